@@ -5,6 +5,9 @@ import numpy as np
 import yaml
 from datetime import datetime, timedelta
 
+import pipeline_metrics
+from parse_journal import load_parsed
+
 def load_config(config_path='rules.yaml'):
     """載入 YAML 配置文件"""
     try:
@@ -25,21 +28,21 @@ def load_config(config_path='rules.yaml'):
             }
         }
 
-def calculate_health_score(df, weights):
-    """
-    計算每日健康分數。
-    分數 = 100 - sum(weight * normalized_count) for each category
-    正規化方式: log(1 + count)
-    """
-    if df.empty:
-        return pd.DataFrame(columns=['date', 'health_score'])
+# 聚合所需的 parsed 欄位
+PARSED_COLUMNS = ['ts_utc', 'message', 'date', 'hour', 'category', 'template_id', 'repeat_count']
 
-    # 確保 date 是 datetime object
-    df['date'] = pd.to_datetime(df['date'])
+def load_templates(io_dir):
+    """parse_journal.py 寫出的 templates.csv, 回傳以 template_id 為 index 的樣板字串"""
+    return pd.read_csv(f"{io_dir}/templates.csv", index_col='template_id', keep_default_na=False)['template']
 
-    # 計算每日各類別的事件總數
-    daily_counts = df.groupby(['date', 'category']).size().unstack(fill_value=0)
-    
+def ts_utc_strings(series):
+    """將 datetime64 的 ts_utc 轉回與 parsed.csv 相同的 ISO 字串"""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series.dt.strftime('%Y-%m-%dT%H:%M:%S+00:00')
+    return series
+
+def health_score_from_daily_counts(daily_counts, weights):
+    """由 date × category 的事件數 (date 為 datetime index) 計算每日健康分數"""
     #正規化 (log(1+x))
     normalized_counts = np.log1p(daily_counts)
     
@@ -58,75 +61,590 @@ def calculate_health_score(df, weights):
     health_df['date'] = health_df['date'].dt.strftime('%Y-%m-%d')
     return health_df
 
-def main():
-    parser = argparse.ArgumentParser(description='從 parsed.csv 聚合指標。')
-    parser.add_argument('--top-k', type=int, default=20, help='Top K 訊息排名的 K 值')
-    parser.add_argument('--window-days', type=int, default=7, help='報告摘要聚焦的最近天數')
-    parser.add_argument('--rules', default='rules.yaml', help='分類規則與權重的 YAML 配置文件')
-    parser.add_argument('--io_dir', default='.', help='輸入與輸出目錄')
-    args = parser.parse_args()
+def health_score_from_counts(counts, weights):
+    """單一時間窗 {category: 事件數} 的健康分數, 公式與 health_score_from_daily_counts 相同"""
+    deduction = sum(float(np.log1p(counts.get(category, 0))) * weight for category, weight in weights.items())
+    return min(max(100 - deduction, 0.0), 100.0)
 
-    input_csv = f"{args.io_dir}/parsed.csv"
-    try:
-        df = pd.read_csv(input_csv)
-    except FileNotFoundError:
-        print(f"錯誤: '{input_csv}' 未找到。請先執行 parse_journal.py。")
+def calculate_health_score(df, weights):
+    """
+    計算每日健康分數。
+    分數 = 100 - sum(weight * normalized_count) for each category
+    正規化方式: log(1 + count)
+    """
+    if df.empty:
+        return pd.DataFrame(columns=['date', 'health_score'])
+
+    # 確保 date 是 datetime object
+    df['date'] = pd.to_datetime(df['date'])
+
+    # 計算每日各類別的事件總數
+    daily_counts = df.groupby(['date', 'category'], observed=True).size().unstack(fill_value=0)
+    return health_score_from_daily_counts(daily_counts, weights)
+
+# summary_last_days.csv 的預設關鍵指標; rules.yaml 的 key_metrics 可覆寫
+# 每個指標以 category 和/或 error_code (訊息中 "return code = N" 的 N) 計數
+DEFAULT_KEY_METRICS = [
+    {'name': 'raid_fw_fault_count', 'category': 'RAID_FW'},
+    {'name': 'fscrypt_error_count', 'category': 'FSCRYPT_EXT4'},
+    {'name': 'cifs_error_95_count', 'error_code': -95},
+    {'name': 'cifs_error_101_count', 'error_code': -101},
+    {'name': 'fwupd_fail_count', 'category': 'FWUPD'},
+    {'name': 'smartd_mail_missing_count', 'category': 'SMARTD_NOTIFY'},
+    {'name': 'sudo_auth_warn_count', 'category': 'SUDO_AUTH'},
+    {'name': 'net_iface_missing_count', 'category': 'NET_IFACE_MISSING'},
+]
+
+# 錯誤碼只擷取一次, 之後的統計都使用 error_code 欄位
+ERROR_CODE_PATTERN = r'return code = (-?\d+)'
+
+def extract_error_code(messages):
+    """以單一 str.extract 取出訊息中的錯誤碼 (Int64, 無錯誤碼時為 NA)"""
+    return pd.to_numeric(messages.str.extract(ERROR_CODE_PATTERN, expand=False)).astype('Int64')
+
+def key_metric_values(key_metrics, category_counts, code_counts):
+    """
+    由摘要視窗內的計數一次算出所有關鍵指標。
+    category_counts: 以 category 為 index 的事件數
+    code_counts: 以 (category, error_code) 為 index 的事件數
+    """
+    values = {}
+    for metric in key_metrics:
+        category = metric.get('category')
+        code = metric.get('error_code')
+        if code is None:
+            count = category_counts.get(category, 0)
+        elif category is None:
+            count = code_counts[code_counts.index.get_level_values('error_code') == code].sum()
+        else:
+            count = code_counts.get((category, code), 0)
+        values[metric['name']] = int(count)
+    return values
+
+def message_groups(df):
+    """以 template_id 分組的 count/first_seen/last_seen/categories"""
+    return df.groupby('template_id').agg(
+        count=('template_id', 'size'),
+        first_seen=('ts_utc', 'min'),
+        last_seen=('ts_utc', 'max'),
+        categories=('category', 'unique')
+    )
+
+def finish_top_messages(grouped, top_k, templates):
+    """grouped 以 template_id 排序, 含 count/first_seen/last_seen/categories 欄位; templates 為樣板字串"""
+    top_messages = grouped.sort_values(by='count', ascending=False).head(top_k)
+    top_messages.insert(0, 'template', templates.reindex(top_messages.index))
+    top_messages['categories'] = top_messages['categories'].map(list)
+    top_messages['first_seen'] = ts_utc_strings(top_messages['first_seen'])
+    top_messages['last_seen'] = ts_utc_strings(top_messages['last_seen'])
+    return top_messages
+
+def epoch_minutes(ts_utc):
+    """ts_utc (datetime64 或 parsed.csv 的 ISO 字串) 轉為 epoch 分鐘數"""
+    if not pd.api.types.is_datetime64_any_dtype(ts_utc):
+        ts_utc = pd.to_datetime(ts_utc.str.slice(0, 19), format='%Y-%m-%dT%H:%M:%S')
+    elif ts_utc.dt.tz is not None:
+        ts_utc = ts_utc.dt.tz_convert(None)
+    return ts_utc.to_numpy().astype('datetime64[m]').astype(np.int64)
+
+# 共現矩陣的預設設定; rules.yaml 的 co_occurrence 可覆寫
+DEFAULT_CO_OCCURRENCE = {'buckets': ['1h'], 'lagged': []}
+
+# 時間長度單位 (分鐘)
+DURATION_UNITS = {'m': 1, 'h': 60, 'd': 1440}
+
+# 0-255 每個位元組的 1 位元數, 用於 bitset 的 popcount
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+def parse_minutes(value):
+    """'5m' / '1h' / '1d' 形式的時間長度轉為分鐘數"""
+    value = str(value).strip()
+    unit = DURATION_UNITS.get(value[-1:])
+    if unit is None or not value[:-1].isdigit():
+        raise ValueError(f"無法解析的時間長度 '{value}' (例如 5m, 1h, 1d)")
+    return int(value[:-1]) * unit
+
+def co_occurrence_file(bucket):
+    """1h 沿用原本的 co_occurrence_hourly.csv, 其餘以 bucket 大小命名"""
+    return {'1h': 'co_occurrence_hourly.csv', '1d': 'co_occurrence_daily.csv'}.get(
+        bucket, f"co_occurrence_{bucket}.csv")
+
+def bucket_sets(minutes, categories, bucket_minutes):
+    """
+    將 (分鐘, 類別) 的出現紀錄轉為 {類別: 排序且不重複的 bucket 編號陣列}。
+    bucket 編號為整數 epoch 分鐘數 // bucket_minutes, 例如 1h 即 epoch // 3600。
+    """
+    categories = pd.Categorical(categories)
+    n = max(len(categories.categories), 1)
+    keys = np.unique(np.asarray(minutes, dtype=np.int64) // bucket_minutes * n + categories.codes)
+    codes = keys % n
+    order = np.argsort(codes, kind='stable')
+    buckets = (keys // n)[order]
+    bounds = np.searchsorted(codes[order], np.arange(n + 1))
+    return {category: buckets[bounds[i]:bounds[i + 1]]
+            for i, category in enumerate(categories.categories) if bounds[i] < bounds[i + 1]}
+
+def co_occurrence_matrix(sets):
+    """
+    以 packed bitset 計算兩兩類別在同一 bucket 出現的次數。
+    每個類別一列 bitset (每個 bucket 1 位元), count[i, j] = popcount(bits[i] & bits[j])。
+    """
+    names = sorted(sets)
+    index = pd.Index(names, name='category')
+    if not names:
+        return pd.DataFrame(index=index, columns=index, dtype=np.int64)
+    low = min(sets[name][0] for name in names)
+    high = max(sets[name][-1] for name in names)
+    nbytes = (high - low) // 8 + 1
+    bits = np.zeros((len(names), nbytes), dtype=np.uint8)
+    for i, name in enumerate(names):
+        offset = sets[name] - low
+        bits[i] = np.bincount(offset >> 3, weights=1 << (7 - (offset & 7)), minlength=nbytes)
+    counts = np.empty((len(names), len(names)), dtype=np.int64)
+    for i in range(len(names)):
+        counts[i] = POPCOUNT[bits[i] & bits].sum(axis=1)
+    return pd.DataFrame(counts, index=index, columns=index)
+
+def selector_minutes(presence, code_presence, selector):
+    """符合 {category, error_code} 條件的出現分鐘 (排序且不重複)"""
+    frame = presence if selector.get('error_code') is None else \
+        code_presence[code_presence['error_code'] == selector['error_code']]
+    if selector.get('category') is not None:
+        frame = frame[frame['category'] == selector['category']]
+    return np.unique(frame['minute'].to_numpy(dtype=np.int64))
+
+def lagged_matches(before, after, within):
+    """after 出現的各分鐘, 其前 within 分鐘內 (含同一分鐘) 是否也有 before 出現"""
+    first = np.searchsorted(before, after - within, side='left')
+    last = np.searchsorted(before, after, side='right')
+    return last > first
+
+def lagged_co_occurrence(before, after, within):
+    """after 出現的分鐘中, 其前 within 分鐘內 (含同一分鐘) 也有 before 出現的數量"""
+    return int(np.count_nonzero(lagged_matches(before, after, within)))
+
+def bucket_size(bucket):
+    """共現 bucket 大小 (分鐘)"""
+    bucket_minutes = parse_minutes(bucket)
+    if bucket_minutes <= 0:
+        raise ValueError(f"共現 bucket 大小必須大於 0: {bucket}")
+    return bucket_minutes
+
+def co_occurrence_outputs(presence, code_presence, co_config):
+    """
+    presence: (minute, category) 的出現紀錄; code_presence: (minute, category, error_code) 的出現紀錄。
+    依 buckets 輸出各 bucket 大小的共現矩陣, 依 lagged 輸出時間差共現 (before 在 after 之前 within 內出現)。
+    """
+    outputs = {}
+    for bucket in co_config.get('buckets', DEFAULT_CO_OCCURRENCE['buckets']):
+        sets = bucket_sets(presence['minute'], presence['category'], bucket_size(bucket))
+        outputs[co_occurrence_file(bucket)] = co_occurrence_matrix(sets)
+
+    lagged = []
+    for rule in co_config.get('lagged', []):
+        within = parse_minutes(rule['within'])
+        before = selector_minutes(presence, code_presence, rule['before'])
+        after = selector_minutes(presence, code_presence, rule['after'])
+        lagged.append({'name': rule['name'], 'within_minutes': within, 'after_minutes': len(after),
+                       'matched_minutes': lagged_co_occurrence(before, after, within)})
+    if lagged:
+        outputs['co_occurrence_lagged.csv'] = pd.DataFrame(lagged)
+    return outputs
+
+# 爆量偵測的預設設定; rules.yaml 的 bursts 可覆寫
+DEFAULT_BURSTS = {'halflife': '1h', 'z': 5.0, 'min_rate': 10, 'merge_gap': '2m'}
+
+BURST_COLUMNS = ['start', 'end', 'category', 'duration_minutes', 'events', 'peak_rate', 'baseline', 'peak_z']
+
+def minute_count_matrix(minutes, categories, counts, first=None):
+    """
+    將 (分鐘, 類別, 事件數) 轉為 minute × category 的事件數矩陣 (涵蓋 first 或第一分鐘到最後一分鐘, 沒有事件的分鐘為 0)。
+    回傳 (第一分鐘, 類別列表, 矩陣); 類別依字母排序 (categories 為 Categorical 時沿用其類別)。
+    矩陣以 column-major 儲存, 每個類別的時間序列是連續的記憶體, 交給 pandas 的 ewm 時不需要複製。
+    """
+    categories = pd.Categorical(categories)
+    minutes = np.asarray(minutes, dtype=np.int64)
+    n = len(categories.categories)
+    if not len(minutes) or not n:
+        return 0, [], np.zeros((0, 0))
+    first = int(minutes.min()) if first is None else first
+    span = int(minutes.max()) - first + 1
+    matrix = np.bincount(categories.codes.astype(np.int64) * span + (minutes - first), weights=np.asarray(counts, dtype=np.float64),
+                         minlength=span * n).reshape(n, span).T
+    return first, list(categories.categories), matrix
+
+def minute_labels(minutes):
+    """epoch 分鐘數轉為與 ts_utc 相同格式的 ISO 字串"""
+    return pd.to_datetime(np.asarray(minutes, dtype=np.int64), unit='m').strftime('%Y-%m-%dT%H:%M:00+00:00')
+
+def ewm_moments(matrix, halflife, initial=None):
+    """
+    每分鐘各類別的 EWMA 平均與平方平均 (變異數 = E[x²] - E[x]²), 一次算完所有類別。
+    initial 為矩陣第一分鐘之前的 (平均, 平方平均) 時由此接續, 結果與從頭計算相同。
+    """
+    moments = []
+    for values, start in zip((matrix, matrix * matrix), initial or (None, None)):
+        if start is not None:
+            values = np.vstack([start, values])
+        ewm = pd.DataFrame(values, copy=False).ewm(halflife=halflife, adjust=False).mean().to_numpy()
+        moments.append(ewm if start is None else ewm[1:])
+    return moments
+
+def hot_minutes(matrix, mean, square_mean, burst_config, initial=None):
+    """
+    z 與事件數都超過門檻的 (類別索引, 分鐘索引, 事件數, baseline, z), 依類別、時間排序。
+    baseline 與變異數只用前一分鐘以前的資料; 第一分鐘用 initial, 沒有時為 0。
+    """
+    # 只有事件數達 min_rate 的分鐘需要計算 z
+    category_index, minute_index = np.nonzero((matrix >= float(burst_config['min_rate'])).T)
+    first_mean, first_square = initial or (np.zeros(matrix.shape[1]), np.zeros(matrix.shape[1]))
+    previous = np.maximum(minute_index - 1, 0)
+    has_previous = minute_index > 0
+    baseline = np.where(has_previous, mean[previous, category_index], first_mean[category_index])
+    square = np.where(has_previous, square_mean[previous, category_index], first_square[category_index])
+    variance = np.maximum(square - baseline ** 2, 0.0)
+    count = matrix[minute_index, category_index]
+    z = (count - baseline) / np.sqrt(np.maximum(variance, baseline) + 1)
+    hot = z >= float(burst_config['z'])
+    return category_index[hot], minute_index[hot], count[hot], baseline[hot], z[hot]
+
+def burst_segments(category_index, minute_index, count, baseline, z, merge_gap):
+    """
+    依類別、時間排序的爆量分鐘, 同類別且間隔不超過 merge_gap 者合併為一段。
+    回傳各段的 (類別索引, 起始分鐘, 結束分鐘, 最高事件數, 起始 baseline, 最高 z)。
+    """
+    breaks = np.flatnonzero((np.diff(category_index) != 0) | (np.diff(minute_index) > merge_gap + 1)) + 1
+    starts = np.concatenate([[0], breaks])
+    ends = np.concatenate([breaks, [len(minute_index)]]) - 1
+    return (category_index[starts], minute_index[starts], minute_index[ends],
+            np.maximum.reduceat(count, starts), baseline[starts], np.maximum.reduceat(z, starts))
+
+def bursts_frame(first_minute, categories, segments, events):
+    """burst_segments 的結果與各段 (含段內未達門檻的分鐘) 的事件總數轉為 bursts.csv"""
+    column, start_minute, end_minute, peak_rate, baseline, peak_z = segments
+    bursts = pd.DataFrame({
+        'start': minute_labels(first_minute + start_minute),
+        'end': minute_labels(first_minute + end_minute),
+        'category': np.asarray(categories, dtype=object)[column],
+        'duration_minutes': end_minute - start_minute + 1,
+        'events': np.asarray(events).astype(np.int64),
+        'peak_rate': peak_rate.astype(np.int64),
+        'baseline': np.round(baseline, 2),
+        'peak_z': np.round(peak_z, 2),
+    })
+    return bursts.sort_values(['start', 'category'], kind='stable').reset_index(drop=True)
+
+def detect_bursts(first_minute, categories, matrix, burst_config=DEFAULT_BURSTS):
+    """
+    以 EWMA 為每分鐘各類別的基準, 一次計算所有類別的 z-score:
+    z = (count - baseline) / sqrt(max(EWMA 變異數, baseline) + 1), baseline 與變異數只用前一分鐘以前的資料
+    (以 baseline 作為變異數下限, 即 Poisson 假設, 避免稀少類別的偶發事件被放大)。
+    z 與事件數都超過門檻的分鐘為爆量, 間隔不超過 merge_gap 的爆量分鐘合併為一段。
+    """
+    if not matrix.size:
+        return pd.DataFrame(columns=BURST_COLUMNS)
+    mean, square_mean = ewm_moments(matrix, parse_minutes(burst_config['halflife']))
+    hot = hot_minutes(matrix, mean, square_mean, burst_config)
+    if not len(hot[0]):
+        return pd.DataFrame(columns=BURST_COLUMNS)
+    segments = burst_segments(*hot, parse_minutes(burst_config['merge_gap']))
+
+    # 各段 (含段內未達門檻的分鐘) 的事件總數
+    column, start_minute, end_minute = segments[:3]
+    lengths = end_minute - start_minute + 1
+    offsets = np.cumsum(lengths) - lengths
+    rows = np.repeat(start_minute - offsets, lengths) + np.arange(lengths.sum())
+    events = np.add.reduceat(matrix[rows, np.repeat(column, lengths)], offsets)
+    return bursts_frame(first_minute, categories, segments, events)
+
+def pair_count_matrix(pairs):
+    """store 中 (category_a, category_b, count) 的共現計數轉為與 co_occurrence_matrix 相同的矩陣"""
+    index = pd.Index(sorted(pairs['category_a'].unique()), name='category')
+    if not len(index):
+        return pd.DataFrame(index=index, columns=index, dtype=np.int64)
+    matrix = pairs.pivot(index='category_a', columns='category_b', values='count')
+    return matrix.reindex(index=index, columns=index).fillna(0).astype(np.int64)
+
+def update_co_occurrence_state(store, bucket_minutes):
+    """
+    將新資料涉及的 bucket 併入 store 的共現計數:
+    這些 bucket 的新、舊出現紀錄各算一次共現矩陣, 只將差值加進 store。
+    """
+    name = f"co_occurrence:{bucket_minutes}"
+    changed = store.changed_range(name)
+    if changed is None:
         return
+    first, last = changed[0] // bucket_minutes, changed[1] // bucket_minutes
+    presence = store.minute_presence(first * bucket_minutes, (last + 1) * bucket_minutes - 1)
+    sets = bucket_sets(presence['minute'], presence['category'], bucket_minutes)
+    old = store.bucket_presence(bucket_minutes, first, last)
+    delta = co_occurrence_matrix(sets).sub(
+        co_occurrence_matrix(bucket_sets(old['bucket'], old['category'], 1)), fill_value=0)
+    store.update_co_occurrence(bucket_minutes, sets, delta)
+    store.mark_state(name)
 
-    config = load_config(args.rules)
-    weights = config.get('weights', {})
+def update_lagged_state(store, rule, within):
+    """重算新資料涉及的 after 分鐘 (變動分鐘到其後 within 分鐘) 是否有 before 在前"""
+    name = f"lagged:{rule['name']}"
+    changed = store.changed_range(name, rule)
+    if changed is None:
+        return
+    start, end = changed[0], changed[1] + within
+    before = store.selector_minutes(rule['before'], start - within, end)
+    after = store.selector_minutes(rule['after'], start, end)
+    store.replace_lagged(rule['name'], start, end, after, lagged_matches(before, after, within))
+    store.mark_state(name, rule)
+
+def update_burst_state(store, burst_config):
+    """
+    由新資料最早的分鐘之前最近的 EWMA checkpoint 接續計算, 只重算其後的分鐘:
+    更新這段期間的爆量分鐘, 並在每小時結尾與最後一分鐘留下新的 checkpoint。
+    沒有可用的 checkpoint (第一次建立、設定改變或新資料早於既有資料) 時從頭計算。
+    """
+    changed = store.changed_range('bursts', burst_config)
+    if changed is None:
+        return
+    checkpoint, state = store.burst_checkpoint(changed[0])
+    counts = store.minute_counts(None if checkpoint is None else checkpoint + 1)
+    categories = pd.Categorical(counts['category'], categories=sorted(set(counts['category']) | set(state)))
+    first, categories, matrix = minute_count_matrix(
+        counts['minute'], categories, counts['count'], None if checkpoint is None else checkpoint + 1)
+    initial = None
+    if checkpoint is not None:
+        initial = tuple(np.array([state.get(category, (0.0, 0.0))[i] for category in categories]) for i in (0, 1))
+
+    mean, square_mean = ewm_moments(matrix, parse_minutes(burst_config['halflife']), initial)
+    category_index, minute_index, count, baseline, z = hot_minutes(matrix, mean, square_mean, burst_config, initial)
+    hot = pd.DataFrame({'minute': first + minute_index, 'category': np.asarray(categories, dtype=object)[category_index],
+                        'count': count.astype(np.int64), 'baseline': baseline, 'z': z})
+    rows = np.flatnonzero((first + np.arange(len(matrix)) + 1) % 60 == 0)
+    rows = np.union1d(rows, [len(matrix) - 1])
+    checkpoints = pd.DataFrame({
+        'minute': np.repeat(first + rows, len(categories)),
+        'category': np.tile(np.asarray(categories, dtype=object), len(rows)),
+        'mean': mean[rows].ravel(), 'square_mean': square_mean[rows].ravel()})
+    store.replace_bursts(first, hot, checkpoints)
+    store.mark_state('bursts', burst_config)
+
+def bursts_from_store(store, burst_config):
+    """由 store 中的爆量分鐘合併爆量區段, 各段的事件總數由每分鐘事件數加總"""
+    update_burst_state(store, burst_config)
+    hot = store.burst_minutes()
+    if hot.empty:
+        return pd.DataFrame(columns=BURST_COLUMNS)
+    categories = pd.Categorical(hot['category'])
+    segments = burst_segments(categories.codes.astype(np.int64), hot['minute'].to_numpy(), hot['count'].to_numpy(),
+                              hot['baseline'].to_numpy(), hot['z'].to_numpy(), parse_minutes(burst_config['merge_gap']))
+    column, start_minute, end_minute = segments[:3]
+    events = store.segment_events(categories.categories[column], start_minute, end_minute)
+    return bursts_frame(0, categories.categories, segments, events)
+
+def co_occurrence_outputs_from_store(store, co_config):
+    """與 co_occurrence_outputs 相同的輸出, 由 store 中增量維護的共現狀態取得"""
+    outputs = {}
+    for bucket in co_config.get('buckets', DEFAULT_CO_OCCURRENCE['buckets']):
+        bucket_minutes = bucket_size(bucket)
+        update_co_occurrence_state(store, bucket_minutes)
+        outputs[co_occurrence_file(bucket)] = pair_count_matrix(store.co_occurrence_counts(bucket_minutes))
+
+    lagged = []
+    for rule in co_config.get('lagged', []):
+        within = parse_minutes(rule['within'])
+        update_lagged_state(store, rule, within)
+        after_minutes, matched_minutes = store.lagged_totals(rule['name'])
+        lagged.append({'name': rule['name'], 'within_minutes': within, 'after_minutes': after_minutes,
+                       'matched_minutes': matched_minutes})
+    if lagged:
+        outputs['co_occurrence_lagged.csv'] = pd.DataFrame(lagged)
+    return outputs
+
+def summary_report_from_metrics(key_metrics):
+    summary_report = pd.DataFrame([key_metrics]).T.reset_index()
+    summary_report.columns = ['metric', 'value']
+    return summary_report
+
+def compute_outputs(df, weights, top_k, window_days, templates, key_metrics=DEFAULT_KEY_METRICS,
+                    co_config=DEFAULT_CO_OCCURRENCE, burst_config=DEFAULT_BURSTS):
+    """由完整的 parsed 資料計算所有輸出, 回傳 {檔名: DataFrame}"""
+    outputs = {}
+    step = pipeline_metrics.step
 
     # 1. 每日指標
-    metrics_daily = df.groupby(['date', 'category']).size().reset_index(name='count')
-    metrics_daily.to_csv(f"{args.io_dir}/metrics_daily.csv", index=False)
+    with step('metrics_daily'):
+        outputs['metrics_daily.csv'] = df.groupby(['date', 'category'], observed=True).size().reset_index(name='count')
 
     # 2. 每小時指標
-    metrics_hourly = df.groupby(['hour', 'category']).size().reset_index(name='count')
-    metrics_hourly.to_csv(f"{args.io_dir}/metrics_hourly.csv", index=False)
+    with step('metrics_hourly'):
+        outputs['metrics_hourly.csv'] = df.groupby(['hour', 'category'], observed=True).size().reset_index(name='count')
 
     # 3. Top K 訊息
-    df['message_key'] = df['message'].str.slice(0, 120)
-    top_messages = df.groupby('message_key').agg(
-        count=('message_key', 'size'),
-        first_seen=('ts_utc', 'min'),
-        last_seen=('ts_utc', 'max'),
-        categories=('category', lambda x: list(x.unique()))
-    ).sort_values(by='count', ascending=False).head(args.top_k)
-    top_messages.to_csv(f"{args.io_dir}/top_messages.csv")
+    with step('top_messages'):
+        outputs['top_messages.csv'] = finish_top_messages(message_groups(df), top_k, templates)
+
+    # 錯誤碼 (CIFS -95/-101 等) 的每日統計, 供圖表與報告使用
+    with step('error_codes'):
+        df['error_code'] = extract_error_code(df['message'])
+        outputs['error_codes_daily.csv'] = (
+            df.dropna(subset=['error_code'])
+            .groupby(['date', 'category', 'error_code'], observed=True).size().reset_index(name='count'))
 
     # 4. 共現矩陣
-    df['date_hour'] = pd.to_datetime(df['ts_utc']).dt.strftime('%Y-%m-%d %H')
-    hourly_presence = df.groupby(['date_hour', 'category']).size().unstack(fill_value=0)
-    hourly_presence[hourly_presence > 0] = 1
-    co_occurrence = hourly_presence.T.dot(hourly_presence)
-    co_occurrence.to_csv(f"{args.io_dir}/co_occurrence_hourly.csv")
+    with step('co_occurrence'):
+        df['minute'] = epoch_minutes(df['ts_utc'])
+        presence = df[['minute', 'category']].drop_duplicates()
+        code_presence = df.loc[df['error_code'].notna(), ['minute', 'category', 'error_code']].drop_duplicates()
+        outputs.update(co_occurrence_outputs(presence, code_presence, co_config))
+
+    # 每分鐘各類別的爆量 (事件數包含合併的重複次數)
+    with step('bursts'):
+        counts = df['repeat_count'] if 'repeat_count' in df else np.ones(len(df))
+        outputs['bursts.csv'] = detect_bursts(*minute_count_matrix(df['minute'], df['category'], counts), burst_config)
 
     # 5. 健康分數
-    health_df = calculate_health_score(df, weights)
-    health_df.to_csv(f"{args.io_dir}/health_score.csv", index=False)
+    with step('health_score'):
+        outputs['health_score.csv'] = calculate_health_score(df, weights)
 
     # 6. 關鍵指標摘要
-    df['date'] = pd.to_datetime(df['date'])
-    end_date = df['date'].max()
-    start_date = end_date - timedelta(days=args.window_days - 1)
-    summary_df = df[df['date'] >= start_date]
-
-    key_metrics = {
-        'raid_fw_fault_count': summary_df[summary_df['category'] == 'RAID_FW'].shape[0],
-        'fscrypt_error_count': summary_df[summary_df['category'] == 'FSCRYPT_EXT4'].shape[0],
-        'cifs_error_95_count': summary_df[summary_df['message'].str.contains('return code = -95', na=False)].shape[0],
-        'cifs_error_101_count': summary_df[summary_df['message'].str.contains('return code = -101', na=False)].shape[0],
-        'fwupd_fail_count': summary_df[summary_df['category'] == 'FWUPD'].shape[0],
-        'smartd_mail_missing_count': summary_df[summary_df['category'] == 'SMARTD_NOTIFY'].shape[0],
-        'sudo_auth_warn_count': summary_df[summary_df['category'] == 'SUDO_AUTH'].shape[0],
-        'net_iface_missing_count': summary_df[summary_df['category'] == 'NET_IFACE_MISSING'].shape[0],
-    }
-    summary_report = pd.DataFrame([key_metrics]).T.reset_index()
-    summary_report.columns = ['metric', 'value']
-    summary_report.to_csv(f"{args.io_dir}/summary_last_days.csv", index=False)
+    with step('summary'):
+        df['date'] = pd.to_datetime(df['date'])
+        end_date = df['date'].max()
+        start_date = end_date - timedelta(days=window_days - 1)
+        summary_df = df[df['date'] >= start_date]
+
+        outputs['summary_last_days.csv'] = summary_report_from_metrics(key_metric_values(
+            key_metrics,
+            summary_df['category'].value_counts(),
+            summary_df.groupby(['category', 'error_code'], observed=True).size()))
+    return outputs
+
+def compute_outputs_from_store(store, weights, top_k, window_days, templates, key_metrics=DEFAULT_KEY_METRICS,
+                               co_config=DEFAULT_CO_OCCURRENCE, burst_config=DEFAULT_BURSTS):
+    """由 rollup store 的彙總表計算所有輸出, 結果與 compute_outputs 相同"""
+    outputs = {}
+
+    # 1. 每日指標 / 2. 每小時指標
+    metrics_daily = store.daily_counts()
+    outputs['metrics_daily.csv'] = metrics_daily
+    outputs['metrics_hourly.csv'] = store.hourly_counts()
+
+    # 3. Top K 訊息
+    outputs['top_messages.csv'] = finish_top_messages(store.message_groups(), top_k, templates)
+
+    error_codes = store.error_code_counts()
+    outputs['error_codes_daily.csv'] = error_codes
+
+    # 4. 共現矩陣與爆量: 只重算新資料涉及的 bucket 與分鐘, 其餘沿用 store 中的狀態
+    outputs.update(co_occurrence_outputs_from_store(store, co_config))
+    outputs['bursts.csv'] = bursts_from_store(store, burst_config)
+
+    # 5. 健康分數
+    daily = metrics_daily.assign(date=pd.to_datetime(metrics_daily['date']))
+    if daily.empty:
+        outputs['health_score.csv'] = pd.DataFrame(columns=['date', 'health_score'])
+    else:
+        daily_counts = daily.set_index(['date', 'category'])['count'].unstack(fill_value=0)
+        outputs['health_score.csv'] = health_score_from_daily_counts(daily_counts, weights)
+
+    # 6. 關鍵指標摘要
+    end_date = daily['date'].max()
+    start_date = end_date - timedelta(days=window_days - 1)
+    window = daily[daily['date'] >= start_date]
+    window_codes = error_codes[pd.to_datetime(error_codes['date']) >= start_date]
+    outputs['summary_last_days.csv'] = summary_report_from_metrics(key_metric_values(
+        key_metrics,
+        window.groupby('category')['count'].sum(),
+        window_codes.groupby(['category', 'error_code'])['count'].sum()))
+    return outputs
+
+def write_outputs(outputs, io_dir):
+    for name, frame in outputs.items():
+        # top_messages 與共現矩陣以 index 作為第一欄
+        matrix = name.startswith('co_occurrence_') and name != 'co_occurrence_lagged.csv'
+        frame.to_csv(f"{io_dir}/{name}", index=matrix or name == 'top_messages.csv')
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='從 parsed.csv 聚合指標。')
+    parser.add_argument('--top-k', type=int, default=20, help='Top K 訊息排名的 K 值')
+    parser.add_argument('--window-days', type=int, default=7, help='報告摘要聚焦的最近天數')
+    parser.add_argument('--rules', default='rules.yaml', help='分類規則與權重的 YAML 配置文件')
+    parser.add_argument('--io_dir', default='.', help='輸入與輸出目錄')
+    parser.add_argument('--rollup-db', help='增量彙總用的 SQLite 檔案; 只併入 parsed.csv 新增的列')
+    parser.add_argument('--rebuild', action='store_true', help='清空 rollup store 後從頭重新彙總')
+    parser.add_argument('--verify', action='store_true', help='比對 rollup store 的輸出與完整重算的結果')
+    parser.add_argument('--metrics', action='store_true', help='記錄各子步驟的耗時到 io_dir/pipeline_metrics.json')
+    parser.add_argument('--profile', choices=pipeline_metrics.PROFILERS, help='另外輸出此階段的 profile (需要 --metrics)')
+    return parser
+
+def run(args, config, df=None):
+    """
+    聚合指標並寫出各 CSV, 回傳 {檔名: DataFrame} (失敗時為 None)。
+    df 為已在記憶體中的 parsed 資料時直接使用, 不再讀取 parsed.csv (使用 rollup store 時除外)。
+    """
+    pipeline_metrics.setup(args.io_dir if args.metrics else None, args.profile)
+    with pipeline_metrics.stage('aggregate'):
+        return aggregate(args, config, df)
+
+def aggregate(args, config, df):
+    weights = config.get('weights', {})
+    key_metrics = config.get('key_metrics') or DEFAULT_KEY_METRICS
+    co_config = config.get('co_occurrence') or DEFAULT_CO_OCCURRENCE
+    burst_config = {**DEFAULT_BURSTS, **(config.get('bursts') or {})}
+
+    input_csv = f"{args.io_dir}/parsed.csv"
+    try:
+        templates = load_templates(args.io_dir)
+    except FileNotFoundError:
+        print(f"錯誤: '{args.io_dir}/templates.csv' 未找到。請先執行 parse_journal.py。")
+        return None
+
+    if args.rollup_db:
+        import rollup_store
+        try:
+            with rollup_store.RollupStore(args.rollup_db, ERROR_CODE_PATTERN) as store:
+                if args.rebuild:
+                    store.reset()
+                with pipeline_metrics.step('rollup_fold'):
+                    folded = store.fold_csv(input_csv)
+                pipeline_metrics.set_counter('rows', folded)
+                print(f"已併入 {folded} 筆新資料至 {args.rollup_db}。")
+                with pipeline_metrics.step('compute_outputs_from_store'):
+                    outputs = compute_outputs_from_store(store, weights, args.top_k, args.window_days, templates,
+                                                         key_metrics, co_config, burst_config)
+        except FileNotFoundError:
+            print(f"錯誤: '{input_csv}' 未找到。請先執行 parse_journal.py。")
+            return None
+
+        if args.verify:
+            # 完整重算的子步驟也會計入同名的 steps
+            expected = compute_outputs(load_parsed(args.io_dir, PARSED_COLUMNS), weights, args.top_k, args.window_days,
+                                       templates, key_metrics, co_config, burst_config)
+            mismatched = [name for name in expected if expected[name].to_csv() != outputs[name].to_csv()]
+            if mismatched:
+                print(f"錯誤: rollup store 的輸出與完整重算不一致: {', '.join(mismatched)}")
+                return None
+            print("驗證通過: rollup store 的輸出與完整重算一致。")
+    else:
+        if df is None:
+            try:
+                with pipeline_metrics.step('load_parsed'):
+                    df = load_parsed(args.io_dir, PARSED_COLUMNS)
+            except FileNotFoundError:
+                print(f"錯誤: '{input_csv}' 未找到。請先執行 parse_journal.py。")
+                return None
+        pipeline_metrics.set_counter('rows', len(df))
+        outputs = compute_outputs(df, weights, args.top_k, args.window_days, templates, key_metrics, co_config,
+                                  burst_config)
+
+    with pipeline_metrics.step('write_outputs'):
+        write_outputs(outputs, args.io_dir)
 
     print("指標聚合完成。輸出文件已儲存至 " + args.io_dir)
     print("正規化方式: log(1 + count)")
+    return outputs
+
+def main():
+    args = build_parser().parse_args()
+    run(args, load_config(args.rules))
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,268 @@
+# bench_report.py
+"""
+日誌分析工具鏈的效能測試。
+以 synth_journal.py 產生可重現的合成日誌, 依各個行數分別量測:
+- parse_log_line / classify_message / MessageClassifier / TemplateMiner 的單獨耗時
+- parse_journal.main 的完整解析
+- aggregate_metrics.py 的各個聚合步驟
+- plot_reports.py 的各個 plot_* 函式與 report.md
+結果寫成 JSON (含 commit 與環境資訊), 可用 --compare 與其他 commit 的結果比較。
+
+    python3 bench_report.py --sizes 10k,1m,10m
+    python3 bench_report.py --sizes 10k --compare bench_abc1234.json
+    python3 bench_report.py --compare bench_abc1234.json bench_def5678.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+import pandas as pd
+import yaml
+
+import aggregate_metrics
+import parse_journal
+import plot_reports
+import synth_journal
+import template_miner
+
+@contextlib.contextmanager
+def quiet():
+    """各階段的 print 不列入輸出"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+@contextlib.contextmanager
+def patched_argv(argv):
+    saved = sys.argv
+    sys.argv = argv
+    try:
+        yield
+    finally:
+        sys.argv = saved
+
+def timed(results, size, name, func, items=None):
+    """執行 func 並記錄 wall/CPU 時間; items 為處理的筆數 (用於計算每秒筆數)"""
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    with quiet():
+        value = func()
+    wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+    result = {'size': size, 'name': name, 'seconds': round(wall, 6), 'cpu_seconds': round(cpu, 6)}
+    rate = ''
+    if items:
+        result['items'] = items
+        result['per_second'] = round(items / wall, 1) if wall else None
+        rate = f" {items / wall:12,.0f}/s" if wall else ''
+    results.append(result)
+    print(f"  {name:<44} {wall:9.3f}s{rate}")
+    return value
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def synth_log(args, size):
+    """產生 (或沿用已產生的) 合成日誌"""
+    path = os.path.join(args.workdir, f"synth_{size}_b{args.boots}_r{args.burst_rate}_s{args.seed}.log")
+    if not os.path.exists(path):
+        print(f"產生 {size:,} 行的合成日誌: {path}")
+        synth_journal.write_journal(path + '.tmp', size, boots=args.boots, burst_rate=args.burst_rate, seed=args.seed)
+        os.replace(path + '.tmp', path)
+    return path
+
+def bench_micro(results, size, log_path, config, limit):
+    """單一函式的耗時, 最多使用 limit 行"""
+    with open(log_path, 'r', encoding='utf-8') as f:
+        lines = [line for _, line in zip(range(limit), f)]
+    categories = config.get('categories', {})
+
+    parse_journal.convert_timestamp.cache_clear()
+    entries = timed(results, size, 'parse_log_line',
+                    lambda: [parse_journal.parse_log_line(line.strip(), '+0900') for line in lines], len(lines))
+    messages = [entry['message'] for entry in entries if entry]
+
+    expected = timed(results, size, 'classify_message',
+                     lambda: [parse_journal.classify_message(message, categories) for message in messages], len(messages))
+    classifier = parse_journal.MessageClassifier(categories)
+    actual = timed(results, size, 'MessageClassifier',
+                   lambda: [classifier(message) for message in messages], len(messages))
+    mismatched = sum(1 for a, b in zip(expected, actual) if a != b)
+    if mismatched:
+        print(f"  警告: MessageClassifier 與 classify_message 有 {mismatched} 筆分類不一致")
+    template_miner.tokenize.cache_clear()
+    miner = parse_journal.template_miner(config)
+    timed(results, size, 'TemplateMiner.add', lambda: [miner.add(message) for message in messages], len(messages))
+
+def bench_parse(results, size, log_path, out_dir, args):
+    argv = ['parse_journal.py', log_path, '--rules', args.rules, '--output_dir', out_dir,
+            '--workers', str(args.parse_workers)]
+    with patched_argv(argv):
+        timed(results, size, 'parse_journal.main', parse_journal.main, size)
+
+def bench_aggregate(results, size, out_dir, config, args):
+    """依 compute_outputs 的順序量測各個聚合步驟, 最後量測整體"""
+    am = aggregate_metrics
+    weights = config.get('weights', {})
+    key_metrics = config.get('key_metrics') or am.DEFAULT_KEY_METRICS
+    co_config = config.get('co_occurrence') or am.DEFAULT_CO_OCCURRENCE
+    burst_config = {**am.DEFAULT_BURSTS, **(config.get('bursts') or {})}
+    templates = am.load_templates(out_dir)
+
+    df = timed(results, size, 'aggregate.load_parsed', lambda: am.load_parsed(out_dir, am.PARSED_COLUMNS))
+    rows = len(df)
+    timed(results, size, 'aggregate.metrics_daily',
+          lambda: df.groupby(['date', 'category'], observed=True).size().reset_index(name='count'), rows)
+    timed(results, size, 'aggregate.metrics_hourly',
+          lambda: df.groupby(['hour', 'category'], observed=True).size().reset_index(name='count'), rows)
+    timed(results, size, 'aggregate.top_messages',
+          lambda: am.finish_top_messages(am.message_groups(df), args.top_k, templates), rows)
+
+    def error_codes():
+        df['error_code'] = am.extract_error_code(df['message'])
+        return df.dropna(subset=['error_code']).groupby(['date', 'category', 'error_code'], observed=True).size()
+    timed(results, size, 'aggregate.error_codes', error_codes, rows)
+
+    def co_occurrence():
+        df['minute'] = am.epoch_minutes(df['ts_utc'])
+        presence = df[['minute', 'category']].drop_duplicates()
+        code_presence = df.loc[df['error_code'].notna(), ['minute', 'category', 'error_code']].drop_duplicates()
+        return am.co_occurrence_outputs(presence, code_presence, co_config)
+    timed(results, size, 'aggregate.co_occurrence', co_occurrence, rows)
+    timed(results, size, 'aggregate.bursts',
+          lambda: am.detect_bursts(*am.minute_count_matrix(df['minute'], df['category'], df['repeat_count']),
+                                   burst_config), rows)
+    timed(results, size, 'aggregate.health_score', lambda: am.calculate_health_score(df, weights), rows)
+
+    def summary():
+        window = df[df['date'] >= df['date'].max() - pd.Timedelta(days=args.window_days - 1)]
+        return am.key_metric_values(key_metrics, window['category'].value_counts(),
+                                    window.groupby(['category', 'error_code'], observed=True).size())
+    timed(results, size, 'aggregate.summary', summary, rows)
+
+    full_df = am.load_parsed(out_dir, am.PARSED_COLUMNS)
+    return timed(results, size, 'aggregate.compute_outputs',
+                 lambda: am.compute_outputs(full_df, weights, args.top_k, args.window_days, templates,
+                                            key_metrics, co_config, burst_config), rows)
+
+def bench_plots(results, size, out_dir, outputs, config, args):
+    """各個 plot_* 函式 (於目前的 process 中依序執行) 與 report.md"""
+    plot_dir = os.path.join(out_dir, 'plots')
+    os.makedirs(plot_dir, exist_ok=True)
+    parsed_df = plot_reports.load_parsed(out_dir, plot_reports.PARSED_COLUMNS)
+    parsed_df['date'] = pd.to_datetime(parsed_df['date'])
+    heatmap_order = config.get('heatmap_order') or outputs['metrics_daily.csv'].groupby(
+        'category')['count'].sum().sort_values(ascending=False).index.tolist()
+
+    timed(results, size, 'plot.import_plotting', plot_reports.import_plotting)
+    for _, func, chart_args in plot_reports.chart_specs(outputs, parsed_df, heatmap_order,
+                                                        config.get('heatmap_palette')):
+        timed(results, size, f'plot.{func.__name__}', lambda: plot_reports.render_chart(func, chart_args, plot_dir))
+    timed(results, size, 'plot.generate_report',
+          lambda: plot_reports.generate_report(outputs['summary_last_days.csv'], args.window_days, parsed_df,
+                                               outputs['error_codes_daily.csv'], plot_dir, outputs['bursts.csv']))
+
+def bench_rules(args):
+    """
+    各階段共用的規則文件; 沒有 categories 時補上 parse_journal 的預設分類規則,
+    否則所有訊息都歸為 OTHER, 無法反映分類的成本。
+    """
+    config = dict(parse_journal.load_config(args.rules) or {})
+    if not config.get('categories'):
+        config['categories'] = parse_journal.DEFAULT_CATEGORIES
+    path = os.path.join(args.workdir, 'bench_rules.yaml')
+    with open(path, 'w', encoding='utf-8') as f:
+        yaml.safe_dump(config, f, allow_unicode=True, sort_keys=False)
+    return config, path
+
+def run_benchmarks(args):
+    config, args.rules = bench_rules(args)
+    results = []
+    for size in args.sizes:
+        log_path = synth_log(args, size)
+        out_dir = os.path.join(args.workdir, f"out_{size}")
+        os.makedirs(out_dir, exist_ok=True)
+        print(f"--- {size:,} 行 ---")
+        bench_micro(results, size, log_path, config, min(size, args.micro_lines))
+        bench_parse(results, size, log_path, out_dir, args)
+        outputs = bench_aggregate(results, size, out_dir, config, args)
+        if not args.skip_plots:
+            bench_plots(results, size, out_dir, outputs, config, args)
+
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'options': {'boots': args.boots, 'burst_rate': args.burst_rate, 'seed': args.seed,
+                        'micro_lines': args.micro_lines, 'parse_workers': args.parse_workers},
+        },
+        'results': results,
+    }
+
+def compare(old, new, threshold):
+    """依 (size, name) 比較兩份結果; 變慢或變快超過 threshold 的項目加上標記"""
+    old_times = {(r['size'], r['name']): r['seconds'] for r in old['results']}
+    print(f"比較 {old['meta'].get('commit')} → {new['meta'].get('commit')}")
+    print(f"{'size':>10}  {'name':<44} {'old':>9} {'new':>9} {'ratio':>7}")
+    for r in new['results']:
+        before = old_times.get((r['size'], r['name']))
+        if not before:
+            continue
+        ratio = r['seconds'] / before
+        mark = '  slower' if ratio > 1 + threshold else '  faster' if ratio < 1 - threshold else ''
+        print(f"{r['size']:>10,}  {r['name']:<44} {before:9.3f} {r['seconds']:9.3f} {ratio:7.2f}{mark}")
+
+def load_results(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='日誌分析工具鏈的效能測試。')
+    parser.add_argument('--sizes', default='10k,1m,10m',
+                        type=lambda text: [synth_journal.parse_size(s) for s in text.split(',')],
+                        help='合成日誌的行數, 以逗號分隔')
+    parser.add_argument('--rules', default='rules.yaml', help='分類規則與權重的 YAML 配置文件')
+    parser.add_argument('--workdir', default='bench_work', help='合成日誌與各階段輸出的目錄')
+    parser.add_argument('--output', help='結果 JSON 文件 (預設為 bench_<commit>.json)')
+    parser.add_argument('--boots', type=int, default=5, help='合成日誌的 Boot 次數')
+    parser.add_argument('--burst-rate', type=float, default=0.01, help='合成日誌中重複爆量的機率')
+    parser.add_argument('--seed', type=int, default=0, help='合成日誌的亂數種子')
+    parser.add_argument('--micro-lines', type=synth_journal.parse_size, default=1000000,
+                        help='單一函式量測最多使用的行數')
+    parser.add_argument('--parse-workers', type=int, default=1, help='parse_journal.main 的 --workers')
+    parser.add_argument('--top-k', type=int, default=20, help='Top K 訊息排名的 K 值')
+    parser.add_argument('--window-days', type=int, default=7, help='報告摘要聚焦的最近天數')
+    parser.add_argument('--skip-plots', action='store_true', help='不量測圖表')
+    parser.add_argument('--compare', nargs='+', metavar='JSON',
+                        help='與先前的結果比較; 給兩個文件時只比較不執行')
+    parser.add_argument('--threshold', type=float, default=0.1, help='比較時標記變化的比例門檻')
+    return parser
+
+def main():
+    args = build_parser().parse_args()
+    if args.compare and len(args.compare) == 2:
+        compare(load_results(args.compare[0]), load_results(args.compare[1]), args.threshold)
+        return
+
+    os.makedirs(args.workdir, exist_ok=True)
+    report = run_benchmarks(args)
+    output = args.output or f"bench_{report['meta']['commit'] or 'local'}.json"
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"結果已儲存至 {output}")
+    if args.compare:
+        compare(load_results(args.compare[0]), report, args.threshold)
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,14 @@
 #!/usr/bin/env bash
 #
-# consolidate_reports.sh (v10.1 - Bugfix)
+# consolidate_reports.sh (v10.2 - Bugfix)
 #
 # Reads multiple server_health_full.sh JSON outputs (and their corresponding
 # .log files) to generate a comprehensive, auditable Markdown report.
 #
+# v10.2 Changelog:
+# - Fixed the missing 'done' of the summary table loop (the script did not parse).
+# - Default UPS_REPORT_HOST_IDX to -1 (no UPS report) instead of failing under set -u.
+# - Declared the UPS_SUB_* associative arrays used for UPS sub-items.
 # v10.1 Changelog:
 # - Fixed syntax errors in get_suggestions (extra ';;') and UPS pre-scan loop.
 # v10 Changelog:
@@ -16,6 +20,13 @@ LC_ALL=C
 
 # --- Script Configuration & Constants ---
 
+# Optional history index (health_index.py, next to this script). When HEALTH_INDEX_DB
+# is set, the reports are ingested into it and all items are read back in one query.
+: "${HEALTH_INDEX_PY:=$(dirname "$(readlink -f "${BASH_SOURCE[0]}")")/health_index.py}"
+: "${HEALTH_INDEX_DB:=}"
+# Index of the UPS report among the inputs (-1: none)
+: "${UPS_REPORT_HOST_IDX:=-1}"
+
 # --- Helper Functions ---
 
 ensure_command() {
@@ -26,6 +37,35 @@ ensure_command() {
   fi
 }
 
+status_icon() {
+  case "$1" in
+    PASS) echo "🟢";;
+    WARN) echo "🟡";;
+    FAIL) echo "🔴";;
+    SKIP|N/A) echo "⚪️";;
+    *) echo "🔵";;
+  esac
+}
+
+health_index_available() {
+  [[ -n "$HEALTH_INDEX_DB" && -f "$HEALTH_INDEX_PY" ]] && command -v python3 >/dev/null 2>&1
+}
+
+# Reads NUL-separated 'file index, host, item id, status, reason, tips' records
+# written by 'health_index.py items'
+load_from_index() {
+  local file_idx host item_id status reason tips key
+  while IFS= read -r -d '' file_idx && IFS= read -r -d '' host && IFS= read -r -d '' item_id \
+        && IFS= read -r -d '' status && IFS= read -r -d '' reason && IFS= read -r -d '' tips; do
+    HOSTNAMES[$file_idx]="$host"
+    key="$item_id,$file_idx"
+    STATUSES[$key]=$status
+    REASONS[$key]=$reason
+    SUGGESTIONS[$key]=$tips
+    ICONS[$key]=$(status_icon "$status")
+  done < "$1"
+}
+
 # --- Main Logic ---
 
 ensure_command "jq"
@@ -41,6 +81,7 @@ N_HOSTS=${#JSON_FILES[@]}
 
 declare -a HOSTNAMES
 declare -A ICONS STATUSES REASONS SUGGESTIONS
+declare -A UPS_SUB_STATUSES UPS_SUB_REASONS UPS_SUB_ICONS
 
 
 
@@ -54,6 +95,18 @@ ITEM_NAMES=(
 echo "Reading ${N_HOSTS} JSON report(s)..." >&2
 echo "---" >&2
 
+USE_INDEX=0
+if health_index_available; then
+  INDEX_OUT=$(mktemp)
+  trap 'rm -f "$INDEX_OUT"' EXIT
+  if python3 "$HEALTH_INDEX_PY" --db "$HEALTH_INDEX_DB" items "${JSON_FILES[@]}" > "$INDEX_OUT"; then
+    USE_INDEX=1
+    load_from_index "$INDEX_OUT"
+  else
+    echo "Warning: health_index.py failed, reading the reports with jq." >&2
+  fi
+fi
+
 for i in $(seq 0 $((N_HOSTS - 1))); do
   json_file="${JSON_FILES[$i]}"
   if [ ! -f "$json_file" ]; then
@@ -62,6 +115,12 @@ for i in $(seq 0 $((N_HOSTS - 1))); do
     continue
   fi
 
+  if (( USE_INDEX )); then
+    : "${HOSTNAMES[$i]:=unknown}"
+    echo "Host: ${HOSTNAMES[$i]}, File: $json_file (index)" >&2
+    continue
+  fi
+
   hostname=$(jq -r '.meta.hostname // "unknown"' "$json_file")
   HOSTNAMES[$i]="$hostname"
   echo "Host: $hostname, File: $json_file" >&2
@@ -107,13 +166,7 @@ for i in $(seq 0 $((N_HOSTS - 1))); do
     REASONS[$key]=$(echo "$item_json" | jq -r '.reason // ""' || echo "")
     SUGGESTIONS[$key]=$(echo "$item_json" | jq -r 'if .tips then .tips[] else "" end' || echo "")
 
-    case "$status" in
-      PASS) ICONS[$key]="🟢";;
-      WARN) ICONS[$key]="🟡";;
-      FAIL) ICONS[$key]="🔴";;
-      SKIP) ICONS[$key]="⚪️";;
-      *) ICONS[$key]="🔵";;
-    esac
+    ICONS[$key]=$(status_icon "$status")
   done
 done
 
@@ -154,6 +207,7 @@ for item_id in $(seq 1 15); do
       printf " %s |" "${ICONS["$item_id,$host_idx"]:-'?'}"
     done
     echo
+done
 
 echo ""
 echo "## 詳細報告"
@@ -0,0 +1,376 @@
+# follow_health.py
+"""
+parse_journal.py --follow: 持續追蹤 journalctl -f 或增長中的日誌文件, 逐行分類並以滑動時間窗計算健康分數。
+
+各類別的事件數保存在固定大小的 ring buffer (每 bucket 一格, 共 window / bucket 格) 中,
+時間窗內的總數隨新事件與過期的 bucket 增量更新, 記憶體與每行的處理成本都與資料量無關。
+健康分數的公式與 health_score.csv 相同 (以時間窗取代日); 分數跌破/回升越過門檻,
+或類別事件數達到/低於門檻時, 輸出一筆 JSON 事件到文件 (JSON Lines) 或本機 webhook。
+
+時間窗依日誌的時間戳推進 (也可用於重播既有文件), 進入新的 bucket 時與每 eval_interval 秒重新計算分數;
+沒有新日誌時依經過的實際時間推進。
+"""
+import functools
+import json
+import os
+import queue
+import shlex
+import signal
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from datetime import datetime, timezone
+
+import aggregate_metrics
+from parse_journal import MessageClassifier, journal_entry, parse_log_line
+
+# rules.yaml 的 follow 區段可覆寫
+DEFAULT_FOLLOW = {
+    'window': '1d',
+    'bucket': '1m',
+    'score_thresholds': [80, 50],
+    'category_thresholds': {'RAID_FW': 1},
+    # 重新計算健康分數的間隔 (秒)
+    'eval_interval': 1.0,
+}
+
+# 沒有新資料時的輪詢間隔 (秒)
+POLL_INTERVAL = 0.5
+
+@functools.lru_cache(maxsize=4096)
+def epoch_seconds(ts_utc):
+    return int(datetime.fromisoformat(ts_utc).timestamp())
+
+def iso_utc(epoch):
+    return datetime.fromtimestamp(int(epoch), timezone.utc).isoformat()
+
+class WindowCounter:
+    """
+    滑動時間窗的各類別事件數。ring[i] 為第 i 個 bucket 各類別的事件數, totals 為時間窗內的總數;
+    時間前進時只扣除並清空過期的 bucket。早於時間窗的事件不計入 (計數在 late)。
+    """
+
+    def __init__(self, categories, window_seconds, bucket_seconds):
+        self.categories = list(categories)
+        self.index = {category: i for i, category in enumerate(self.categories)}
+        self.bucket_seconds = bucket_seconds
+        self.size = max(window_seconds // bucket_seconds, 1)
+        self.ring = [[0] * len(self.categories) for _ in range(self.size)]
+        self.totals = [0] * len(self.categories)
+        self.current = None
+        self.late = 0
+
+    def advance(self, epoch):
+        bucket = int(epoch) // self.bucket_seconds
+        if self.current is None:
+            self.current = bucket
+            return
+        if bucket <= self.current:
+            return
+        if bucket - self.current >= self.size:
+            for slot in self.ring:
+                slot[:] = [0] * len(slot)
+            self.totals = [0] * len(self.categories)
+        else:
+            totals = self.totals
+            for b in range(self.current + 1, bucket + 1):
+                slot = self.ring[b % self.size]
+                for i, value in enumerate(slot):
+                    if value:
+                        totals[i] -= value
+                        slot[i] = 0
+        self.current = bucket
+
+    def add(self, epoch, category):
+        """計入一筆事件, 回傳該類別在時間窗內的總數 (過舊的事件回傳 None)"""
+        bucket = int(epoch) // self.bucket_seconds
+        if self.current is None or bucket > self.current:
+            self.advance(epoch)
+        elif bucket <= self.current - self.size:
+            self.late += 1
+            return None
+        i = self.index[category]
+        self.ring[bucket % self.size][i] += 1
+        self.totals[i] += 1
+        return self.totals[i]
+
+    def counts(self):
+        return {category: total for category, total in zip(self.categories, self.totals) if total}
+
+class ThresholdMonitor:
+    """依目前狀態判斷是否越過門檻; 只有狀態改變時才產生事件"""
+
+    def __init__(self, weights, score_thresholds, category_thresholds, window, emit):
+        self.weights = weights
+        self.score_thresholds = sorted(score_thresholds, reverse=True)
+        self.category_thresholds = category_thresholds
+        self.window = window
+        self.emit = emit
+        self.below = set()
+        self.reached = set()
+        self.score = 100.0
+
+    def check_category(self, epoch, category, count):
+        threshold = self.category_thresholds.get(category)
+        if threshold is None:
+            return
+        reached = count >= threshold
+        if reached != (category in self.reached):
+            (self.reached.add if reached else self.reached.discard)(category)
+            self.emit({'time': iso_utc(epoch), 'event': 'category_count', 'category': category,
+                       'direction': 'reached' if reached else 'cleared', 'threshold': threshold,
+                       'count': count, 'window': self.window})
+
+    def evaluate(self, epoch, counter):
+        """重新計算健康分數並檢查所有門檻"""
+        counts = counter.counts()
+        self.score = aggregate_metrics.health_score_from_counts(counts, self.weights)
+        for threshold in self.score_thresholds:
+            below = self.score < threshold
+            if below != (threshold in self.below):
+                (self.below.add if below else self.below.discard)(threshold)
+                self.emit({'time': iso_utc(epoch), 'event': 'health_score',
+                           'direction': 'below' if below else 'recovered', 'threshold': threshold,
+                           'score': round(self.score, 2), 'window': self.window, 'counts': counts})
+        for category in self.category_thresholds:
+            if category in counter.index:
+                self.check_category(epoch, category, counter.totals[counter.index[category]])
+
+# --- 事件輸出 ---
+
+class FileSink:
+    def __init__(self, path):
+        self.f = sys.stdout if path == '-' else open(path, 'a', encoding='utf-8')
+
+    def __call__(self, event):
+        self.f.write(json.dumps(event, ensure_ascii=False) + '\n')
+        self.f.flush()
+
+    def close(self):
+        if self.f is not sys.stdout:
+            self.f.close()
+
+class WebhookSink:
+    """在背景 thread 以 HTTP POST 送出事件; 佇列已滿時丟棄 (不阻塞日誌處理)"""
+
+    def __init__(self, url, maxsize=1000, timeout=5):
+        self.url = url
+        self.timeout = timeout
+        self.queue = queue.Queue(maxsize)
+        self.dropped = 0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def __call__(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            event = self.queue.get()
+            if event is None:
+                return
+            request = urllib.request.Request(self.url, data=json.dumps(event, ensure_ascii=False).encode('utf-8'),
+                                             headers={'Content-Type': 'application/json'}, method='POST')
+            try:
+                with urllib.request.urlopen(request, timeout=self.timeout):
+                    pass
+            except OSError as e:
+                print(f"警告: webhook 送出失敗: {e}", file=sys.stderr)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join(self.timeout)
+        if self.dropped:
+            print(f"警告: webhook 佇列已滿，丟棄了 {self.dropped} 筆事件。", file=sys.stderr)
+
+# --- 輸入來源: 產出一行 (str 或 bytes), 暫時沒有新資料時產出 None ---
+
+def tail_file(path, from_start=False, stop_at_eof=False, poll=POLL_INTERVAL):
+    """如同 tail -F: 文件被輪替 (inode 改變) 或截斷時從頭重新讀取新文件"""
+    f = open(path, 'r', encoding='utf-8', errors='replace')
+    try:
+        if not from_start:
+            f.seek(0, os.SEEK_END)
+        partial = ''
+        while True:
+            line = f.readline()
+            if line:
+                if line.endswith('\n'):
+                    yield partial + line
+                    partial = ''
+                else:
+                    partial += line
+                continue
+            if stop_at_eof:
+                if partial:
+                    yield partial
+                return
+            time.sleep(poll)
+            yield None
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if st.st_ino != os.fstat(f.fileno()).st_ino or st.st_size < f.tell():
+                f.close()
+                f = open(path, 'r', encoding='utf-8', errors='replace')
+                partial = ''
+    finally:
+        f.close()
+
+def read_stream(stream, poll=POLL_INTERVAL, maxsize=10000):
+    """
+    在背景 thread 讀取 stream 的各行; 佇列已滿時讀取端暫停 (背壓), 記憶體用量固定。
+    stream 結束時結束。
+    """
+    lines = queue.Queue(maxsize)
+
+    def reader():
+        try:
+            for line in stream:
+                lines.put(line)
+        finally:
+            lines.put(StopIteration)
+
+    threading.Thread(target=reader, daemon=True).start()
+    while True:
+        try:
+            line = lines.get(timeout=poll)
+        except queue.Empty:
+            yield None
+            continue
+        if line is StopIteration:
+            return
+        yield line
+
+def journalctl_command(args):
+    """journalctl -f -o json; 未指定 --from-start 時只讀取啟動後的新紀錄"""
+    cmd = ['journalctl', '--no-pager', '-f', '-o', 'json'] + shlex.split(args.journalctl)
+    if not args.from_start:
+        cmd += ['-n', '0']
+    return cmd
+
+def entry_times(lines, fmt, tz_offset_str, stats):
+    """將各行轉為 (epoch 秒, 訊息); 無法解析的行計入 stats['skipped'], None (閒置) 原樣傳遞"""
+    for line in lines:
+        if line is None:
+            yield None
+            continue
+        if fmt == 'json':
+            if not line.strip():
+                continue
+            try:
+                entry = journal_entry(json.loads(line), tz_offset_str)
+            except ValueError:
+                entry = None
+        else:
+            if isinstance(line, bytes):
+                line = line.decode('utf-8', 'replace')
+            entry = parse_log_line(line, tz_offset_str)
+        if not entry:
+            stats['skipped'] += 1
+            continue
+        yield epoch_seconds(entry['ts_utc']), entry['message']
+
+def follow_config(config):
+    settings = dict(DEFAULT_FOLLOW)
+    settings.update(config.get('follow') or {})
+    return settings
+
+def follow(args, config):
+    """執行 follow 模式直到輸入結束或中斷, 回傳處理的行數"""
+    fmt = args.format or ('json' if args.journalctl is not None else 'text')
+    if fmt == 'export':
+        print("錯誤: --follow 只支援 text 與 json 格式。")
+        return 0
+    if args.journalctl is None and not args.logfile:
+        print("錯誤: 請指定日誌文件或 --journalctl。")
+        return 0
+
+    settings = follow_config(config)
+    try:
+        window_seconds = aggregate_metrics.parse_minutes(settings['window']) * 60
+        bucket_seconds = aggregate_metrics.parse_minutes(settings['bucket']) * 60
+    except ValueError as e:
+        print(f"錯誤: follow 設定: {e}")
+        return 0
+    categories = config.get('categories', {})
+    classifier = MessageClassifier(categories)
+    counter = WindowCounter(list(dict.fromkeys(list(categories) + ['OTHER'])), window_seconds, bucket_seconds)
+
+    sinks = [FileSink(args.events or os.path.join(args.output_dir, 'follow_events.jsonl'))]
+    if args.webhook:
+        sinks.append(WebhookSink(args.webhook))
+
+    def emit(event):
+        for sink in sinks:
+            sink(event)
+
+    monitor = ThresholdMonitor(config.get('weights', {}), settings['score_thresholds'],
+                               settings['category_thresholds'] or {}, settings['window'], emit)
+    eval_interval = float(settings['eval_interval'])
+    stats = {'skipped': 0}
+    proc = None
+    if args.journalctl is not None:
+        proc = subprocess.Popen(journalctl_command(args), stdout=subprocess.PIPE)
+        lines = read_stream(proc.stdout)
+    elif args.logfile == '-':
+        lines = read_stream(sys.stdin.buffer)
+    else:
+        lines = tail_file(args.logfile, args.from_start, args.stop_at_eof)
+
+    # systemd 等以 SIGTERM 停止時與 Ctrl-C 相同, 正常關閉事件輸出
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    print(f"追蹤中: {'journalctl' if proc else args.logfile} (時間窗 {settings['window']}, bucket {settings['bucket']})",
+          file=sys.stderr)
+    processed = 0
+    # 日誌時間 last_epoch 對應的實際時間, 閒置時以此推進時間窗
+    last_epoch, last_clock = None, time.monotonic()
+    next_eval = last_clock + eval_interval
+    add, check_category = counter.add, monitor.check_category
+    watched = monitor.category_thresholds
+    evaluated_bucket = None
+    try:
+        for item in entry_times(lines, fmt, args.tz, stats):
+            if item is not None:
+                epoch, message = item
+                category = classifier(message)
+                count = add(epoch, category)
+                if count is not None and category in watched:
+                    check_category(epoch, category, count)
+                if last_epoch is None or epoch >= last_epoch:
+                    last_epoch = epoch
+                processed += 1
+                # 進入新的 bucket 時重新計算 (依日誌時間, 重播時也與即時追蹤相同)
+                if counter.current != evaluated_bucket:
+                    monitor.evaluate(last_epoch, counter)
+                    evaluated_bucket = counter.current
+                if processed & 1023:
+                    continue
+            now = time.monotonic()
+            if item is not None:
+                last_clock = now
+            elif last_epoch is not None:
+                counter.advance(last_epoch + (now - last_clock))
+            if now >= next_eval and last_epoch is not None:
+                monitor.evaluate(last_epoch + (now - last_clock if item is None else 0), counter)
+                next_eval = now + eval_interval
+        if last_epoch is not None:
+            monitor.evaluate(last_epoch, counter)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if proc is not None:
+            proc.kill()
+            proc.wait()
+        for sink in sinks:
+            sink.close()
+
+    print(f"已處理 {processed} 行，跳過 {stats['skipped']} 行，過舊 {counter.late} 筆; "
+          f"目前健康分數 {monitor.score:.2f}", file=sys.stderr)
+    return processed
@@ -0,0 +1,427 @@
+# health_index.py
+"""
+server_health_full.sh 報告 (build_master_json 的輸出) 的歷史索引 (SQLite)。
+
+每份報告為一次 run (主機 + 時間), 15 個項目的 status/reason/thresholds 與 UPS 子項目各一列,
+依主機、項目與時間建立索引; 已匯入且未變更的檔案 (路徑、大小、mtime 相同) 直接略過。
+整合表 (各主機最新一次的各項狀態) 與單一項目的狀態時間軸都由一個查詢產生。
+
+    python3 health_index.py ingest logs/ /data/reports/**/logs/*_health_*.json
+    python3 health_index.py table --format md
+    python3 health_index.py timeline --item 5 --status WARN --current
+    python3 health_index.py timeline --ups 'UPS-A' --host UPS_System
+
+store 預設為目前目錄的 health_index.db (--db 或 HEALTH_INDEX_DB 可覆寫)。
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+
+DEFAULT_DB = 'health_index.db'
+ITEM_IDS = range(1, 16)
+ITEM_NAMES = {
+    1: 'PSU', 2: 'Disks/RAID/SMART', 3: 'Memory/ECC', 4: 'CPU', 5: 'NIC',
+    6: 'GPU', 7: 'Fans', 8: 'Env', 9: 'UPS', 10: 'Network Reach/Perf',
+    11: 'Cabling', 12: 'BMC/SEL', 13: 'System Logs', 14: 'Firmware', 15: 'I/O Perf',
+}
+ICONS = {'PASS': '🟢', 'WARN': '🟡', 'FAIL': '🔴', 'SKIP': '⚪️', 'N/A': '⚪️'}
+# meta.timestamp 的格式 (server_health_full.sh 的 TIMESTAMP, 本機時間)
+TIMESTAMP_FORMAT = '%Y%m%d_%H%M%S'
+DISPLAY_FORMAT = '%Y-%m-%d %H:%M:%S'
+# 目錄中要匯入的報告 (略過 legacy 陣列格式與 _latest 連結)
+REPORT_SUFFIX = '.json'
+REPORT_EXCLUDE = ('_legacy_array.json', '_latest.json', '_ups_summary.json')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+-- 已匯入的檔案; 大小與 mtime 相同時不再讀取
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime_ns INTEGER,
+    run_id INTEGER
+);
+-- 每份報告一次 run; 同一主機同一時間的報告 (e.g., 複製到別處) 視為同一次
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    host TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    timestamp TEXT,
+    script_version TEXT,
+    duration_sec REAL,
+    bios_version TEXT,
+    kernel TEXT,
+    ups_overall TEXT,
+    sel_crit INTEGER,
+    sel_warn INTEGER,
+    sel_info INTEGER,
+    file TEXT,
+    UNIQUE (host, ts)
+);
+CREATE INDEX IF NOT EXISTS runs_ts ON runs (ts);
+-- host/ts 與 runs 重複, 讓時間軸查詢只需讀索引
+CREATE TABLE IF NOT EXISTS items (
+    run_id INTEGER NOT NULL,
+    item_id INTEGER NOT NULL,
+    host TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    status TEXT,
+    reason TEXT,
+    note TEXT,
+    tips TEXT,
+    thresholds TEXT,
+    PRIMARY KEY (run_id, item_id)
+);
+CREATE INDEX IF NOT EXISTS items_item_host_ts ON items (item_id, host, ts, status);
+CREATE TABLE IF NOT EXISTS ups_items (
+    run_id INTEGER NOT NULL,
+    ups_id TEXT NOT NULL,
+    host TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    status TEXT,
+    reason TEXT,
+    battery_pct REAL,
+    temp_c REAL,
+    runtime_min REAL,
+    output_state TEXT,
+    PRIMARY KEY (run_id, ups_id)
+);
+CREATE INDEX IF NOT EXISTS ups_items_ups_host_ts ON ups_items (ups_id, host, ts, status);
+"""
+
+SCHEMA_VERSION = 1
+
+def report_epoch(meta):
+    """run 的時間: meta.start_epoch, 否則以本機時間解析 meta.timestamp; 都沒有時為 None"""
+    epoch = meta.get('start_epoch')
+    if isinstance(epoch, (int, float)) and not isinstance(epoch, bool) and epoch > 0:
+        return int(epoch)
+    try:
+        return int(time.mktime(time.strptime(str(meta.get('timestamp')), TIMESTAMP_FORMAT)))
+    except ValueError:
+        return None
+
+def ups_status(reason):
+    """與 consolidate_reports.sh 相同, 由 UPS reason 的前綴判斷狀態"""
+    if reason.startswith('CRIT:'):
+        return 'FAIL'
+    if reason.startswith('WARN:'):
+        return 'WARN'
+    if reason.endswith('-> PASS'):
+        return 'PASS'
+    return 'INFO'
+
+def ups_name(ups_id):
+    """去掉 id 中的 '(...)' (e.g., 'UPS-A(10.0.0.5)' → 'UPS-A')"""
+    start = ups_id.find('(')
+    if start < 0:
+        return ups_id
+    end = ups_id.rfind(')')
+    return ups_id[:start] + (ups_id[end + 1:] if end > start else '')
+
+def number(value):
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+def text(value):
+    return value if isinstance(value, str) else None
+
+def find_reports(paths):
+    """展開參數中的目錄 (遞迴尋找 *.json 報告); 檔案原樣保留"""
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if name.endswith(REPORT_SUFFIX) and not name.endswith(REPORT_EXCLUDE):
+                    yield os.path.join(root, name)
+
+class HealthIndex:
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+        version = self.conn.execute("SELECT value FROM meta WHERE key = 'schema_version'").fetchone()
+        if version is None or version[0] != str(SCHEMA_VERSION):
+            for table in ('files', 'runs', 'items', 'ups_items'):
+                self.conn.execute(f"DELETE FROM {table}")
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('schema_version', ?)",
+                              (str(SCHEMA_VERSION),))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.conn.commit()
+        else:
+            self.conn.rollback()
+        self.conn.close()
+
+    def ingest(self, path):
+        """匯入一份報告; 回傳 'ingested' / 'skipped' / 'invalid'"""
+        real_path = os.path.realpath(path)
+        stat = os.stat(real_path)
+        known = self.conn.execute("SELECT size, mtime_ns FROM files WHERE path = ?", (real_path,)).fetchone()
+        if known == (stat.st_size, stat.st_mtime_ns):
+            return 'skipped'
+        try:
+            with open(real_path, 'r', encoding='utf-8') as f:
+                report = json.load(f)
+        except (OSError, ValueError, UnicodeDecodeError) as e:
+            print(f"警告: 無法讀取 {path}: {e}", file=sys.stderr)
+            report = None
+        meta = report.get('meta') if isinstance(report, dict) else None
+        items = report.get('items') if isinstance(report, dict) else None
+        ts = report_epoch(meta) if isinstance(meta, dict) else None
+        if ts is None or not isinstance(items, list):
+            if report is not None:
+                print(f"警告: {path} 不是 server_health 報告 (缺少 meta.timestamp 或 items)，略過。", file=sys.stderr)
+            # 記錄無效的檔案, 檔案變更前不再讀取
+            self.conn.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, NULL)",
+                              (real_path, stat.st_size, stat.st_mtime_ns))
+            return 'invalid'
+
+        host = str(meta.get('hostname') or 'unknown')
+        run_id = self._add_run(host, ts, meta, report, real_path)
+        self.conn.execute("DELETE FROM items WHERE run_id = ?", (run_id,))
+        self.conn.execute("DELETE FROM ups_items WHERE run_id = ?", (run_id,))
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(run_id, item['id'], host, ts, text(item.get('status')), text(item.get('reason')),
+              text(item.get('note')), json.dumps(item.get('tips') or [], ensure_ascii=False),
+              self._thresholds(item))
+             for item in items if isinstance(item, dict) and item.get('id') in ITEM_IDS])
+        ups = report.get('ups')
+        ups_list = ups.get('ups') if isinstance(ups, dict) else None
+        if isinstance(ups_list, list):
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO ups_items VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(run_id, ups_name(str(entry['id'])), host, ts, ups_status(entry.get('reason') or ''),
+                  text(entry.get('reason')), number(entry.get('battery_pct')), number(entry.get('temp_c')),
+                  number(entry.get('runtime_min')), text(entry.get('output_state')))
+                 for entry in ups_list if isinstance(entry, dict) and entry.get('id') is not None])
+        self.conn.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                          (real_path, stat.st_size, stat.st_mtime_ns, run_id))
+        return 'ingested'
+
+    def _add_run(self, host, ts, meta, report, path):
+        sel = report.get('sel') if isinstance(report.get('sel'), dict) else {}
+        summary = sel.get('summary') if isinstance(sel.get('summary'), dict) else {}
+        ups = report.get('ups') if isinstance(report.get('ups'), dict) else {}
+        self.conn.execute(
+            """INSERT INTO runs (host, ts, timestamp, script_version, duration_sec, bios_version, kernel,
+                                 ups_overall, sel_crit, sel_warn, sel_info, file)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT (host, ts) DO UPDATE SET
+                   timestamp = excluded.timestamp, script_version = excluded.script_version,
+                   duration_sec = excluded.duration_sec, bios_version = excluded.bios_version,
+                   kernel = excluded.kernel, ups_overall = excluded.ups_overall, sel_crit = excluded.sel_crit,
+                   sel_warn = excluded.sel_warn, sel_info = excluded.sel_info, file = excluded.file""",
+            (host, ts, text(meta.get('timestamp')), text(meta.get('script_version')),
+             number(meta.get('duration_sec')), text(meta.get('bios_version')), text(meta.get('kernel')),
+             text(ups.get('overall')), number(summary.get('crit')), number(summary.get('warn')),
+             number(summary.get('info')), path))
+        return self.conn.execute("SELECT id FROM runs WHERE host = ? AND ts = ?", (host, ts)).fetchone()[0]
+
+    @staticmethod
+    def _thresholds(item):
+        judgement = item.get('judgement')
+        thresholds = judgement.get('thresholds') if isinstance(judgement, dict) else None
+        return json.dumps(thresholds, ensure_ascii=False) if thresholds is not None else None
+
+    def latest(self, hosts=None, at=None):
+        """各主機在 at (epoch, 預設為最新) 之前最後一次 run 的 15 項狀態: {主機: (ts, {項目: (status, reason)})}"""
+        where, params = ["1"], []
+        if at is not None:
+            where.append("ts <= ?")
+            params.append(at)
+        if hosts:
+            where.append(f"host IN ({','.join('?' * len(hosts))})")
+            params.extend(hosts)
+        table = {}
+        for host, ts, item_id, status, reason in self.conn.execute(
+                # SQLite 的 MAX() 聚合會讓 id 取自 ts 最大的那一列
+                f"""SELECT r.host, r.ts, i.item_id, i.status, i.reason
+                    FROM (SELECT id, host, MAX(ts) AS ts FROM runs WHERE {' AND '.join(where)} GROUP BY host) AS r
+                    JOIN items AS i ON i.run_id = r.id
+                    ORDER BY r.host, i.item_id""", params):
+            table.setdefault(host, (ts, {}))[1][item_id] = (status, reason)
+        return table
+
+    def timeline(self, item_id=None, ups_id=None, hosts=None, since=None):
+        """同一狀態的連續 run 合併為一段: [(主機, status, 開始, 最後一次, run 數, 下一段開始)]"""
+        table, key, value = ('items', 'item_id', item_id) if ups_id is None else ('ups_items', 'ups_id', ups_id)
+        where, params = [f"{key} = ?"], [value]
+        if hosts:
+            where.append(f"host IN ({','.join('?' * len(hosts))})")
+            params.extend(hosts)
+        if since is not None:
+            where.append("ts >= ?")
+            params.append(since)
+        return self.conn.execute(
+            f"""WITH changes AS (
+                    SELECT host, ts, status,
+                           CASE WHEN status IS LAG(status) OVER (PARTITION BY host ORDER BY ts) THEN 0 ELSE 1 END
+                               AS changed
+                    FROM {table} WHERE {' AND '.join(where)}),
+                segments AS (
+                    SELECT host, ts, status,
+                           SUM(changed) OVER (PARTITION BY host ORDER BY ts ROWS UNBOUNDED PRECEDING) AS segment
+                    FROM changes),
+                spans AS (
+                    SELECT host, segment, status, MIN(ts) AS since, MAX(ts) AS last_seen, COUNT(*) AS runs
+                    FROM segments GROUP BY host, segment)
+                SELECT host, status, since, last_seen, runs,
+                       LEAD(since) OVER (PARTITION BY host ORDER BY segment) AS until
+                FROM spans ORDER BY host, since""", params).fetchall()
+
+    def report_items(self, paths):
+        """consolidate_reports.sh 用: 各檔案對應 run 的主機與 15 項 (status, reason, tips); 未匯入的檔案為 None"""
+        real_paths = [os.path.realpath(path) for path in paths]
+        rows = {}
+        for start in range(0, len(real_paths), 500):
+            chunk = real_paths[start:start + 500]
+            for path, host, item_id, status, reason, tips in self.conn.execute(
+                    f"""SELECT f.path, r.host, i.item_id, i.status, i.reason, i.tips
+                        FROM files AS f JOIN runs AS r ON r.id = f.run_id
+                        LEFT JOIN items AS i ON i.run_id = r.id
+                        WHERE f.path IN ({','.join('?' * len(chunk))})""", chunk):
+                host_items = rows.setdefault(path, (host, {}))[1]
+                if item_id is not None:
+                    host_items[item_id] = (status, reason, json.loads(tips) if tips else [])
+        return [rows.get(path) for path in real_paths]
+
+def format_ts(epoch):
+    return time.strftime(DISPLAY_FORMAT, time.localtime(epoch)) if epoch is not None else ''
+
+def parse_time(value):
+    """'YYYY-mm-dd[ HH:MM:SS]' (本機時間) 或 epoch 秒"""
+    if value is None:
+        return None
+    if value.isdigit():
+        return int(value)
+    for fmt in (DISPLAY_FORMAT, '%Y-%m-%d'):
+        try:
+            return int(time.mktime(time.strptime(value, fmt)))
+        except ValueError:
+            continue
+    raise argparse.ArgumentTypeError(f"無法解析時間 '{value}'")
+
+def md_cell(value):
+    return str(value).replace('|', '\\|').replace('\n', ' ')
+
+def print_table(table, fmt):
+    if fmt == 'json':
+        print(json.dumps([{'host': host, 'time': format_ts(ts),
+                           'items': {str(item_id): {'status': status, 'reason': reason}
+                                     for item_id, (status, reason) in items.items()}}
+                          for host, (ts, items) in table.items()], ensure_ascii=False, indent=2))
+        return
+    if fmt == 'tsv':
+        print('\t'.join(['host', 'time'] + [str(item_id) for item_id in ITEM_IDS]))
+        for host, (ts, items) in table.items():
+            print('\t'.join([host, format_ts(ts)] + [items.get(i, ('N/A',))[0] or 'N/A' for i in ITEM_IDS]))
+        return
+    print('| 主機 | 時間 | ' + ' | '.join(f"{i} {ITEM_NAMES[i]}" for i in ITEM_IDS) + ' |')
+    print('|:---|:---|' + ':----:|' * len(ITEM_IDS))
+    for host, (ts, items) in table.items():
+        cells = [ICONS.get(items.get(i, ('N/A',))[0], '🔵') for i in ITEM_IDS]
+        print(f"| {md_cell(host)} | {format_ts(ts)} | " + ' | '.join(cells) + ' |')
+
+def print_timeline(spans, fmt):
+    rows = [{'host': host, 'status': status, 'since': format_ts(since), 'last_seen': format_ts(last_seen),
+             'until': format_ts(until), 'runs': runs, 'days': round((last_seen - since) / 86400, 2)}
+            for host, status, since, last_seen, runs, until in spans]
+    if fmt == 'json':
+        print(json.dumps(rows, ensure_ascii=False, indent=2))
+        return
+    columns = ['host', 'status', 'since', 'last_seen', 'until', 'runs', 'days']
+    if fmt == 'tsv':
+        print('\t'.join(columns))
+        for row in rows:
+            print('\t'.join(str(row[column]) for column in columns))
+        return
+    print('| ' + ' | '.join(columns) + ' |')
+    print('|' + ':---|' * len(columns))
+    for row in rows:
+        print('| ' + ' | '.join(md_cell(row[column]) for column in columns) + ' |')
+
+def print_report_items(rows):
+    """以 NUL 分隔輸出 '檔案序號, 主機, 項目, status, reason, tips (以換行連接)', 每項一筆"""
+    out = sys.stdout
+    for index, row in enumerate(rows):
+        if row is None:
+            continue
+        host, items = row
+        for item_id in ITEM_IDS:
+            status, reason, tips = items.get(item_id, ('N/A', 'No data in JSON', []))
+            fields = [str(index), host, str(item_id), status or '', reason or '', '\n'.join(tips)]
+            out.write('\0'.join(field.replace('\0', '') for field in fields) + '\0')
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='server_health 報告的歷史索引 (SQLite)。')
+    parser.add_argument('--db', default=os.environ.get('HEALTH_INDEX_DB') or DEFAULT_DB,
+                        help=f'store 路徑 (預設: $HEALTH_INDEX_DB 或 {DEFAULT_DB})')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    ingest = subparsers.add_parser('ingest', help='匯入報告 JSON (目錄會遞迴尋找), 已匯入且未變更的檔案略過')
+    ingest.add_argument('paths', nargs='+', help='報告 JSON 檔案或目錄')
+
+    def filters(sub):
+        sub.add_argument('--host', action='append', help='只列出指定主機 (可重複)')
+        sub.add_argument('--format', choices=('md', 'tsv', 'json'), default='md', help='輸出格式 (預設: md)')
+
+    table = subparsers.add_parser('table', help='各主機最新一次 run 的 15 項狀態')
+    filters(table)
+    table.add_argument('--at', type=parse_time, help='改用此時間之前的最後一次 run')
+
+    timeline = subparsers.add_parser('timeline', help='單一項目 (或 UPS 子項目) 的狀態時間軸')
+    target = timeline.add_mutually_exclusive_group(required=True)
+    target.add_argument('--item', type=int, choices=list(ITEM_IDS), help='項目編號 1-15')
+    target.add_argument('--ups', help="UPS 子項目 id (不含 '(...)')")
+    filters(timeline)
+    timeline.add_argument('--since', type=parse_time, help='只看此時間之後的 run')
+    timeline.add_argument('--status', help='只列出此狀態的區段 (e.g., WARN)')
+    timeline.add_argument('--current', action='store_true', help='只列出各主機目前 (最新一次 run) 所在的區段')
+
+    items = subparsers.add_parser('items', help='(consolidate_reports.sh 用) 匯入並以 NUL 分隔輸出各檔案的項目')
+    items.add_argument('paths', nargs='+', help='報告 JSON 檔案')
+    return parser
+
+def main():
+    args = build_parser().parse_args()
+    with HealthIndex(args.db) as index:
+        if args.command in ('ingest', 'items'):
+            paths = list(find_reports(args.paths)) if args.command == 'ingest' else args.paths
+            counts = {'ingested': 0, 'skipped': 0, 'invalid': 0}
+            for path in paths:
+                if os.path.isfile(path):
+                    counts[index.ingest(path)] += 1
+                else:
+                    print(f"警告: 找不到檔案 {path}", file=sys.stderr)
+                    counts['invalid'] += 1
+            index.conn.commit()
+            print(f"[Index] {args.db}: 匯入 {counts['ingested']}、略過 (已匯入) {counts['skipped']}、"
+                  f"無效 {counts['invalid']}", file=sys.stderr)
+            if args.command == 'items':
+                print_report_items(index.report_items(paths))
+        elif args.command == 'table':
+            print_table(index.latest(args.host, args.at), args.format)
+        else:
+            spans = index.timeline(args.item, args.ups, args.host, args.since)
+            if args.current:
+                spans = [span for span in spans if span[5] is None]
+            if args.status:
+                spans = [span for span in spans if span[1] == args.status.upper()]
+            print_timeline(spans, args.format)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
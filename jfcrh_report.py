@@ -0,0 +1,295 @@
+# jfcrh_report.py
+"""
+日誌分析工具鏈的單一入口: parse → aggregate → plot 在同一個 process 中執行,
+各階段之間直接傳遞 DataFrame, 不再經由 CSV 交接; 各階段的輸出檔案與單獨執行時相同。
+
+    python3 -m jfcrh_report run <log> --output_dir <dir> [--rules rules.yaml]
+    python3 -m jfcrh_report fleet '<glob>' --output_dir <dir> [--workers N]
+
+parse_journal.py / aggregate_metrics.py / plot_reports.py 仍可單獨執行。
+"""
+import argparse
+import contextlib
+import glob
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+
+import aggregate_metrics
+import parse_journal
+import pipeline_metrics
+import plot_reports
+import rollup_store
+
+def load_configs(path):
+    """rules.yaml 只讀取一次; 找不到時各階段沿用自己的預設設定"""
+    if os.path.exists(path):
+        config = parse_journal.load_config(path)
+        return config, config, config
+    return parse_journal.load_config(path), aggregate_metrics.load_config(path), plot_reports.load_config(path)
+
+def parsed_frame(collect):
+    """由解析時收集的欄位建立 parsed DataFrame"""
+    df = pd.DataFrame(collect)
+    df['category'] = df['category'].astype('category')
+    return df
+
+def run_stages(args, plots=True, in_memory=True):
+    """
+    執行各階段, 回傳 (outputs, parsed_df); 失敗時回傳 None。
+    in_memory=False 時不在記憶體中保留解析結果 (parsed_df 為 None), 後續階段由輸出檔案讀取。
+    """
+    parse_config, aggregate_config, plot_config = load_configs(args.rules)
+
+    # 各階段以自己的 parser 建立參數, 預設值與單獨執行時相同
+    parse_argv = ([args.logfile] if args.logfile else []) + [
+        '--tz', args.tz, '--rules', args.rules, '--output_dir', args.output_dir, '--workers', str(args.workers)]
+    if args.format:
+        parse_argv += ['--format', args.format]
+    if args.journalctl is not None:
+        parse_argv += ['--journalctl', args.journalctl]
+    if args.parquet:
+        parse_argv.append('--parquet')
+    if args.incremental:
+        parse_argv.append('--incremental')
+    aggregate_argv = ['--io_dir', args.output_dir, '--rules', args.rules,
+                      '--top-k', str(args.top_k), '--window-days', str(args.window_days)]
+    if args.rollup_db:
+        aggregate_argv += ['--rollup-db', args.rollup_db]
+    plot_argv = ['--io_dir', args.output_dir, '--rules', args.rules,
+                 '--window-days', str(args.window_days), '--workers', str(args.plot_workers)]
+    if args.force:
+        plot_argv.append('--force')
+    if args.metrics:
+        # 各階段合併寫入同一個 pipeline_metrics.json
+        metrics_argv = ['--metrics'] + (['--profile', args.profile] if args.profile else [])
+        parse_argv += metrics_argv
+        aggregate_argv += metrics_argv
+        plot_argv += metrics_argv
+
+    print("--- (a) 解析日誌 ---")
+    # 增量解析只產出新增的部分, 後續階段改由輸出檔案讀取完整資料
+    columns = dict.fromkeys(aggregate_metrics.PARSED_COLUMNS + plot_reports.PARSED_COLUMNS)
+    collect = None if args.incremental or not in_memory else {column: [] for column in columns}
+    if not parse_journal.run(parse_journal.build_parser().parse_args(parse_argv), parse_config, collect):
+        return None
+    parsed_df = parsed_frame(collect) if collect is not None else None
+
+    print("--- (b) 聚合指標 ---")
+    outputs = aggregate_metrics.run(aggregate_metrics.build_parser().parse_args(aggregate_argv),
+                                    aggregate_config, parsed_df)
+    if outputs is None:
+        return None
+
+    if plots:
+        print("--- (c) 產生圖表與報告 ---")
+        plot_reports.run(plot_reports.build_parser().parse_args(plot_argv), plot_config, outputs, parsed_df)
+    return outputs, parsed_df
+
+def run(args):
+    return 0 if run_stages(args) is not None else 1
+
+# --- fleet 模式: 多台主機的日誌平行分析, 另外產出跨主機的彙總表 ---
+
+FLEET_STATE = 'fleet_state.json'
+# 判斷主機輸出是否完整 (略過未變更的主機時需要)
+FLEET_HOST_FILES = ('health_score.csv', 'metrics_daily.csv', 'message_counts.csv')
+
+def host_name(path):
+    """與 make_report.sh 相同, 取檔名以 '_' 分隔的前兩段, e.g., jfcrh_strg"""
+    return '_'.join(os.path.basename(path).split('_')[:2])
+
+def fleet_inputs(patterns):
+    """展開 glob, 回傳 {主機名稱: 日誌路徑}; 名稱重複時改用完整檔名 (去除副檔名)"""
+    paths = sorted({path for pattern in patterns for path in (glob.glob(pattern) or [pattern])
+                    if os.path.isfile(path)})
+    names = [host_name(path) for path in paths]
+    hosts = {}
+    for path, name in zip(paths, names):
+        if names.count(name) > 1:
+            name = os.path.splitext(os.path.basename(path))[0]
+        hosts[name] = path
+    return hosts
+
+def input_digest(path, block=1024 * 1024):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(block), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def fleet_signature(args):
+    """規則與分析參數的摘要; 改變時所有主機都需重新分析"""
+    digest = hashlib.sha1()
+    if os.path.exists(args.rules):
+        with open(args.rules, 'rb') as f:
+            digest.update(f.read())
+    digest.update(repr((args.tz, args.format, args.top_k, args.window_days, args.plots)).encode())
+    return digest.hexdigest()
+
+def fleet_host(host, logfile, host_dir, args, previous):
+    """
+    在 worker process 中分析單一主機, 回傳 (host, 狀態, state 記錄)。
+    輸入檔的 hash 與分析參數都未改變時略過; 各階段的訊息寫入 host_dir/fleet.log。
+    解析結果不留在記憶體中: 聚合以 host_dir/rollup.db 分批讀取 parsed.csv, 記憶體用量不隨日誌大小增加。
+    """
+    record = {'logfile': logfile, 'digest': input_digest(logfile), 'signature': fleet_signature(args)}
+    if (not args.force and previous
+            and all(previous.get(key) == record[key] for key in ('digest', 'signature'))
+            and all(os.path.exists(os.path.join(host_dir, name)) for name in FLEET_HOST_FILES)):
+        return host, 'skipped', dict(previous, logfile=logfile)
+
+    os.makedirs(host_dir, exist_ok=True)
+    host_args = argparse.Namespace(
+        logfile=logfile, output_dir=host_dir, rules=args.rules, tz=args.tz, format=args.format,
+        journalctl=None, workers=1, plot_workers=1, parquet=False, incremental=False,
+        rollup_db=os.path.join(host_dir, 'rollup.db'),
+        top_k=args.top_k, window_days=args.window_days, force=args.force, metrics=False, profile=None)
+    with open(os.path.join(host_dir, 'fleet.log'), 'w', encoding='utf-8') as log, contextlib.redirect_stdout(log):
+        result = run_stages(host_args, plots=args.plots, in_memory=False)
+    if result is None:
+        return host, 'failed', None
+
+    # 所有樣板的計數 (不只 Top K) 由 rollup store 取得; template_id 只在單一主機內有意義, 跨主機以樣板字串合併
+    with rollup_store.RollupStore(host_args.rollup_db, aggregate_metrics.ERROR_CODE_PATTERN) as store:
+        groups = store.message_groups()
+    counts = aggregate_metrics.finish_top_messages(groups, len(groups), aggregate_metrics.load_templates(host_dir))
+    counts.drop(columns='categories').to_csv(os.path.join(host_dir, 'message_counts.csv'))
+    record['events'] = int(groups['count'].sum())
+    return host, 'parsed', record
+
+def fleet_tables(host_dirs, top_k):
+    """由各主機的輸出建立跨主機彙總表, 回傳 {檔名: (DataFrame, 是否輸出 index)}"""
+    health, daily, messages = [], [], []
+    for host, host_dir in host_dirs.items():
+        health.append(pd.read_csv(os.path.join(host_dir, 'health_score.csv')).assign(host=host))
+        daily.append(pd.read_csv(os.path.join(host_dir, 'metrics_daily.csv')).assign(host=host))
+        messages.append(pd.read_csv(os.path.join(host_dir, 'message_counts.csv'),
+                                    dtype={'template': str}, keep_default_na=False).assign(host=host))
+    hosts = list(host_dirs)
+    health = pd.concat(health, ignore_index=True)
+    daily = pd.concat(daily, ignore_index=True)
+    messages = pd.concat(messages, ignore_index=True)
+
+    # 每台主機每日的健康分數 (date × host)
+    health_daily = health.pivot(index='date', columns='host', values='health_score').reindex(columns=hosts)
+
+    # 每台主機各類別的事件總數 (host × category)
+    category_counts = (daily.groupby(['host', 'category'])['count'].sum()
+                       .unstack(fill_value=0).reindex(hosts, fill_value=0))
+
+    # 全機群的 Top K 訊息, hosts 為出現過的主機數
+    top_messages = messages.groupby('template').agg(
+        count=('count', 'sum'), hosts=('host', 'nunique'),
+        first_seen=('first_seen', 'min'), last_seen=('last_seen', 'max'),
+    ).sort_values(by='count', ascending=False).head(top_k)
+
+    latest = health.sort_values('date').groupby('host').last()
+    summary = pd.DataFrame({
+        'events': daily.groupby('host')['count'].sum(),
+        'days': health.groupby('host').size(),
+        'latest_date': latest['date'],
+        'latest_health_score': latest['health_score'],
+        'min_health_score': health.groupby('host')['health_score'].min(),
+    }).reindex(hosts)
+    summary.index.name = 'host'
+    return {
+        'fleet_hosts.csv': summary,
+        'fleet_health_daily.csv': health_daily,
+        'fleet_category_counts.csv': category_counts,
+        'fleet_top_messages.csv': top_messages,
+    }
+
+def save_fleet_state(path, state):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+def run_fleet(args):
+    hosts = fleet_inputs(args.patterns)
+    if not hosts:
+        print(f"錯誤: 找不到符合 {' '.join(args.patterns)} 的日誌文件。")
+        return 1
+
+    state_path = os.path.join(args.output_dir, FLEET_STATE)
+    state = {}
+    if os.path.exists(state_path):
+        with open(state_path, encoding='utf-8') as f:
+            state = json.load(f)
+    # 只保留本次輸入中的主機
+    state = {host: record for host, record in state.items() if host in hosts}
+    host_dirs = {host: os.path.join(args.output_dir, f"{host}_report") for host in hosts}
+
+    print(f"--- 分析 {len(hosts)} 台主機 (workers={args.workers}) ---")
+    # 同時在記憶體中的主機數最多為 workers 個
+    failed = []
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = {executor.submit(fleet_host, host, logfile, host_dirs[host], args, state.get(host)): host
+                   for host, logfile in hosts.items()}
+        for future in as_completed(futures):
+            try:
+                host, status, record = future.result()
+            except Exception as e:
+                # worker 中未預期的錯誤 (含 OOM 造成的 BrokenProcessPool) 只讓該主機失敗
+                host, status, record = futures[future], 'failed', None
+                print(f"  {host}: 發生錯誤: {e!r}")
+            if record is None:
+                failed.append(host)
+                state.pop(host, None)
+                save_fleet_state(state_path, state)
+                print(f"  {host}: 失敗, 詳見 {os.path.join(host_dirs[host], 'fleet.log')}")
+                continue
+            state[host] = record
+            save_fleet_state(state_path, state)
+            print(f"  {host}: {'未變更, 略過' if status == 'skipped' else '完成'} ({record.get('events', 0)} 筆)")
+
+    done = {host: host_dir for host, host_dir in host_dirs.items() if host not in failed}
+    if done:
+        for name, frame in fleet_tables(done, args.top_k).items():
+            frame.to_csv(os.path.join(args.output_dir, name))
+        print(f"機群彙總表已儲存至 {args.output_dir}")
+    return 1 if failed else 0
+
+def main():
+    parser = argparse.ArgumentParser(description='在單一 process 中執行 parse → aggregate → plot。')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run_parser = subparsers.add_parser('run', help='分析日誌並產生報告')
+    run_parser.add_argument('logfile', nargs='?', help="要解析的日誌文件名; json/export 格式可用 '-' 從 stdin 讀取")
+    run_parser.add_argument('--rules', default='rules.yaml', help='分類規則與權重的 YAML 配置文件')
+    run_parser.add_argument('--output_dir', default='.', help='輸出目錄')
+    run_parser.add_argument('--tz', default='+0900', help='日誌的時區偏移, e.g., +0800')
+    run_parser.add_argument('--format', choices=('text',) + parse_journal.JOURNAL_FORMATS, help='輸入格式')
+    run_parser.add_argument('--journalctl', metavar='ARGS', help='直接讀取 journalctl 的輸出, ARGS 為額外參數')
+    run_parser.add_argument('--workers', type=int, default=1, help='平行解析的 process 數')
+    run_parser.add_argument('--plot-workers', type=int, default=os.cpu_count() or 1, help='平行繪圖的 process 數')
+    run_parser.add_argument('--parquet', action='store_true', help='另外輸出 parsed.parquet')
+    run_parser.add_argument('--incremental', action='store_true', help='依 parse_state.json 只解析新增的日誌')
+    run_parser.add_argument('--rollup-db', help='增量彙總用的 SQLite 檔案')
+    run_parser.add_argument('--top-k', type=int, default=20, help='Top K 訊息排名的 K 值')
+    run_parser.add_argument('--window-days', type=int, default=7, help='報告摘要聚焦的最近天數')
+    run_parser.add_argument('--force', action='store_true', help='忽略圖表快取, 重畫所有圖表')
+    run_parser.add_argument('--metrics', action='store_true', help='記錄各階段的耗時與處理量到 pipeline_metrics.json')
+    run_parser.add_argument('--profile', choices=pipeline_metrics.PROFILERS, help='另外輸出各階段的 profile (需要 --metrics)')
+
+    fleet_parser = subparsers.add_parser('fleet', help='平行分析多台主機的日誌並產生跨主機彙總表')
+    fleet_parser.add_argument('patterns', nargs='+', help="日誌文件或 glob, e.g., 'logs/*_journal.log'")
+    fleet_parser.add_argument('--rules', default='rules.yaml', help='分類規則與權重的 YAML 配置文件')
+    fleet_parser.add_argument('--output_dir', default='fleet_report', help='輸出目錄; 各主機輸出至 <host>_report/')
+    fleet_parser.add_argument('--tz', default='+0900', help='日誌的時區偏移, e.g., +0800')
+    fleet_parser.add_argument('--format', choices=('text',) + parse_journal.JOURNAL_FORMATS, help='輸入格式')
+    fleet_parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='同時分析的主機數')
+    fleet_parser.add_argument('--top-k', type=int, default=20, help='Top K 訊息排名的 K 值')
+    fleet_parser.add_argument('--window-days', type=int, default=7, help='報告摘要聚焦的最近天數')
+    fleet_parser.add_argument('--plots', action='store_true', help='同時產生各主機的圖表與報告')
+    fleet_parser.add_argument('--force', action='store_true', help='忽略輸入檔 hash, 重新分析所有主機')
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    return run_fleet(args) if args.command == 'fleet' else run(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,6 +2,11 @@
 
 # make_report.sh
 # 一鍵執行日誌分析工具鏈
+#
+# 用法: ./make_report.sh <log> [rules.yaml]
+#   預設每次完整重新解析與彙總，不在報告目錄留下狀態檔；以下環境變數可開啟增量模式:
+#   INCREMENTAL=1  依 parse_state.json 只解析新增的日誌
+#   ROLLUP=1       以 <report>/rollup.db 增量彙總
 
 # -e: 當命令失敗時，立即退出腳本
 # -u: 當使用未定義的變數時，視為錯誤並退出
@@ -54,24 +59,33 @@ main() {
     source "$VENV_DIR/bin/activate"
     echo "虛擬環境已啟用。"
 
-    # 3. 安裝依賴套件
-    echo "[3/5] 正在安裝/更新依賴套件..."
-    $PIP_CMD install -q --upgrade pip
-    $PIP_CMD install -q pandas seaborn matplotlib pytz pyyaml tabulate
-    echo "依賴套件安裝完成。"
+    # 3. 安裝依賴套件 (只在缺少時安裝; 以 find_spec 檢查, 不實際 import)
+    echo "[3/5] 正在檢查依賴套件..."
+    if python3 -c 'import importlib.util, sys; sys.exit(any(importlib.util.find_spec(m) is None for m in sys.argv[1:]))' \
+        pandas seaborn matplotlib pytz yaml tabulate; then
+        echo "依賴套件已安裝，略過安裝。"
+    else
+        $PIP_CMD install -q --upgrade pip
+        $PIP_CMD install -q pandas seaborn matplotlib pytz pyyaml tabulate
+        echo "依賴套件安裝完成。"
+    fi
 
     # 4. 建立輸出目錄並執行分析
     echo "[4/5] 正在建立輸出目錄並執行分析..."
     mkdir -p "$OUTPUT_DIR"
     
-    echo "--- (a) 解析日誌 ---"
-    python3 parse_journal.py "$LOG_FILE" --output_dir "$OUTPUT_DIR" --rules "$RULES_FILE"
-    
-    echo "--- (b) 聚合指標 ---"
-    python3 aggregate_metrics.py --io_dir "$OUTPUT_DIR" --rules "$RULES_FILE"
-    
-    echo "--- (c) 產生圖表與報告 ---"
-    python3 plot_reports.py --io_dir "$OUTPUT_DIR" --rules "$RULES_FILE"
+    # 解析 → 聚合 → 圖表與報告在同一個 Python process 中執行
+    local run_opts=()
+    # INCREMENTAL=1: 依 parse_state.json 只解析新增的日誌 (預設每次完整重新解析)
+    if [ "${INCREMENTAL:-0}" = "1" ]; then
+        run_opts+=(--incremental)
+    fi
+    # ROLLUP=1: 以 $OUTPUT_DIR/rollup.db 增量彙總 (預設每次由 parsed.csv 完整重算)
+    if [ "${ROLLUP:-0}" = "1" ]; then
+        run_opts+=(--rollup-db "$OUTPUT_DIR/rollup.db")
+    fi
+    python3 -m jfcrh_report run "$LOG_FILE" --output_dir "$OUTPUT_DIR" --rules "$RULES_FILE" \
+        ${run_opts[@]+"${run_opts[@]}"}
 
     # 5. 完成
     echo "[5/5] 分析流程全部完成！"
@@ -0,0 +1,591 @@
+# netdiag_analyzer.py
+"""
+netdrop_probe.sh 取樣 log (netdiag_<host>_<ts>.log) 的分析。
+
+逐行串流讀取一或多份 log, 將每個介面的 rx/tx 計數器與 softnet drops (每次取樣) 以及 SNAPSHOT 中的
+/proc/interrupts、/proc/softirqs NET_RX、ethtool -S 與 nstat 計數器 (每 10 秒) 整批轉為 NumPy 陣列, 再一次計算:
+- 每個區間的增量與速率、百分位數
+- rx_dropped 的爆量區段 (EWMA 基準的 z-score, 同 aggregate_metrics.py 的 bursts)
+- 與 rx_dropped 速率相關的計數器 (softnet drops、IRQ / NET_RX 分布不均等), 以 Pearson 相關係數與爆量期間的平均值判斷
+
+    python3 netdiag_analyzer.py netdiag_host1_20251006T105518.log [...] --output-dir netdiag_out
+
+輸出 netdiag_summary.json、netdiag_bursts.csv、netdiag_correlations.csv (--intervals 時另有 netdiag_intervals.csv)。
+判斷門檻與 server_health_full.sh 的 check_nic 相同 (NIC_WARN_MIN_DELTA 等環境變數可覆寫)。
+"""
+import argparse
+import json
+import os
+import re
+import sys
+from array import array
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+# 爆量偵測的預設設定 (min_rate 為 rx_dropped / 秒)
+DEFAULT_BURSTS = {'halflife': '5m', 'z': 5.0, 'min_rate': 0.5, 'merge_gap': '10s'}
+DEFAULT_MIN_CORR = 0.5
+# 間隔超過取樣間隔中位數的倍數時視為中斷 (e.g., 兩份 log 之間), 不計算增量
+DEFAULT_MAX_GAP_FACTOR = 5
+# 與 server_health_full.sh 的 check_nic 相同的門檻 (環境變數可覆寫)
+NIC_THRESHOLDS = {
+    'NIC_WARN_MIN_DELTA': 100,
+    'NIC_WARN_MIN_PCT': 0.01,
+    'NIC_WARN_MIN_RX_DROP_RATE': 0.5,
+    'NIC_RATE_MIN_DELTA': 200,
+    'NIC_MIN_WINDOW_SEC': 180,
+    'NIC_MIN_RX_PKTS': 50000,
+}
+
+# 取樣行: timestamp iface rx_pkts rx_drop tx_pkts tx_drop softnet_drops
+SAMPLE_FIELDS = ('rx_pkts', 'rx_drop', 'tx_pkts', 'tx_drop', 'softnet_drops')
+PERCENTILES = (50, 95, 99)
+
+BURST_COLUMNS = ['host', 'iface', 'start', 'end', 'seconds', 'rx_dropped', 'peak_rate', 'baseline', 'peak_z',
+                 'rx_pkts_rate', 'softnet_drops']
+CORRELATION_COLUMNS = ['host', 'iface', 'counter', 'source', 'intervals', 'corr', 'spike_mean', 'baseline_mean',
+                       'flagged']
+INTERVAL_COLUMNS = ['host', 'iface', 'start', 'seconds', 'rx_pkts_rate', 'rx_drop_rate', 'tx_pkts_rate',
+                    'tx_drop_rate', 'softnet_drop_rate', 'burst']
+
+def parse_seconds(value):
+    """'30s' / '5m' / '1h' 或數字 (秒)"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = re.fullmatch(r'\s*([0-9.]+)\s*([smh]?)\s*', str(value))
+    if not match:
+        raise ValueError(f"無法解析時間長度 '{value}'")
+    return float(match.group(1)) * {'': 1, 's': 1, 'm': 60, 'h': 3600}[match.group(2)]
+
+def parse_iso(text):
+    """ISO 8601 時間; 沒有時區時視為本機時間"""
+    parsed = datetime.fromisoformat(text)
+    return parsed if parsed.tzinfo is not None else parsed.astimezone()
+
+class Series:
+    """
+    累積的時間序列; width > 1 時每筆為一個向量 (e.g., 各 CPU 的中斷次數)。
+    逐筆的資料以 array 累積, 整批解析的資料以 NumPy 區塊累積, arrays() 時才合併。
+    """
+
+    def __init__(self, width=1):
+        self.width = width
+        self.ts = array('q')
+        self.seg = array('l')
+        self.values = array('q')
+        self.blocks = []
+
+    def add(self, ts, seg, values):
+        self.ts.append(ts)
+        self.seg.append(seg)
+        if self.width == 1:
+            self.values.append(values)
+        else:
+            self.values.extend(values)
+
+    def add_block(self, ts, seg, values):
+        self.blocks.append((ts, np.full(len(ts), seg, dtype=np.int64), values.reshape(len(ts), -1)))
+
+    def arrays(self):
+        """依時間排序的 (ts, seg, values); values 為 (筆數,) 或 (筆數, width)"""
+        parts = [(np.asarray(self.ts, dtype=np.int64), np.asarray(self.seg, dtype=np.int64),
+                  np.asarray(self.values, dtype=np.int64).reshape(len(self.ts), self.width))]
+        parts.extend(self.blocks)
+        ts, seg, values = (np.concatenate([part[i] for part in parts]) for i in range(3))
+        if self.width == 1:
+            values = values[:, 0]
+        order = np.argsort(ts, kind='stable')
+        return ts[order], seg[order], values[order]
+
+# 整批解析取樣行時取出 'timestamp iface'
+SAMPLE_HEAD = re.compile(r'^(\S+)[ \t]+(\S+)', re.M)
+# 累積到這麼多行取樣時整批解析 (限制記憶體用量)
+SAMPLE_BATCH = 50000
+
+class NetdiagData:
+    """所有 log 的計數器; host 來自 log 的 'Host:' 行 (沒有時取檔名)"""
+
+    def __init__(self):
+        self.samples = {}   # (host, iface) → Series (每筆為 SAMPLE_FIELDS 的向量)
+        self.host_counters = {}   # host → {計數器: Series} (nstat)
+        self.iface_counters = {}  # (host, iface) → {計數器: Series} (ethtool -S)
+        self.irq = {}       # (host, iface) → Series (各 CPU 的中斷次數總和)
+        self.softirq = {}   # host → Series (各 CPU 的 NET_RX 次數)
+        self.tz = {}        # host → 第一筆取樣的時區
+        self.logs = []
+        self._epochs = {}
+
+    def epoch(self, text):
+        """date -Iseconds 的時間字串 → epoch 秒; 同一時間字串只解析一次"""
+        epoch = self._epochs.get(text)
+        if epoch is None:
+            epoch = self._epochs[text] = int(parse_iso(text).timestamp())
+        return epoch
+
+    def read_log(self, path):
+        """
+        逐行讀取, 每行只做分類: 取樣行與 IRQ 行先累積, 再整批以 NumPy 解析;
+        nstat / ethtool / softirqs 逐行解析, ip -s link 與 tc 的輸出略過。
+        """
+        seg = len(self.logs)
+        self.logs.append(path)
+        match = re.match(r'netdiag_(.+)_\d{8}T\d{6}\.log$', os.path.basename(path))
+        host = match.group(1) if match else os.path.basename(path)
+        snapshot_ts = None
+        section = iface = None
+        sample_lines, irq_lines = [], []
+
+        def flush_samples():
+            if sample_lines:
+                self._add_samples(host, seg, sample_lines)
+            sample_lines.clear()
+
+        def flush_irq():
+            if irq_lines and snapshot_ts is not None:
+                self._add_irq(host, iface, snapshot_ts, seg, irq_lines)
+            irq_lines.clear()
+
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            for line in f:
+                first = line[:1]
+                # 依出現頻率判斷: IRQ 行、取樣行、略過的區段
+                if section == 'irq' and (first == ' ' or first.isdigit() and line[10:11] != 'T'):
+                    irq_lines.append(line)
+                    continue
+                if line[10:11] == 'T' and first.isdigit():
+                    sample_lines.append(line)
+                    if len(sample_lines) >= SAMPLE_BATCH:
+                        flush_samples()
+                    continue
+                if section == 'skip' and first not in '#-=\n':
+                    continue
+                if line.startswith('---- SNAPSHOT ') or line.startswith('==== FINAL SNAPSHOTS '):
+                    flush_irq()
+                    try:
+                        snapshot_ts = self.epoch(line.split()[2])
+                    except (IndexError, ValueError):
+                        snapshot_ts = None
+                    section = None
+                elif line.startswith('-- '):
+                    flush_irq()
+                    section = ('softirq' if line.startswith('-- /proc/softirqs') else
+                               'nstat' if line.startswith('-- nstat') else
+                               'skip' if line.startswith(('-- ip -s link', '-- qdisc')) else None)
+                elif line.startswith('## '):
+                    flush_irq()
+                    words = line.split()
+                    if line.startswith('## IRQ for ') and len(words) >= 4:
+                        section, iface = 'irq', words[3]
+                    elif line.startswith('## ethtool -S ') and len(words) >= 4:
+                        section, iface = 'ethtool', words[3]
+                    else:
+                        section = 'skip'
+                elif line.startswith('Host: ') and snapshot_ts is None and len(line.split()) > 1:
+                    host = line.split()[1]
+                elif first in '\n=':
+                    flush_irq()
+                    section = None
+                elif section is None or snapshot_ts is None:
+                    continue
+                elif section == 'ethtool':
+                    name, _, value = line.partition(':')
+                    value = value.strip()
+                    if value.isdigit():
+                        counters = self.iface_counters.setdefault((host, iface), {})
+                        counters.setdefault(name.strip(), Series()).add(snapshot_ts, seg, int(value))
+                elif section == 'nstat':
+                    fields = line.split()
+                    if len(fields) >= 2 and fields[1].isdigit() and not fields[0].startswith('#'):
+                        counters = self.host_counters.setdefault(host, {})
+                        counters.setdefault(fields[0], Series()).add(snapshot_ts, seg, int(fields[1]))
+                elif section == 'softirq' and 'NET_RX:' in line:
+                    values = np.fromstring(line.split(':', 1)[1], dtype=np.int64, sep=' ')
+                    series = self.softirq.get(host)
+                    if series is None:
+                        series = self.softirq[host] = Series(len(values))
+                    if len(values) == series.width:
+                        series.add(snapshot_ts, seg, values)
+            flush_irq()
+            flush_samples()
+
+    def _add_samples(self, host, seg, lines):
+        """一批取樣行: 時間與介面以 regex 取出, 5 個計數器一次轉為 (行數, 5) 的陣列, 再依介面分組"""
+        text = ''.join(lines)
+        heads = SAMPLE_HEAD.findall(text)
+        values = np.fromstring(SAMPLE_HEAD.sub('', text), dtype=np.int64, sep=' ')
+        if len(values) != len(heads) * len(SAMPLE_FIELDS):
+            # 有格式不符的行時逐行解析
+            rows = [line.split() for line in lines]
+            rows = [row for row in rows if len(row) == 7 and all(value.isdigit() for value in row[2:])]
+            heads = [(row[0], row[1]) for row in rows]
+            values = np.array([row[2:] for row in rows], dtype=np.int64)
+        if not heads:
+            return
+        ts = np.fromiter((self.epoch(text) for text, _ in heads), dtype=np.int64, count=len(heads))
+        codes = {}
+        iface_index = np.fromiter((codes.setdefault(name, len(codes)) for _, name in heads), dtype=np.int64,
+                                  count=len(heads))
+        values = values.reshape(len(heads), len(SAMPLE_FIELDS))
+        for name, code in codes.items():
+            series = self.samples.get((host, name))
+            if series is None:
+                series = self.samples[(host, name)] = Series(len(SAMPLE_FIELDS))
+                self.tz.setdefault(host, parse_iso(heads[int(np.argmax(iface_index == code))][0]).tzinfo)
+            mask = iface_index == code
+            series.add_block(ts[mask], seg, values[mask])
+
+    def _add_irq(self, host, iface, ts, seg, lines):
+        """
+        同一介面的所有 IRQ 行一次轉為 (行數, CPU 數) 的陣列, 各 CPU 加總;
+        CPU 數取第一行 'IRQ:' 之後連續的數字欄位數, 每行只切出這些欄位。
+        """
+        rows = [line.split() for line in lines[:1]]
+        if not rows or not rows[0][0].endswith(':'):
+            return
+        width = 0
+        for field in rows[0][1:]:
+            if not field.isdigit():
+                break
+            width += 1
+        rows = [line.split(None, width + 1) for line in lines]
+        rows = [' '.join(row[1:width + 1]) for row in rows if len(row) > width and row[0].endswith(':')]
+        values = np.fromstring(' '.join(rows), dtype=np.int64, sep=' ') if width else np.empty(0)
+        if len(values) != len(rows) * width:
+            return
+        series = self.irq.get((host, iface))
+        if series is None:
+            series = self.irq[(host, iface)] = Series(width)
+        if series.width == width:
+            series.add(ts, seg, values.reshape(len(rows), width).sum(axis=0))
+
+def interval_mask(ts, seg, gap_factor):
+    """相鄰兩筆之間可計算增量的區間: 同一份 log、時間遞增且不超過取樣間隔中位數的 gap_factor 倍"""
+    dt = np.diff(ts)
+    step = max(float(np.median(dt)), 1.0) if len(dt) else 1.0
+    return (np.diff(seg) == 0) & (dt > 0) & (dt <= step * gap_factor), dt
+
+def counter_deltas(values, valid):
+    """計數器的增量; 無效區間與計數器歸零 (負增量) 為 NaN"""
+    delta = np.diff(values, axis=0).astype(np.float64)
+    delta[~valid] = np.nan
+    delta[delta < 0] = np.nan
+    return delta
+
+def detect_bursts(ts, drop, dt, burst_config):
+    """
+    rx_dropped 增量的爆量區間, 算法同 aggregate_metrics.detect_bursts:
+    z = (drop - baseline) / sqrt(max(EWMA 變異數, baseline) + 1), baseline 與變異數只用前一區間以前的資料。
+    速率與 z 都超過門檻的區間為爆量, 間隔不超過 merge_gap 的合併為一段。
+    回傳 (各段的起訖區間 index, 各區間是否屬於爆量段, baseline, z)
+    """
+    n = len(drop)
+    if not n:
+        return np.zeros((0, 2), dtype=np.int64), np.zeros(0, dtype=bool), np.zeros(0), np.zeros(0)
+    step = float(np.median(dt)) or 1.0
+    halflife = max(parse_seconds(burst_config['halflife']) / step, 1.0)
+    filled = np.nan_to_num(drop)
+    mean, square_mean = (pd.Series(values, copy=False).ewm(halflife=halflife, adjust=False).mean().to_numpy()
+                         for values in (filled, filled * filled))
+    baseline = np.concatenate([[0.0], mean[:-1]])
+    variance = np.maximum(np.concatenate([[0.0], square_mean[:-1]]) - baseline ** 2, 0.0)
+    z = (filled - baseline) / np.sqrt(np.maximum(variance, baseline) + 1)
+    rate = filled / np.maximum(dt, 1)
+    hot = np.flatnonzero((rate >= float(burst_config['min_rate'])) & (z >= float(burst_config['z'])))
+    in_burst = np.zeros(n, dtype=bool)
+    if not len(hot):
+        return np.zeros((0, 2), dtype=np.int64), in_burst, baseline, z
+    # 上一個爆量區間結束到下一個開始超過 merge_gap 處切成新的一段
+    gaps = ts[hot[1:]] - ts[hot[:-1] + 1]
+    breaks = np.flatnonzero(gaps > parse_seconds(burst_config['merge_gap'])) + 1
+    starts = hot[np.concatenate([[0], breaks])]
+    ends = hot[np.concatenate([breaks - 1, [len(hot) - 1]])]
+    marks = np.zeros(n + 1, dtype=np.int64)
+    np.add.at(marks, starts, 1)
+    np.add.at(marks, ends + 1, -1)
+    in_burst = np.cumsum(marks[:-1]) > 0
+    return np.column_stack([starts, ends]), in_burst, baseline, z
+
+def grouped_pearson(group, x, y, groups):
+    """依 group 分組的 Pearson 相關係數 (兩階段: 先求平均再求離差乘積, 避免大數相減的誤差)"""
+    n = np.bincount(group, minlength=groups).astype(np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_x = np.bincount(group, weights=x, minlength=groups) / n
+        mean_y = np.bincount(group, weights=y, minlength=groups) / n
+        dx, dy = x - mean_x[group], y - mean_y[group]
+        sxy = np.bincount(group, weights=dx * dy, minlength=groups)
+        sxx = np.bincount(group, weights=dx * dx, minlength=groups)
+        syy = np.bincount(group, weights=dy * dy, minlength=groups)
+        return n, sxy / np.sqrt(sxx * syy)
+
+def candidate_intervals(data, host, iface, sample, gap_factor):
+    """
+    可能與 rx_dropped 相關的計數器, 各自以其取樣點切成區間: [(名稱, 來源, 區間起點, 終點, 數值)]。
+    累計計數器取區間速率; IRQ / NET_RX 另外計算分布不均 (區間內最多的 CPU 佔總數的比例)。
+    """
+    candidates = []
+
+    def add_counter(name, source, ts, seg, values):
+        if len(ts) < 2:
+            return
+        valid, dt = interval_mask(ts, seg, gap_factor)
+        delta = counter_deltas(values, valid)
+        keep = ~np.isnan(delta)
+        candidates.append((name, source, ts[:-1][keep], ts[1:][keep], delta[keep] / dt[keep]))
+
+    def add_vector(name, source, series):
+        ts, seg, values = series.arrays()
+        if len(ts) < 2:
+            return
+        valid, dt = interval_mask(ts, seg, gap_factor)
+        delta = counter_deltas(values, valid)
+        keep = ~np.isnan(delta).any(axis=1)
+        delta, start, end, dt = delta[keep], ts[:-1][keep], ts[1:][keep], dt[keep]
+        total = delta.sum(axis=1)
+        candidates.append((f'{name}_rate', source, start, end, total / dt))
+        busy = total > 0
+        candidates.append((f'{name}_max_cpu_share', source, start[busy], end[busy],
+                           delta[busy].max(axis=1) / total[busy]))
+
+    ts, seg, values = sample
+    for name in ('rx_pkts', 'tx_drop', 'softnet_drops'):
+        add_counter(name, 'sample', ts, seg, values[:, SAMPLE_FIELDS.index(name)])
+    for name, series in sorted(data.iface_counters.get((host, iface), {}).items()):
+        add_counter(name, 'ethtool', *series.arrays())
+    for name, series in sorted(data.host_counters.get(host, {}).items()):
+        add_counter(name, 'nstat', *series.arrays())
+    if (host, iface) in data.irq:
+        add_vector('irq', 'interrupts', data.irq[(host, iface)])
+    if host in data.softirq:
+        add_vector('net_rx_softirq', 'softirqs', data.softirq[host])
+    return candidates
+
+def correlate(candidates, ts, cum_drop, windows, min_corr):
+    """
+    所有候選計數器一次計算: 以累計 rx_dropped 在區間端點的內插值求區間內的 rx_dropped 速率,
+    與計數器數值分組計算相關係數; 與爆量段重疊的區間另外計算平均值。
+    """
+    if not candidates or len(ts) < 2:
+        return []
+    group = np.concatenate([np.full(len(start), i) for i, (_, _, start, _, _) in enumerate(candidates)])
+    start = np.concatenate([c[2] for c in candidates]).astype(np.float64)
+    end = np.concatenate([c[3] for c in candidates]).astype(np.float64)
+    y = np.concatenate([c[4] for c in candidates]).astype(np.float64)
+    # 只使用完全落在取樣範圍內的區間
+    inside = (start >= ts[0]) & (end <= ts[-1])
+    group, start, end, y = group[inside], start[inside], end[inside], y[inside]
+    x = (np.interp(end, ts, cum_drop) - np.interp(start, ts, cum_drop)) / (end - start)
+
+    # 區間是否與任一爆量段 [起, 訖] 重疊 (各段依時間排序且不重疊)
+    spike = np.zeros(len(start), dtype=bool)
+    if len(windows):
+        window_start, window_end = ts[windows[:, 0]], ts[windows[:, 1] + 1]
+        first = np.searchsorted(window_end, start, side='right')
+        has_window = first < len(windows)
+        spike[has_window] = window_start[first[has_window]] < end[has_window]
+
+    groups = len(candidates)
+    n, corr = grouped_pearson(group, x, y, groups)
+    spike_n = np.bincount(group, weights=spike, minlength=groups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        spike_mean = np.bincount(group, weights=np.where(spike, y, 0), minlength=groups) / spike_n
+        baseline_mean = np.bincount(group, weights=np.where(spike, 0, y), minlength=groups) / (n - spike_n)
+    rows = []
+    for i, (name, source, _, _, _) in enumerate(candidates):
+        if n[i] < 3:
+            continue
+        r = None if np.isnan(corr[i]) else round(float(corr[i]), 3)
+        spike_value = None if np.isnan(spike_mean[i]) else round(float(spike_mean[i]), 4)
+        baseline_value = None if np.isnan(baseline_mean[i]) else round(float(baseline_mean[i]), 4)
+        # 相關係數達門檻, 且有爆量段時需在爆量期間較高
+        flagged = (r is not None and r >= min_corr
+                   and (spike_value is None or baseline_value is None or spike_value > baseline_value))
+        rows.append({'counter': name, 'source': source, 'intervals': int(n[i]), 'corr': r,
+                     'spike_mean': spike_value, 'baseline_mean': baseline_value, 'flagged': flagged})
+    return rows
+
+def nic_verdict(d_rx_drop, d_rx_pkts, window, drop_pct, rate, thresholds):
+    """與 check_nic 相同的判斷: 樣本不足時為 SAMPLE, 符合任一條件為 WARN"""
+    if window < thresholds['NIC_MIN_WINDOW_SEC'] or d_rx_pkts < thresholds['NIC_MIN_RX_PKTS']:
+        return 'SAMPLE', []
+    hits = []
+    if d_rx_drop >= thresholds['NIC_WARN_MIN_DELTA']:
+        hits.append(f"Δrx_dropped ≥ {thresholds['NIC_WARN_MIN_DELTA']}")
+    if drop_pct >= thresholds['NIC_WARN_MIN_PCT'] and d_rx_drop >= thresholds['NIC_RATE_MIN_DELTA']:
+        hits.append(f"drop% ≥ {thresholds['NIC_WARN_MIN_PCT']}%")
+    if rate >= thresholds['NIC_WARN_MIN_RX_DROP_RATE'] and d_rx_drop >= thresholds['NIC_RATE_MIN_DELTA']:
+        hits.append(f"rx_drop_rate ≥ {thresholds['NIC_WARN_MIN_RX_DROP_RATE']}/s")
+    return ('WARN' if hits else 'PASS'), hits
+
+def percentiles(values, keys=PERCENTILES):
+    values = values[~np.isnan(values)]
+    if not len(values):
+        return {}
+    result = {f'p{key}': round(float(value), 4) for key, value in zip(keys, np.percentile(values, keys))}
+    result['max'] = round(float(values.max()), 4)
+    result['mean'] = round(float(values.mean()), 4)
+    return result
+
+def analyze_interface(data, host, iface, config, intervals=None):
+    """回傳 (摘要, 爆量段, 相關計數器); intervals 為 list 時附加每個區間的速率"""
+    sample = data.samples[(host, iface)].arrays()
+    ts, seg, matrix = sample
+    summary = {'host': host, 'iface': iface, 'samples': int(len(ts))}
+    if len(ts) < 2:
+        return summary, [], []
+    tz = data.tz.get(host, timezone.utc)
+    fmt = lambda epoch: datetime.fromtimestamp(int(epoch), tz).isoformat()
+
+    valid, dt = interval_mask(ts, seg, config['max_gap_factor'])
+    # 所有欄位一次計算增量與速率
+    delta_matrix = counter_deltas(matrix, valid)
+    rate_matrix = delta_matrix / dt[:, None]
+    deltas = {name: delta_matrix[:, i] for i, name in enumerate(SAMPLE_FIELDS)}
+    rates = {name: rate_matrix[:, i] for i, name in enumerate(SAMPLE_FIELDS)}
+    covered = float(dt[valid].sum())
+    totals = {name: int(np.nansum(deltas[name])) for name in SAMPLE_FIELDS}
+    # 與 check_nic 相同: Δrx_dropped / Δrx_packets
+    drop_pct = totals['rx_drop'] / totals['rx_pkts'] * 100 if totals['rx_pkts'] else 0.0
+    mean_rate = totals['rx_drop'] / covered if covered else 0.0
+
+    windows, in_burst, baseline, z = detect_bursts(ts, deltas['rx_drop'], dt, config['bursts'])
+    drop = np.nan_to_num(deltas['rx_drop'])
+    cum_drop = np.concatenate([[0.0], np.cumsum(drop)])
+    cum_pkts = np.concatenate([[0.0], np.cumsum(np.nan_to_num(deltas['rx_pkts']))])
+    cum_softnet = np.concatenate([[0.0], np.cumsum(np.nan_to_num(deltas['softnet_drops']))])
+    bursts = []
+    for first, last in windows:
+        seconds = float(ts[last + 1] - ts[first])
+        bursts.append({
+            'host': host, 'iface': iface, 'start': fmt(ts[first]), 'end': fmt(ts[last + 1]),
+            'seconds': int(seconds),
+            'rx_dropped': int(cum_drop[last + 1] - cum_drop[first]),
+            'peak_rate': round(float(np.nanmax(rates['rx_drop'][first:last + 1])), 3),
+            'baseline': round(float(baseline[first]), 3),
+            'peak_z': round(float(z[first:last + 1].max()), 2),
+            'rx_pkts_rate': round((cum_pkts[last + 1] - cum_pkts[first]) / seconds, 1) if seconds else None,
+            'softnet_drops': int(cum_softnet[last + 1] - cum_softnet[first]),
+        })
+    burst_drops = sum(burst['rx_dropped'] for burst in bursts)
+
+    candidates = candidate_intervals(data, host, iface, sample, config['max_gap_factor'])
+    correlations = correlate(candidates, ts.astype(np.float64), cum_drop, windows, config['min_corr'])
+    for row in correlations:
+        row.update(host=host, iface=iface)
+    status, hits = nic_verdict(totals['rx_drop'], totals['rx_pkts'], covered, drop_pct, mean_rate,
+                               config['thresholds'])
+
+    summary.update({
+        'start': fmt(ts[0]), 'end': fmt(ts[-1]), 'interval_seconds': float(np.median(dt)),
+        'covered_seconds': int(covered), 'gaps': int((~valid).sum()),
+        'totals': totals,
+        'drop_pct': round(drop_pct, 6),
+        'rx_drop_rate': {'mean_over_window': round(mean_rate, 4), **percentiles(rates['rx_drop'])},
+        'rx_pkts_rate': percentiles(rates['rx_pkts']),
+        'tx_drop_rate': percentiles(rates['tx_drop']),
+        'softnet_drop_rate': percentiles(rates['softnet_drops']),
+        'bursts': {'count': len(bursts), 'seconds': int(sum(burst['seconds'] for burst in bursts)),
+                   'rx_dropped': burst_drops,
+                   'share': round(burst_drops / totals['rx_drop'], 4) if totals['rx_drop'] else 0.0},
+        'correlated': [row['counter'] for row in sorted(correlations, key=lambda row: -(row['corr'] or 0))
+                       if row['flagged']],
+        'verdict': {'status': status, 'hits': hits},
+    })
+    if intervals is not None:
+        keep = np.flatnonzero(valid)
+        intervals.append(pd.DataFrame({
+            'host': host, 'iface': iface,
+            'start': [fmt(epoch) for epoch in ts[keep]],
+            'seconds': dt[keep],
+            'rx_pkts_rate': np.round(rates['rx_pkts'][keep], 3),
+            'rx_drop_rate': np.round(rates['rx_drop'][keep], 3),
+            'tx_pkts_rate': np.round(rates['tx_pkts'][keep], 3),
+            'tx_drop_rate': np.round(rates['tx_drop'][keep], 3),
+            'softnet_drop_rate': np.round(rates['softnet_drops'][keep], 3),
+            'burst': in_burst[keep].astype(np.int8),
+        }, columns=INTERVAL_COLUMNS))
+    return summary, bursts, correlations
+
+def nic_thresholds():
+    thresholds = {}
+    for name, default in NIC_THRESHOLDS.items():
+        try:
+            thresholds[name] = float(os.environ.get(name, default))
+        except ValueError:
+            thresholds[name] = float(default)
+    return thresholds
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='分析 netdrop_probe.sh 的取樣 log。')
+    parser.add_argument('logs', nargs='+', help='netdiag_<host>_<ts>.log (可多份, 依時間合併)')
+    parser.add_argument('--output-dir', default='.', help='輸出目錄 (預設: 目前目錄)')
+    parser.add_argument('--halflife', default=DEFAULT_BURSTS['halflife'], help='爆量基準的 EWMA 半衰期 (s/m/h)')
+    parser.add_argument('--z', type=float, default=DEFAULT_BURSTS['z'], help='爆量的 z-score 門檻')
+    parser.add_argument('--min-rate', type=float, default=DEFAULT_BURSTS['min_rate'],
+                        help='爆量的最低 rx_dropped 速率 (/s)')
+    parser.add_argument('--merge-gap', default=DEFAULT_BURSTS['merge_gap'], help='合併爆量區間的最大間隔 (s/m/h)')
+    parser.add_argument('--min-corr', type=float, default=DEFAULT_MIN_CORR, help='標記相關計數器的相關係數門檻')
+    parser.add_argument('--max-gap-factor', type=float, default=DEFAULT_MAX_GAP_FACTOR,
+                        help='間隔超過取樣間隔中位數的倍數時視為中斷')
+    parser.add_argument('--intervals', action='store_true', help='另外寫出每個區間的速率 (netdiag_intervals.csv)')
+    return parser
+
+def main():
+    args = build_parser().parse_args()
+    config = {
+        'bursts': {'halflife': args.halflife, 'z': args.z, 'min_rate': args.min_rate, 'merge_gap': args.merge_gap},
+        'min_corr': args.min_corr,
+        'max_gap_factor': args.max_gap_factor,
+        'thresholds': nic_thresholds(),
+    }
+    try:
+        for key in ('halflife', 'merge_gap'):
+            parse_seconds(config['bursts'][key])
+    except ValueError as e:
+        print(f"錯誤: {e}", file=sys.stderr)
+        return 1
+
+    data = NetdiagData()
+    for path in args.logs:
+        try:
+            data.read_log(path)
+        except OSError as e:
+            print(f"錯誤: 無法讀取 {path}: {e}", file=sys.stderr)
+            return 1
+    if not data.samples:
+        print("錯誤: log 中沒有取樣資料。", file=sys.stderr)
+        return 1
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    summaries, bursts, correlations = [], [], []
+    intervals = [] if args.intervals else None
+    for host, iface in sorted(data.samples):
+        summary, iface_bursts, iface_correlations = analyze_interface(data, host, iface, config, intervals)
+        summaries.append(summary)
+        bursts.extend(iface_bursts)
+        correlations.extend(iface_correlations)
+        if 'verdict' in summary:
+            rate = summary['rx_drop_rate']
+            print(f"[{summary['verdict']['status']}] {host} {iface}: Δrx_dropped={summary['totals']['rx_drop']} "
+                  f"drop={summary['drop_pct']:.4f}% p99={rate.get('p99', 0)}/s max={rate.get('max', 0)}/s "
+                  f"bursts={summary['bursts']['count']} correlated={','.join(summary['correlated']) or '-'}")
+
+    with open(os.path.join(args.output_dir, 'netdiag_summary.json'), 'w', encoding='utf-8') as f:
+        json.dump({'generated': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                   'logs': data.logs,
+                   'config': {**config['bursts'], 'min_corr': config['min_corr'],
+                              'max_gap_factor': config['max_gap_factor'], **config['thresholds']},
+                   'interfaces': summaries}, f, ensure_ascii=False, indent=2)
+    pd.DataFrame(bursts, columns=BURST_COLUMNS).to_csv(
+        os.path.join(args.output_dir, 'netdiag_bursts.csv'), index=False)
+    pd.DataFrame(correlations, columns=CORRELATION_COLUMNS).to_csv(
+        os.path.join(args.output_dir, 'netdiag_correlations.csv'), index=False)
+    if intervals is not None:
+        frame = pd.concat(intervals) if intervals else pd.DataFrame(columns=INTERVAL_COLUMNS)
+        frame.to_csv(os.path.join(args.output_dir, 'netdiag_intervals.csv'), index=False)
+    print(f"輸出: {args.output_dir}/netdiag_summary.json, netdiag_bursts.csv, netdiag_correlations.csv")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -5,6 +5,7 @@
 #   sudo IFACES="ens12f0np0 ens1f0np0" DURATION=300 INTERVAL=1 ./netdrop_probe.sh
 #
 # 產物：./netdiag_${HOSTNAME}_YYYYmmddTHHMMSS.log
+#       ./netdiag_${HOSTNAME}_YYYYmmddTHHMMSS/ (netdiag_analyzer.py 的 summary/bursts/correlations；NETDIAG_ANALYZER_DISABLE=1 關閉)
 
 set -euo pipefail
 
@@ -12,6 +13,7 @@ set -euo pipefail
 DURATION="${DURATION:-180}"   # 總秒數
 INTERVAL="${INTERVAL:-1}"     # 取樣間隔秒
 OUT="netdiag_$(hostname)_$(date +%Y%m%dT%H%M%S).log"
+: "${NETDIAG_ANALYZER_PY:=$(dirname "$(readlink -f "${BASH_SOURCE[0]}")")/netdiag_analyzer.py}"
 
 ts() { date -Iseconds; }
 
@@ -145,3 +147,9 @@ done
 } | tee -a "$OUT"
 
 echo "Saved log: $OUT"
+
+# ---- 離線分析：增量/速率/突發與相關計數器（沒有 python3 / numpy 就略過）----
+if [[ "${NETDIAG_ANALYZER_DISABLE:-0}" -ne 1 && -f "$NETDIAG_ANALYZER_PY" ]] && has python3; then
+  python3 "$NETDIAG_ANALYZER_PY" "$OUT" --output-dir "${OUT%.log}" \
+    || echo "WARN: netdiag_analyzer.py failed; raw log kept at $OUT" >&2
+fi
@@ -1,12 +1,38 @@
 # parse_journal.py
 import argparse
+import collections
+import contextlib
+import csv
+import functools
+import hashlib
+import io
+import itertools
 import json
+import os
 import re
-from datetime import datetime, timezone
-import pandas as pd
+import shlex
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
 import pytz
 import yaml
 
+import pipeline_metrics
+from template_miner import WILDCARD, TemplateMiner
+
+# 找不到配置文件時使用的預設分類規則
+DEFAULT_CATEGORIES = {
+    'RAID_FW': ['megasas|megaraid_sas|FW in FAULT|storcli'],
+    'FSCRYPT_EXT4': ['fscrypt', 'ext4_bio_write_folio'],
+    'CIFS_SMB': ['CIFS: VFS', 'cifs_mount', 'Dialect not supported', 'return code = -95', 'return code = -101'],
+    'FWUPD': ['Failed to start Refresh fwupd metadata'],
+    'SMARTD_NOTIFY': ['smartd.*(10mail|/usr/bin/mail|mailutils)'],
+    'NET_IFACE_MISSING': ['networkctl.*not found', 'docker0 not found', 'veth.*not found', 'br-.* not found'],
+    'SUDO_AUTH': ['incorrect password', 'pam_unix.*auth'],
+    'OTHER': ['.*']
+}
+
 def load_config(config_path='rules.yaml'):
     """載入 YAML 配置文件"""
     try:
@@ -14,18 +40,7 @@ def load_config(config_path='rules.yaml'):
             return yaml.safe_load(f)
     except FileNotFoundError:
         print(f"警告: 配置文件 '{config_path}' 未找到，將使用預設規則。")
-        return {
-            'categories': {
-                'RAID_FW': ['megasas|megaraid_sas|FW in FAULT|storcli'],
-                'FSCRYPT_EXT4': ['fscrypt', 'ext4_bio_write_folio'],
-                'CIFS_SMB': ['CIFS: VFS', 'cifs_mount', 'Dialect not supported', 'return code = -95', 'return code = -101'],
-                'FWUPD': ['Failed to start Refresh fwupd metadata'],
-                'SMARTD_NOTIFY': ['smartd.*(10mail|/usr/bin/mail|mailutils)'],
-                'NET_IFACE_MISSING': ['networkctl.*not found', 'docker0 not found', 'veth.*not found', 'br-.* not found'],
-                'SUDO_AUTH': ['incorrect password', 'pam_unix.*auth'],
-                'OTHER': ['.*']
-            }
-        }
+        return {'categories': DEFAULT_CATEGORIES}
 
 def classify_message(message, categories):
     """根據規則對訊息進行分類"""
@@ -35,6 +50,136 @@ def classify_message(message, categories):
                 return category
     return 'OTHER'
 
+# 不含任何 regex 特殊字元的規則可視為純字串, 以子字串比對取代 re.search
+REGEX_META_CHARS = set('.^$*+?{}[]\\|()')
+
+class MessageClassifier:
+    """
+    預先編譯的分類器, 結果與 classify_message 完全一致。
+    - 每個類別的純字串規則 (ASCII) 以小寫子字串比對處理
+    - 其餘 regex 規則合併為單一預編譯的 alternation (含捕獲群組或 inline flag 的規則另外編譯)
+    - 以 LRU 快取重複出現的訊息
+    """
+
+    def __init__(self, categories, cache_size=65536):
+        self.rules = []
+        for category, patterns in categories.items():
+            literals = []
+            regexes = []
+            for pattern in patterns:
+                if pattern.isascii() and not REGEX_META_CHARS.intersection(pattern):
+                    literals.append(pattern)
+                else:
+                    regexes.append(pattern)
+            self.rules.append((
+                category,
+                tuple(p.lower() for p in literals),
+                self._compile(re.escape(p) for p in literals),
+                self._compile(regexes),
+            ))
+        self.classify = functools.lru_cache(maxsize=cache_size)(self._classify)
+
+    @staticmethod
+    def _compile(patterns):
+        """
+        將多個規則合併為一個 regex。含捕獲群組 (合併後群組編號改變, 反向參照會失效) 或
+        inline flag (合併後會套用到其他規則) 的規則逐一編譯; 合併失敗時也逐一編譯。
+        """
+        compiled = [re.compile(p, re.IGNORECASE) for p in patterns]
+        plain_flags = re.compile('', re.IGNORECASE).flags
+        mergeable = [r for r in compiled if not r.groups and r.flags == plain_flags]
+        separate = [r for r in compiled if r.groups or r.flags != plain_flags]
+        if len(mergeable) > 1:
+            try:
+                mergeable = [re.compile('|'.join(f'(?:{r.pattern})' for r in mergeable), re.IGNORECASE)]
+            except re.error:
+                pass
+        return tuple(mergeable + separate)
+
+    def _classify(self, message):
+        # 純 ASCII 訊息時, 小寫子字串比對與 re.IGNORECASE 結果相同
+        lowered = message.lower() if message.isascii() else None
+        for category, literals, literal_regexes, regexes in self.rules:
+            if lowered is not None:
+                if any(literal in lowered for literal in literals):
+                    return category
+            elif any(r.search(message) for r in literal_regexes):
+                return category
+            if any(r.search(message) for r in regexes):
+                return category
+        return 'OTHER'
+
+    def __call__(self, message):
+        return self.classify(message)
+
+def verify_classifier(messages, categories, limit=20):
+    """
+    以 classify_message 為基準比對 MessageClassifier 的分類結果 (回歸檢查)。
+    回傳 (比對筆數, 不一致筆數, 不一致的 (訊息, 預期, 實際) 範例, 最多 limit 筆)。
+    """
+    classifier = MessageClassifier(categories)
+    checked = mismatched = 0
+    examples = []
+    for message in messages:
+        checked += 1
+        expected = classify_message(message, categories)
+        actual = classifier(message)
+        if expected != actual:
+            mismatched += 1
+            if len(examples) < limit:
+                examples.append((message, expected, actual))
+    return checked, mismatched, examples
+
+def iter_log_messages(path):
+    """文字格式日誌中每一行的訊息 (供 --verify-classifier 使用)"""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or '-- Boot ' in line:
+                continue
+            log_entry = parse_log_line(line, '+0000')
+            if log_entry:
+                yield log_entry['message']
+
+@functools.lru_cache(maxsize=None)
+def offset_timezone(tz):
+    """將 ±HHMM 轉為 timezone 物件 (每個偏移只建立一次); 分鐘 >= 60 或超過 24 小時時拋出 ValueError"""
+    if tz[3] > '5':
+        raise ValueError(f"invalid utc offset: {tz}")
+    minutes = int(tz[1:3]) * 60 + int(tz[3:5])
+    return timezone(timedelta(minutes=-minutes if tz[0] == '-' else minutes))
+
+@functools.lru_cache(maxsize=None)
+def fallback_timezone(tz_offset_str):
+    """--tz 參數對應的 pytz 時區"""
+    return pytz.timezone(f'Etc/GMT{-int(tz_offset_str[:3])}')
+
+@functools.lru_cache(maxsize=4096)
+def utc_day_strings(utc_date):
+    """同一天的 date 與 weekday 字串只計算一次"""
+    return utc_date.strftime('%Y-%m-%d'), utc_date.strftime('%A')
+
+@functools.lru_cache(maxsize=4096)
+def convert_timestamp(ts, tz, tz_offset_str):
+    """
+    將 YYYY-MM-DDTHH:MM:SS 與 ±HHMM 轉換為 (ts_utc, ts_local, date, hour, weekday)。
+    日誌依時間排序, 同一秒的多行會直接命中快取。
+    """
+    # 處理時區: 以整數切片快速解析, 與 strptime('%Y-%m-%dT%H:%M:%S%z') 結果相同
+    try:
+        local_dt = datetime(int(ts[0:4]), int(ts[5:7]), int(ts[8:10]),
+                            int(ts[11:13]), int(ts[14:16]), int(ts[17:19]),
+                            tzinfo=offset_timezone(tz))
+        utc_dt = local_dt.astimezone(timezone.utc)
+    except ValueError:
+        # 如果時區轉換失敗，退回到手動指定
+        local_dt = datetime.strptime(ts, '%Y-%m-%dT%H:%M:%S')
+        local_dt = fallback_timezone(tz_offset_str).localize(local_dt)
+        utc_dt = local_dt.astimezone(pytz.utc)
+
+    date, weekday = utc_day_strings(utc_dt.date())
+    return utc_dt.isoformat(), local_dt.isoformat(), date, utc_dt.hour, weekday
+
 def parse_log_line(line, tz_offset_str):
     """
     解析單行日誌。
@@ -65,116 +210,921 @@ def parse_log_line(line, tz_offset_str):
     if match:
         data = match.groupdict()
         
-        # 處理時區
-        try:
-            local_dt = datetime.strptime(data['ts'] + data['tz'], '%Y-%m-%dT%H:%M:%S%z')
-            utc_dt = local_dt.astimezone(timezone.utc)
-        except ValueError:
-            # 如果時區轉換失敗，退回到手動指定
-            local_dt = datetime.strptime(data['ts'], '%Y-%m-%dT%H:%M:%S')
-            source_tz = pytz.timezone(f'Etc/GMT{-int(tz_offset_str[:3])}')
-            local_dt = source_tz.localize(local_dt)
-            utc_dt = local_dt.astimezone(pytz.utc)
+        ts_utc, ts_local, date, hour, weekday = convert_timestamp(data['ts'], data['tz'], tz_offset_str)
 
         return {
-            'ts_utc': utc_dt.isoformat(),
-            'ts_local': local_dt.isoformat(),
+            'ts_utc': ts_utc,
+            'ts_local': ts_local,
             'tz_offset': data['tz'],
             'host': data.get('host'),
             'unit': data.get('unit'),
             'pid': data.get('pid'),
             'message': data.get('message', '').strip(),
             'raw': line.strip(),
-            'date': utc_dt.strftime('%Y-%m-%d'),
-            'hour': utc_dt.hour,
-            'weekday': utc_dt.strftime('%A'),
+            'date': date,
+            'hour': hour,
+            'weekday': weekday,
+            'priority': None,
         }
     return None
 
-def main():
+# parsed.csv / parsed.jsonl 的欄位順序
+PARSED_COLUMNS = [
+    'ts_utc', 'ts_local', 'tz_offset', 'host', 'unit', 'pid', 'message', 'raw',
+    'date', 'hour', 'weekday', 'boot_seq', 'category', 'repeat_count', 'priority',
+    'template_id', 'params',
+]
+
+# 樣板探勘的預設設定; rules.yaml 的 templates 可覆寫
+DEFAULT_TEMPLATES = {'depth': 4, 'similarity': 0.4, 'max_children': 100}
+
+def template_miner(config):
+    settings = dict(DEFAULT_TEMPLATES, **(config.get('templates') or {}))
+    return TemplateMiner(settings['depth'], settings['similarity'], settings['max_children'])
+
+def assign_templates(entries, miner):
+    """依序為每筆紀錄指定 template_id 與參數 (樣板中 <*> 位置的 token)"""
+    add = pipeline_metrics.timed_call('template', miner.add)
+    for log_entry in entries:
+        log_entry['template_id'], log_entry['params'] = add(log_entry['message'])
+        yield log_entry
+
+def write_templates(path, miner):
+    """寫出 templates.csv (template_id, template)"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(['template_id', 'template'])
+        writer.writerows(miner.items())
+    os.replace(tmp_path, path)
+
+# 判斷重複的欄位; 改變時既有的 parse_state.json 需重新完整解析 (列入 signature)
+REPEAT_KEY = ('ts_utc[:19]', 'unit', 'template_id', 'category', 'params')
+
+def is_repeat(last_log_entry, log_entry):
+    """
+    檢查時間戳(秒)、unit、template_id、category 和參數是否相同。
+    同一個樣板可涵蓋不同類別或錯誤碼的訊息 (e.g., '<*> not found'、'return code = <*>'), 參數不同時不合併。
+    """
+    is_same_ts = last_log_entry['ts_utc'][:19] == log_entry['ts_utc'][:19]
+    is_same_unit = last_log_entry['unit'] == log_entry['unit']
+    is_same_template = last_log_entry['template_id'] == log_entry['template_id']
+    is_same_event = (last_log_entry['category'] == log_entry['category']
+                     and last_log_entry['params'] == log_entry['params'])
+    return is_same_ts and is_same_unit and is_same_template and is_same_event
+
+# 重複合併的回歸案例: 同一秒、同一 unit 的連續訊息, 樣板相同但事件不同, 不可合併
+REPEAT_CASES = [
+    ['sda1 not found', 'docker0 not found'],
+    ['CIFS: VFS: cifs_mount failed w/return code = -95', 'CIFS: VFS: cifs_mount failed w/return code = -101'],
+]
+
+def check_repeat_cases(config):
+    """執行 REPEAT_CASES, 回傳失敗案例的說明清單"""
+    failures = []
+    classifier = MessageClassifier(config.get('categories', {}))
+    for messages in REPEAT_CASES:
+        lines = [f"2025-07-05T10:28:40+0900 host kernel: {message}" for message in messages]
+        entries = list(iter_log_entries(lines, '+0900', classifier, template_miner(config), {'skipped': 0, 'boots': 0}))
+        merged = [(entry['message'], entry['repeat_count']) for entry in entries]
+        if merged != [(message, 1) for message in messages]:
+            failures.append(f"{messages} → {merged}")
+    return failures
+
+def merge_repeats(entries, pending=None):
+    """
+    合併連續的重複紀錄 (見 is_repeat), 依序產出含 repeat_count 的紀錄。
+    pending 為上次尚未定案的最後一筆, 用於從中斷處接續。
+    """
+    last_log_entry = pending
+    repeat_count = pending['repeat_count'] if pending else 1
+
+    for log_entry in entries:
+        if last_log_entry:
+            if is_repeat(last_log_entry, log_entry):
+                repeat_count += 1
+                continue
+            else:
+                last_log_entry['repeat_count'] = repeat_count
+                yield last_log_entry
+                repeat_count = 1
+
+        last_log_entry = log_entry
+
+    # 產出最後一筆日誌
+    if last_log_entry:
+        last_log_entry['repeat_count'] = repeat_count
+        yield last_log_entry
+
+def iter_parsed_lines(lines, tz_offset_str, classifier, stats, boot_seq=0):
+    """逐行解析並分類 (尚未合併重複); 跳過的行數與 Boot 標記數累計在 stats"""
+    lines = pipeline_metrics.timed_iter('read', lines)
+    parse_line = pipeline_metrics.timed_call('regex', parse_log_line)
+    classifier = pipeline_metrics.timed_call('classify', classifier)
+    for line in lines:
+        line = line.strip()
+        if not line:
+            stats['skipped'] += 1
+            continue
+
+        if '-- Boot ' in line:
+            boot_seq += 1
+            stats['boots'] += 1
+            continue
+
+        log_entry = parse_line(line, tz_offset_str)
+
+        if not log_entry:
+            stats['skipped'] += 1
+            continue
+
+        log_entry['boot_seq'] = boot_seq
+        log_entry['category'] = classifier(log_entry['message'])
+        yield log_entry
+
+def iter_log_entries(lines, tz_offset_str, classifier, miner, stats, boot_seq=0, pending=None):
+    """
+    逐行解析、分類、指定樣板並合併重複日誌的 generator。
+    合併後的紀錄 (含 repeat_count) 會依序產出; 跳過的行數與 Boot 標記數累計在 stats。
+    boot_seq 與 pending (上次尚未定案的最後一筆) 用於從中斷處接續解析。
+    """
+    entries = iter_parsed_lines(lines, tz_offset_str, classifier, stats, boot_seq)
+    return merge_repeats(assign_templates(entries, miner), pending)
+
+# journalctl 支援的結構化輸出格式
+JOURNAL_FORMATS = ('json', 'export')
+
+@functools.lru_cache(maxsize=4096)
+def convert_epoch(seconds, tz_offset_str):
+    """將 epoch 秒數轉換為 (ts_utc, ts_local, date, hour, weekday), 本地時間使用 --tz 的偏移"""
+    utc_dt = datetime.fromtimestamp(seconds, timezone.utc)
+    try:
+        local_dt = utc_dt.astimezone(offset_timezone(tz_offset_str))
+    except (ValueError, IndexError):
+        local_dt = utc_dt.astimezone(fallback_timezone(tz_offset_str))
+    date, weekday = utc_day_strings(utc_dt.date())
+    return utc_dt.isoformat(), local_dt.isoformat(), date, utc_dt.hour, weekday
+
+def journal_field(record, key):
+    """取出 journal 欄位的字串值; -o json 以數字陣列表示非 UTF-8 內容, 同一欄位有多個值時取第一個"""
+    value = record.get(key)
+    if isinstance(value, list):
+        if value and not isinstance(value[0], int):
+            value = value[0]
+        if isinstance(value, list):
+            value = bytes(value).decode('utf-8', 'replace')
+    return value
+
+def journal_entry(record, tz_offset_str):
+    """
+    將一筆 journal 紀錄轉為與 parse_log_line 相同欄位的紀錄, 不需要正則表達式與 strptime。
+    時間取自 __REALTIME_TIMESTAMP (微秒), 與文字日誌一樣取到秒; 缺少時間或訊息時回傳 None。
+    """
+    realtime = journal_field(record, '__REALTIME_TIMESTAMP')
+    message = journal_field(record, 'MESSAGE')
+    if realtime is None or message is None:
+        return None
+    try:
+        ts_utc, ts_local, date, hour, weekday = convert_epoch(int(realtime) // 1000000, tz_offset_str)
+    except ValueError:
+        return None
+
+    tz = ts_local[19:].replace(':', '')
+    host = journal_field(record, '_HOSTNAME')
+    unit = journal_field(record, 'SYSLOG_IDENTIFIER') or journal_field(record, '_COMM')
+    if not unit and record.get('_TRANSPORT') == 'kernel':
+        unit = 'kernel'
+    pid = journal_field(record, 'SYSLOG_PID') or journal_field(record, '_PID')
+    priority = journal_field(record, 'PRIORITY')
+    # 多行訊息併為一行, 與 short-iso 文字日誌的逐行處理一致
+    message = message.strip().replace('\r', ' ').replace('\n', ' ')
+    # raw 以 journalctl -o short-iso 的格式重建
+    raw = f"{ts_local[:19]}{tz} {host} {unit}" + (f"[{pid}]" if pid else '') + f": {message}"
+
+    return {
+        'ts_utc': ts_utc,
+        'ts_local': ts_local,
+        'tz_offset': tz,
+        'host': host,
+        'unit': unit,
+        'pid': pid,
+        'message': message,
+        'raw': raw,
+        'date': date,
+        'hour': hour,
+        'weekday': weekday,
+        'priority': int(priority) if priority and priority.isdigit() else None,
+    }
+
+def iter_json_records(stream, stats, after_cursor=None):
+    """journalctl -o json: 每行一筆 JSON 物件; 指定 after_cursor 時略過該 cursor 及其之前的紀錄"""
+    marker = after_cursor.encode('utf-8') if after_cursor else None
+    for line in stream:
+        if marker is not None:
+            # 先以 bytes 搜尋, 只有含 cursor 的行才需要解析
+            if marker in line:
+                try:
+                    if json.loads(line).get('__CURSOR') == after_cursor:
+                        marker = None
+                except ValueError:
+                    pass
+            continue
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            stats['skipped'] += 1
+
+def iter_export_records(stream, stats, after_cursor=None):
+    """
+    journalctl -o export: 每個欄位一行 KEY=value, 紀錄之間以空行分隔;
+    二進位欄位為 KEY 行後接 64-bit little-endian 長度與內容。
+    指定 after_cursor 時略過該 cursor 及其之前的紀錄。
+    """
+    skipping = after_cursor is not None
+    record = {}
+    while True:
+        line = stream.readline()
+        if not line or line == b'\n':
+            if record:
+                if skipping:
+                    skipping = record.get('__CURSOR') != after_cursor
+                else:
+                    yield record
+                record = {}
+            if not line:
+                break
+            continue
+        key, sep, value = line.rstrip(b'\n').partition(b'=')
+        if not sep:
+            size = int.from_bytes(stream.read(8), 'little')
+            value = stream.read(size)
+            stream.read(1)
+        record[key.decode('utf-8', 'replace')] = value.decode('utf-8', 'replace')
+
+def iter_journal_entries(records, tz_offset_str, classifier, miner, stats, boot_ids, pending=None):
+    """
+    將 journal 紀錄轉換、分類、指定樣板並合併重複, 產出與 iter_log_entries 相同欄位的紀錄。
+    boot_ids 為 _BOOT_ID → boot_seq 的對應 (依首次出現的順序編號), 接續解析時沿用上次的對應;
+    最後讀到的 __CURSOR 記錄在 stats['cursor']。
+    """
+    def parsed_entries():
+        boot_seq = max(boot_ids.values(), default=0)
+        convert = pipeline_metrics.timed_call('convert', journal_entry)
+        classify = pipeline_metrics.timed_call('classify', classifier)
+        for record in pipeline_metrics.timed_iter('read', records):
+            stats['cursor'] = record.get('__CURSOR', stats.get('cursor'))
+            log_entry = convert(record, tz_offset_str)
+            if not log_entry:
+                stats['skipped'] += 1
+                continue
+
+            boot_id = record.get('_BOOT_ID')
+            if boot_id is not None:
+                if boot_id not in boot_ids:
+                    boot_ids[boot_id] = len(boot_ids)
+                    if boot_ids[boot_id]:
+                        stats['boots'] += 1
+                boot_seq = boot_ids[boot_id]
+            log_entry['boot_seq'] = boot_seq
+            log_entry['category'] = classify(log_entry['message'])
+            yield log_entry
+
+    return merge_repeats(assign_templates(parsed_entries(), miner), pending)
+
+def iter_journal_records(stream, fmt, stats, after_cursor=None):
+    if fmt == 'export':
+        return iter_export_records(stream, stats, after_cursor)
+    return iter_json_records(stream, stats, after_cursor)
+
+@contextlib.contextmanager
+def journal_stream(args, fmt, after_cursor=None):
+    """
+    開啟 journal 輸入的 binary stream: --journalctl 時直接讀取 journalctl 子程序的輸出
+    (以 --after-cursor 接續), logfile 為 '-' 時讀取 stdin, 否則讀取文件。
+    """
+    if args.journalctl is not None:
+        cmd = ['journalctl', '--no-pager', '-o', fmt] + shlex.split(args.journalctl)
+        if after_cursor:
+            cmd.append(f'--after-cursor={after_cursor}')
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+        try:
+            yield proc.stdout
+        except BaseException:
+            proc.kill()
+            raise
+        finally:
+            proc.stdout.close()
+            returncode = proc.wait()
+        if returncode != 0:
+            raise RuntimeError(f"journalctl 結束代碼為 {returncode}")
+    elif args.logfile == '-':
+        yield sys.stdin.buffer
+    else:
+        with open(args.logfile, 'rb') as f:
+            yield f
+
+def cursor_in_file(path, fmt, cursor, block=1024 * 1024):
+    """檢查 journal 文件中是否仍有該 cursor 的紀錄"""
+    needle = cursor.encode('utf-8')
+    if fmt == 'export':
+        needle = b'__CURSOR=' + needle + b'\n'
+    with open(path, 'rb') as f:
+        prev = b''
+        while True:
+            data = f.read(block)
+            if not data:
+                return False
+            if needle in prev + data:
+                return True
+            prev = data[-(len(needle) - 1):]
+
+def split_file_ranges(path, chunk_size, start=0, end=None):
+    """將文件的 [start, end) 切成約 chunk_size bytes 的區段, 每段都結束在換行之後"""
+    size = os.path.getsize(path) if end is None else end
+    ranges = []
+    with open(path, 'rb') as f:
+        while start < size:
+            end = min(start + chunk_size, size)
+            if end < size:
+                f.seek(end)
+                f.readline()
+                end = f.tell()
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+_worker_classifier = None
+_worker_template_settings = None
+
+def _init_worker(categories, template_settings, metrics):
+    """每個 worker process 只建立一次分類器; metrics 為 True 時記錄各區段的子步驟"""
+    global _worker_classifier, _worker_template_settings
+    _worker_classifier = MessageClassifier(categories)
+    _worker_template_settings = template_settings
+    pipeline_metrics.worker_setup(metrics)
+
+def read_range_lines(path, start, end):
+    """讀取文件的 [start, end) 區段, 以與直接以文字模式讀檔相同的換行處理逐行回傳"""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return io.TextIOWrapper(io.BytesIO(data), encoding='utf-8')
+
+def iter_range_lines(path, start, end, chunk_size=32 * 1024 * 1024):
+    """分段逐行讀取文件的 [start, end), 記憶體用量只與 chunk_size 有關"""
+    for chunk_start, chunk_end in split_file_ranges(path, chunk_size, start, end):
+        yield from read_range_lines(path, chunk_start, chunk_end)
+
+def _parse_chunk(path, start, end, tz_offset_str):
+    """
+    在 worker 中解析、分類並探勘單一區段的樣板。
+    回傳 (尚未合併的紀錄, 區段內的樣板, 區段內的 Boot 標記數, 跳過行數, 子步驟的量測);
+    template_id 為區段內的 ID, boot_seq 從 0 起算, 皆由主程序換算。
+    """
+    stats = {'skipped': 0, 'boots': 0}
+    miner = TemplateMiner(*_worker_template_settings)
+    lines = read_range_lines(path, start, end)
+    entries = list(assign_templates(iter_parsed_lines(lines, tz_offset_str, _worker_classifier, stats), miner))
+    return entries, miner.templates, stats['boots'], stats['skipped'], pipeline_metrics.take_steps()
+
+def reconcile_templates(entries, templates, miner):
+    """
+    將區段內探勘的樣板依序併入 miner, 並把各紀錄的 template_id 換成 miner 中的 ID。
+    樣板只會增加 <*>, 因此參數個數與併入後樣板的 <*> 數不同時, 依併入後的樣板重新取出參數。
+    """
+    ids = miner.merge(templates)
+    wildcards = {cluster_id: miner.templates[cluster_id - 1].count(WILDCARD) for cluster_id in set(ids)}
+    for log_entry in entries:
+        cluster_id = log_entry['template_id'] = ids[log_entry['template_id'] - 1]
+        params = log_entry['params']
+        if (len(params.split()) if params else 0) != wildcards[cluster_id]:
+            template = miner.templates[cluster_id - 1]
+            log_entry['params'] = ' '.join(token for token, t in zip(log_entry['message'].split(), template)
+                                           if t == WILDCARD)
+    return entries
+
+def iter_parallel_entries(path, tz_offset_str, categories, miner, workers, stats, chunk_size=32 * 1024 * 1024,
+                          start=0, end=None, boot_seq=0, pending=None):
+    """
+    以 process pool 平行解析文件的各個區段, 依原順序產出合併重複後的紀錄。
+    樣板在各區段內分別探勘, 主程序依日誌順序併入 miner (見 reconcile_templates), 因此 template_id
+    依區段大小而定, 可能與單一程序的結果略有不同; 重複合併在主程序中進行, boot_seq 加上前面區段的 Boot 標記數。
+    同時最多只保留 workers * 2 個區段的結果, 以限制記憶體用量。
+    start/end/boot_seq/pending 的意義與 iter_log_entries 相同, 用於接續解析。
+    """
+    entries = iter_parsed_chunks(path, tz_offset_str, categories, miner, workers, stats, chunk_size, start, end,
+                                 boot_seq)
+    return merge_repeats(entries, pending)
+
+def iter_parsed_chunks(path, tz_offset_str, categories, miner, workers, stats, chunk_size, start, end, boot_seq):
+    """依原順序產出各區段解析並指定樣板後 (尚未合併) 的紀錄"""
+    ranges = split_file_ranges(path, chunk_size, start, end)
+    boot_offset = boot_seq
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(categories, miner.settings(), pipeline_metrics.enabled())) as pool:
+        futures = collections.deque()
+        ranges = iter(ranges)
+        while True:
+            for chunk_start, chunk_end in itertools.islice(ranges, workers * 2 - len(futures)):
+                futures.append(pool.submit(_parse_chunk, path, chunk_start, chunk_end, tz_offset_str))
+            if not futures:
+                break
+
+            entries, templates, boot_count, skipped, steps = futures.popleft().result()
+            pipeline_metrics.merge_steps(steps)
+            stats['skipped'] += skipped
+            with pipeline_metrics.step('template_merge'):
+                reconcile_templates(entries, templates, miner)
+            for log_entry in entries:
+                log_entry['boot_seq'] += boot_offset
+            boot_offset += boot_count
+            stats['boots'] += boot_count
+            yield from entries
+
+def parquet_schema():
+    """parsed.parquet 的欄位型別: UTC 時間戳、字典編碼的 category/unit、整數 hour/boot_seq/template_id"""
+    import pyarrow as pa
+    dict_string = pa.dictionary(pa.int32(), pa.string())
+    types = {
+        'ts_utc': pa.timestamp('us', tz='UTC'),
+        'unit': dict_string,
+        'category': dict_string,
+        'hour': pa.int8(),
+        'boot_seq': pa.int32(),
+        'repeat_count': pa.int32(),
+        'priority': pa.int8(),
+        'template_id': pa.int32(),
+    }
+    return pa.schema([(col, types.get(col, pa.string())) for col in PARSED_COLUMNS])
+
+def parquet_table(batch, schema):
+    """將一批紀錄轉為 Arrow table; ts_utc 以向量化方式由 ISO 字串轉為時間戳"""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    arrays = []
+    for field in schema:
+        values = [entry[field.name] for entry in batch]
+        if field.name == 'ts_utc':
+            naive = pc.utf8_slice_codeunits(pa.array(values, pa.string()), 0, 19)
+            arrays.append(pc.cast(naive, pa.timestamp('us')).cast(field.type))
+        else:
+            arrays.append(pa.array(values, field.type))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+def load_parsed(io_dir, columns):
+    """
+    供後續階段載入本程式的輸出, 只讀取需要的欄位。
+    有 parsed.parquet 時以 memory-map 讀取 (ts_utc 為 datetime64, category 為 categorical), 否則讀 parsed.csv。
+    """
+    import pandas as pd
+    parquet_path = os.path.join(io_dir, 'parsed.parquet')
+    if os.path.exists(parquet_path):
+        try:
+            df = pd.read_parquet(parquet_path, columns=columns, memory_map=True)
+        except ImportError:
+            pass
+        else:
+            # 類別依字母排序, 讓 groupby 的輸出順序與讀取 CSV 時相同
+            for col in df.select_dtypes('category').columns:
+                df[col] = df[col].cat.set_categories(sorted(df[col].cat.categories))
+            return df
+    return pd.read_csv(os.path.join(io_dir, 'parsed.csv'), usecols=columns, low_memory=False)
+
+def write_entry_batches(entries, jf, cf, batch_size, parquet_writer=None, schema=None, tail=None):
+    """
+    分批將紀錄寫入已開啟的 jsonl/csv (與 parquet) 輸出, 回傳寫出的筆數。
+    tail 為 dict 時, 記錄最後一筆紀錄本身及其寫入前的輸出位置。
+    """
+    # 與 DataFrame.to_csv 相同的格式: QUOTE_MINIMAL, None 寫為空字串
+    writer = csv.writer(cf, lineterminator='\n')
+    # pipeline: 產生紀錄 (讀取、解析、分類、樣板、合併) 的時間, 不含寫出
+    entries = pipeline_metrics.timed_iter('pipeline', entries)
+    count = 0
+    while True:
+        batch = list(itertools.islice(entries, batch_size))
+        if not batch:
+            break
+        with pipeline_metrics.step('write'):
+            last = batch[-1]
+            jf.write(''.join(json.dumps(entry) + '\n' for entry in batch[:-1]))
+            writer.writerows([entry[col] for col in PARSED_COLUMNS] for entry in batch[:-1])
+            if tail is not None:
+                tail.update(jsonl=jf.tell(), csv=cf.tell(), entry=dict(last))
+            jf.write(json.dumps(last) + '\n')
+            writer.writerow([last[col] for col in PARSED_COLUMNS])
+            if parquet_writer:
+                parquet_writer.write_table(parquet_table(batch, schema))
+        count += len(batch)
+    return count
+
+def write_parsed_outputs(entries, jsonl_path, csv_path, batch_size=10000, parquet_path=None, tail=None):
+    """
+    將紀錄分批串流寫入 parsed.jsonl 與 parsed.csv (以及選用的 parsed.parquet), 記憶體用量只與 batch_size 有關。
+    先寫入暫存檔, 完成後才取代正式輸出; 沒有任何紀錄時不產生檔案。
+    回傳寫出的筆數。
+    """
+    outputs = [(jsonl_path + '.tmp', jsonl_path), (csv_path + '.tmp', csv_path)]
+    schema = None
+    if parquet_path:
+        import pyarrow.parquet as pq
+        schema = parquet_schema()
+        outputs.append((parquet_path + '.tmp', parquet_path))
+    count = 0
+    parquet_writer = None
+    try:
+        with open(outputs[0][0], 'w', encoding='utf-8') as jf, \
+                open(outputs[1][0], 'w', encoding='utf-8', newline='') as cf:
+            csv.writer(cf, lineterminator='\n').writerow(PARSED_COLUMNS)
+            if parquet_path:
+                parquet_writer = pq.ParquetWriter(outputs[2][0], schema)
+            count = write_entry_batches(entries, jf, cf, batch_size, parquet_writer, schema, tail)
+            if parquet_writer:
+                parquet_writer.close()
+    except BaseException:
+        if parquet_writer:
+            parquet_writer.close()
+        for tmp_path, _ in outputs:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        raise
+
+    for tmp_path, path in outputs:
+        if count:
+            os.replace(tmp_path, path)
+        else:
+            os.remove(tmp_path)
+    return count
+
+def append_parsed_outputs(entries, jsonl_path, csv_path, positions, batch_size=10000, tail=None):
+    """
+    將既有的 parsed.jsonl / parsed.csv 截斷至 positions 記錄的位置 (即上次尚未定案的最後一筆之前),
+    再附加新的紀錄。中途失敗時, 下次仍會從相同位置重新截斷, 不會留下重複資料。
+    """
+    os.truncate(jsonl_path, positions['jsonl'])
+    os.truncate(csv_path, positions['csv'])
+    with open(jsonl_path, 'a', encoding='utf-8') as jf, \
+            open(csv_path, 'a', encoding='utf-8', newline='') as cf:
+        return write_entry_batches(entries, jf, cf, batch_size, tail=tail)
+
+def file_head_digest(path, size=4096):
+    """文件開頭的 sha1, 用於偵測輪替後 inode 被重用的情況"""
+    with open(path, 'rb') as f:
+        head = f.read(size)
+    return len(head), hashlib.sha1(head).hexdigest()
+
+def complete_lines_end(path, size):
+    """最後一個換行之後的位置; 尚未寫完的最後一行留待下次解析"""
+    block = 64 * 1024
+    with open(path, 'rb') as f:
+        pos = size
+        while pos > 0:
+            start = max(0, pos - block)
+            f.seek(start)
+            idx = f.read(pos - start).rfind(b'\n')
+            if idx >= 0:
+                return start + idx + 1
+            pos = start
+    return 0
+
+def load_parse_state(state_path):
+    try:
+        with open(state_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def save_parse_state(state_path, state):
+    tmp_path = state_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, state_path)
+
+def can_resume(state, logfile, st, signature, jsonl_path, csv_path):
+    """檢查上次的 checkpoint 是否仍適用於目前的日誌文件與輸出"""
+    if not state or state.get('signature') != signature:
+        return False
+    if state.get('logfile') != os.path.abspath(logfile) or state.get('inode') != st.st_ino:
+        return False
+    # 文件被截斷或開頭內容不同: 視為輪替
+    if st.st_size < state['offset']:
+        return False
+    if file_head_digest(logfile, state['head_len']) != (state['head_len'], state['head_sha1']):
+        return False
+    for path, key in ((jsonl_path, 'jsonl'), (csv_path, 'csv')):
+        if not os.path.exists(path) or os.path.getsize(path) < state['outputs'][key]:
+            return False
+    return True
+
+def write_or_append(args, entries, state, jsonl_path, csv_path, parquet_path, tail):
+    """
+    接續解析時 (state 不為 None) 將新紀錄附加到既有輸出, 否則完整寫出; 回傳輸出中的總筆數。
+    tail 記錄最後一筆紀錄及其寫入前的輸出位置, 供下次接續。
+    """
+    if state is None:
+        return write_parsed_outputs(entries, jsonl_path, csv_path, args.batch_size, parquet_path, tail)
+    if parquet_path:
+        print("警告: 附加模式無法更新 parsed.parquet，已移除; 後續階段將讀取 parsed.csv。")
+    if os.path.exists(f"{args.output_dir}/parsed.parquet"):
+        os.remove(f"{args.output_dir}/parsed.parquet")
+    count = append_parsed_outputs(entries, jsonl_path, csv_path, state['outputs'], args.batch_size, tail)
+    return count + state['parsed_count']
+
+def parse_journal_incremental(args, fmt, categories, classifier, miner, stats, jsonl_path, csv_path, parquet_path):
+    """
+    journalctl json/export 輸入的增量解析: 記錄最後一筆的 __CURSOR, 下次只處理其後的紀錄。
+    --journalctl 時以 --after-cursor 讓 journalctl 只輸出新紀錄; 讀取文件時略過 cursor 之前的紀錄。
+    來源或設定變更、文件中已找不到 cursor 時, 改為完整重新解析。回傳輸出中的總筆數。
+    """
+    state_path = f"{args.output_dir}/parse_state.json"
+    source = f"journalctl {args.journalctl}" if args.journalctl is not None else os.path.abspath(args.logfile)
+    signature = hashlib.sha1(json.dumps([categories, args.tz, fmt, PARSED_COLUMNS, REPEAT_KEY, miner.settings()], sort_keys=True).encode('utf-8')).hexdigest()
+    state = load_parse_state(state_path)
+
+    resume = (state and state.get('signature') == signature and state.get('source') == source
+              and state.get('cursor') and all(os.path.exists(path) and os.path.getsize(path) >= state['outputs'][key]
+                                              for path, key in ((jsonl_path, 'jsonl'), (csv_path, 'csv'))))
+    if resume and args.journalctl is None and not cursor_in_file(args.logfile, fmt, state['cursor']):
+        resume = False
+    if resume:
+        cursor, boot_ids, pending = state['cursor'], state['boot_ids'], state['pending']
+        stats['skipped'] += state['skipped']
+        miner.restore(state['templates'])
+        print(f"從 cursor {cursor} 之後接續解析。")
+    else:
+        if state:
+            print("journal 來源或設定已變更，或已找不到上次的 cursor，將完整重新解析。")
+        cursor, boot_ids, pending = None, {}, None
+
+    tail = {}
+    with journal_stream(args, fmt, cursor) as stream:
+        # journalctl 已依 --after-cursor 只輸出新紀錄, 文件則需自行略過
+        records = iter_journal_records(stream, fmt, stats, cursor if args.journalctl is None else None)
+        entries = iter_journal_entries(records, args.tz, classifier, miner, stats, boot_ids, pending)
+        count = write_or_append(args, entries, state if pending else None, jsonl_path, csv_path, parquet_path, tail)
+    if not count:
+        return 0
+
+    save_parse_state(state_path, {
+        'source': source,
+        'signature': signature,
+        'cursor': stats.get('cursor') or cursor,
+        'boot_ids': boot_ids,
+        'skipped': stats['skipped'],
+        # 最後一筆可能在下次與新的重複日誌合併, 因此記錄其寫入前的輸出位置
+        'pending': tail['entry'],
+        'outputs': {'jsonl': tail['jsonl'], 'csv': tail['csv']},
+        'parsed_count': count - 1,
+        # 樣板探勘的解析樹, 接續時沿用以保持 template_id 不變
+        'templates': miner.state(),
+    })
+    return count
+
+def parse_incremental(args, categories, classifier, miner, stats, jsonl_path, csv_path, parquet_path):
+    """
+    依 parse_state.json 只解析日誌新增的部分並附加到既有輸出, 結果與完整解析相同。
+    日誌被輪替或截斷、規則或時區變更、輸出缺失時, 改為完整重新解析。
+    回傳輸出中的總筆數。
+    """
+    state_path = f"{args.output_dir}/parse_state.json"
+    st = os.stat(args.logfile)
+    end = complete_lines_end(args.logfile, st.st_size)
+    signature = hashlib.sha1(json.dumps([categories, args.tz, PARSED_COLUMNS, REPEAT_KEY, miner.settings()], sort_keys=True).encode('utf-8')).hexdigest()
+    state = load_parse_state(state_path)
+
+    if can_resume(state, args.logfile, st, signature, jsonl_path, csv_path):
+        start, boot_seq, pending = state['offset'], state['boot_seq'], state['pending']
+        stats['skipped'] += state['skipped']
+        miner.restore(state['templates'])
+        if start == end:
+            print("沒有新的日誌行。")
+            return state['parsed_count'] + 1
+        print(f"從位置 {start} 接續解析 (新增 {end - start} bytes)。")
+    else:
+        if state:
+            print("日誌已輪替、截斷或設定已變更，將完整重新解析。")
+        start, boot_seq, pending = 0, 0, None
+    pipeline_metrics.set_counter('bytes', end - start)
+
+    if args.workers > 1:
+        entries = iter_parallel_entries(args.logfile, args.tz, categories, miner, args.workers, stats,
+                                        chunk_size=args.chunk_mb * 1024 * 1024,
+                                        start=start, end=end, boot_seq=boot_seq, pending=pending)
+    else:
+        lines = iter_range_lines(args.logfile, start, end, args.chunk_mb * 1024 * 1024)
+        entries = iter_log_entries(lines, args.tz, classifier, miner, stats, boot_seq=boot_seq, pending=pending)
+
+    tail = {}
+    count = write_or_append(args, entries, state if pending else None, jsonl_path, csv_path, parquet_path, tail)
+    if not count:
+        return 0
+
+    head_len, head_sha1 = file_head_digest(args.logfile)
+    save_parse_state(state_path, {
+        'logfile': os.path.abspath(args.logfile),
+        'inode': st.st_ino,
+        'head_len': head_len,
+        'head_sha1': head_sha1,
+        'offset': end,
+        'signature': signature,
+        'boot_seq': boot_seq + stats['boots'],
+        'skipped': stats['skipped'],
+        # 最後一筆可能在下次與新的重複日誌合併, 因此記錄其寫入前的輸出位置
+        'pending': tail['entry'],
+        'outputs': {'jsonl': tail['jsonl'], 'csv': tail['csv']},
+        'parsed_count': count - 1,
+        # 樣板探勘的解析樹, 接續時沿用以保持 template_id 不變
+        'templates': miner.state(),
+    })
+    return count
+
+def collect_entries(entries, collect):
+    """將每筆資料中 collect 指定欄位的值附加到對應的 list, 其餘照原樣傳下去"""
+    for entry in entries:
+        for column, values in collect.items():
+            values.append(entry[column])
+        yield entry
+
+def build_parser():
     parser = argparse.ArgumentParser(description='解析 systemd journal 日誌文件。')
-    parser.add_argument('logfile', help='要解析的日誌文件名')
+    parser.add_argument('logfile', nargs='?',
+                        help="要解析的日誌文件名; json/export 格式可用 '-' 從 stdin 讀取")
     parser.add_argument('--tz', default='+0900', help='日誌的時區偏移, e.g., +0800')
     parser.add_argument('--rules', default='rules.yaml', help='分類規則的 YAML 配置文件')
     parser.add_argument('--output_dir', default='.', help='輸出目錄')
-    args = parser.parse_args()
+    parser.add_argument('--batch-size', type=int, default=10000, help='串流寫出時每批的筆數')
+    parser.add_argument('--parquet', action='store_true', help='另外輸出帶型別的 parsed.parquet 供後續階段讀取 (需要 pyarrow)')
+    parser.add_argument('--incremental', action='store_true', help='依 parse_state.json 只解析新增的日誌並附加到既有輸出')
+    parser.add_argument('--workers', type=int, default=1, help='平行解析的 process 數 (1 = 單一程序)')
+    parser.add_argument('--chunk-mb', type=int, default=32, help='平行解析時每個區段的大小 (MB)')
+    parser.add_argument('--format', choices=('text',) + JOURNAL_FORMATS,
+                        help='輸入格式: text (journalctl -o short-iso), json 或 export '
+                             '(預設為 text; 使用 --journalctl 時為 json)')
+    parser.add_argument('--journalctl', metavar='ARGS',
+                        help="直接讀取 journalctl 的輸出而非文件, ARGS 為額外的 journalctl 參數, "
+                             "e.g., \"-p 0..3 --since '7 days ago'\"; --incremental 時以 --after-cursor 接續")
+    parser.add_argument('--follow', action='store_true',
+                        help='持續追蹤 journalctl -f 或增長中的文件, 以滑動時間窗計算健康分數並輸出門檻事件 (見 follow_health.py)')
+    parser.add_argument('--events', help="--follow 的事件輸出 (JSON Lines); '-' 為 stdout, 預設為 output_dir/follow_events.jsonl")
+    parser.add_argument('--webhook', help='--follow 的事件另外以 HTTP POST 送到此 URL')
+    parser.add_argument('--from-start', action='store_true', help='--follow 時從文件開頭 (或 journal 的全部紀錄) 開始讀取')
+    parser.add_argument('--stop-at-eof', action='store_true', help='--follow 時讀到文件結尾即結束 (重播既有文件)')
+    parser.add_argument('--metrics', action='store_true', help='記錄各子步驟的耗時與處理量到 pipeline_metrics.json')
+    parser.add_argument('--profile', choices=pipeline_metrics.PROFILERS, help='另外輸出此階段的 profile (需要 --metrics)')
+    parser.add_argument('--self-check', action='store_true', help='執行內建的回歸案例 (重複合併) 後結束')
+    parser.add_argument('--verify-classifier', action='store_true',
+                        help='不輸出結果, 以日誌文件的訊息為回歸語料比對 MessageClassifier 與 classify_message 的分類')
+    return parser
+
+def record_parse_metrics(args, fmt, stats, miner, parsed_count):
+    """
+    解析階段的計數; 合併重複所花的時間由整體扣除其餘子步驟推算。
+    平行解析時 read/regex/classify/template 為各 worker 的時間總和, 與主程序的時間重疊, 不推算合併的時間。
+    """
+    entries = pipeline_metrics.step_total('template', 'calls')
+    written = pipeline_metrics.step_total('pipeline', 'calls')
+    parallel = fmt == 'text' and args.workers > 1
+    if parallel:
+        pipeline_metrics.set_counter('workers', args.workers)
+    else:
+        pipeline_metrics.derive_step('merge', 'pipeline', ['read', 'regex', 'classify', 'convert', 'template'])
+    pipeline_metrics.set_counter('entries', entries)
+    pipeline_metrics.set_counter('written', written)
+    pipeline_metrics.set_counter('rows', parsed_count)
+    pipeline_metrics.set_counter('skipped', stats['skipped'])
+    pipeline_metrics.set_counter('boots', stats['boots'])
+    pipeline_metrics.set_counter('templates', len(miner.templates))
+    if fmt == 'text':
+        # 沒有 read 的紀錄時改由解析結果推算 (接續解析時包含先前跳過的行)
+        lines = pipeline_metrics.step_total('read', 'calls') or entries + stats['skipped'] + stats['boots']
+        pipeline_metrics.set_counter('lines', lines)
+    if args.logfile and args.logfile != '-' and args.journalctl is None and not (args.incremental and fmt == 'text'):
+        pipeline_metrics.set_counter('bytes', os.path.getsize(args.logfile))
+    # 重複合併的比例: 1 - 寫出筆數 / 解析筆數
+    if entries:
+        pipeline_metrics.set_counter('repeat_collapse_ratio', round(1 - written / entries, 6))
+
+def run(args, config, collect=None):
+    """
+    解析日誌並寫出 parsed.jsonl/parsed.csv, 回傳輸出中的筆數 (失敗時為 0)。
+    collect 為 {欄位: list} 時, 同時把解析出的每筆資料的這些欄位收集在記憶體中 (不適用於 --incremental)。
+    """
+    if args.follow:
+        import follow_health
+        return follow_health.follow(args, config)
 
-    config = load_config(args.rules)
     categories = config.get('categories', {})
+    classifier = MessageClassifier(categories)
+    miner = template_miner(config)
 
-    parsed_data = []
-    skipped_count = 0
-    boot_seq = 0
-    last_log_entry = None
-    repeat_count = 1
+    fmt = args.format or ('json' if args.journalctl is not None else 'text')
+    if args.journalctl is None and not args.logfile:
+        print("錯誤: 請指定日誌文件或 --journalctl。")
+        return 0
+    if fmt == 'text' and (args.journalctl is not None or args.logfile == '-'):
+        print("錯誤: --journalctl 與 stdin 輸入只支援 json/export 格式。")
+        return 0
+    if args.incremental and args.logfile == '-' and args.journalctl is None:
+        print("錯誤: stdin 輸入無法接續解析，請改用 --journalctl 或文件。")
+        return 0
 
-    try:
-        with open(args.logfile, 'r', encoding='utf-8') as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    skipped_count += 1
-                    continue
-
-                if '-- Boot ' in line:
-                    boot_seq += 1
-                    continue
-
-                log_entry = parse_log_line(line, args.tz)
-
-                if not log_entry:
-                    skipped_count += 1
-                    continue
-                
-                log_entry['boot_seq'] = boot_seq
-                log_entry['category'] = classify_message(log_entry['message'], categories)
-
-                # 合併重複日誌
-                if last_log_entry:
-                    # 檢查時間戳(秒)、unit 和 message 前綴是否相同
-                    is_same_ts = last_log_entry['ts_utc'][:19] == log_entry['ts_utc'][:19]
-                    is_same_unit = last_log_entry['unit'] == log_entry['unit']
-                    is_same_msg_prefix = last_log_entry['message'][:120] == log_entry['message'][:120]
-
-                    if is_same_ts and is_same_unit and is_same_msg_prefix:
-                        repeat_count += 1
-                        continue
-                    else:
-                        last_log_entry['repeat_count'] = repeat_count
-                        parsed_data.append(last_log_entry)
-                        repeat_count = 1
-                
-                last_log_entry = log_entry
-
-            # 添加最後一筆日誌
-            if last_log_entry:
-                last_log_entry['repeat_count'] = repeat_count
-                parsed_data.append(last_log_entry)
+    stats = {'skipped': 0, 'boots': 0}
+    jsonl_path = f"{args.output_dir}/parsed.jsonl"
+    csv_path = f"{args.output_dir}/parsed.csv"
+    parquet_path = None
+    if args.parquet:
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            print("警告: 未安裝 pyarrow，將只輸出 parsed.csv。")
+        else:
+            parquet_path = f"{args.output_dir}/parsed.parquet"
+    if not parquet_path and os.path.exists(f"{args.output_dir}/parsed.parquet"):
+        # 避免後續階段讀到舊的 parquet
+        os.remove(f"{args.output_dir}/parsed.parquet")
 
-    except FileNotFoundError:
-        print(f"錯誤: 找不到日誌文件 '{args.logfile}'")
-        return
+    pipeline_metrics.setup(args.output_dir if args.metrics else None, args.profile)
+    with pipeline_metrics.stage('parse'):
+        parsed_count = parse_outputs(args, fmt, categories, classifier, miner, stats, collect,
+                                     jsonl_path, csv_path, parquet_path)
+        if not parsed_count:
+            return 0
+
+        templates_path = f"{args.output_dir}/templates.csv"
+        with pipeline_metrics.step('write_templates'):
+            write_templates(templates_path, miner)
+        if pipeline_metrics.enabled():
+            record_parse_metrics(args, fmt, stats, miner, parsed_count)
+
+    print(f"解析完成。共處理 {parsed_count} 筆日誌，跳過 {stats['skipped']} 行，{len(miner.templates)} 個樣板。")
+    print(f"輸出文件: {jsonl_path}, {csv_path}, {templates_path}" + (f", {parquet_path}" if parquet_path and os.path.exists(parquet_path) else ""))
+    return parsed_count
+
+def parse_outputs(args, fmt, categories, classifier, miner, stats, collect, jsonl_path, csv_path, parquet_path):
+    """依輸入格式與模式解析並寫出, 回傳輸出中的筆數 (失敗時為 0)"""
+    try:
+        if fmt in JOURNAL_FORMATS:
+            if args.incremental:
+                parsed_count = parse_journal_incremental(args, fmt, categories, classifier, miner, stats,
+                                                         jsonl_path, csv_path, parquet_path)
+            else:
+                with journal_stream(args, fmt) as stream:
+                    records = iter_journal_records(stream, fmt, stats)
+                    entries = iter_journal_entries(records, args.tz, classifier, miner, stats, {})
+                    if collect is not None:
+                        entries = collect_entries(entries, collect)
+                    parsed_count = write_parsed_outputs(entries, jsonl_path, csv_path, args.batch_size, parquet_path)
+        elif args.incremental:
+            parsed_count = parse_incremental(args, categories, classifier, miner, stats, jsonl_path, csv_path, parquet_path)
+        elif args.workers > 1:
+            entries = iter_parallel_entries(args.logfile, args.tz, categories, miner, args.workers, stats,
+                                            chunk_size=args.chunk_mb * 1024 * 1024)
+            if collect is not None:
+                entries = collect_entries(entries, collect)
+            parsed_count = write_parsed_outputs(entries, jsonl_path, csv_path, args.batch_size, parquet_path)
+        else:
+            with open(args.logfile, 'r', encoding='utf-8') as f:
+                entries = iter_log_entries(f, args.tz, classifier, miner, stats)
+                if collect is not None:
+                    entries = collect_entries(entries, collect)
+                parsed_count = write_parsed_outputs(entries, jsonl_path, csv_path, args.batch_size, parquet_path)
+    except FileNotFoundError as e:
+        if e.filename == args.logfile:
+            print(f"錯誤: 找不到日誌文件 '{args.logfile}'")
+        elif e.filename == 'journalctl':
+            print("錯誤: 找不到 journalctl。")
+        else:
+            print(f"錯誤: 無法寫入輸出文件 '{e.filename}'")
+        return 0
     except Exception as e:
         print(f"處理文件時發生錯誤: {e}")
-        return
+        return 0
 
-    if not parsed_data:
+    if not parsed_count:
         print("錯誤: 未能從日誌文件中解析出任何數據。請檢查文件格式與時區設定。")
-        return
-
-    # 輸出 parsed.jsonl
-    jsonl_path = f"{args.output_dir}/parsed.jsonl"
-    with open(jsonl_path, 'w', encoding='utf-8') as f:
-        for entry in parsed_data:
-            f.write(json.dumps(entry) + '\n')
-
-    # 輸出 parsed.csv
-    csv_path = f"{args.output_dir}/parsed.csv"
-    df = pd.DataFrame(parsed_data)
-    df.to_csv(csv_path, index=False, encoding='utf-8')
+    return parsed_count
 
-    print(f"解析完成。共處理 {len(parsed_data)} 筆日誌，跳過 {skipped_count} 行。")
-    print(f"輸出文件: {jsonl_path}, {csv_path}")
+def main():
+    args = build_parser().parse_args()
+    config = load_config(args.rules)
+    if args.self_check:
+        failures = check_repeat_cases(config)
+        for failure in failures:
+            print(f"回歸案例失敗: {failure}")
+        print(f"回歸案例: {len(REPEAT_CASES)} 個, {len(failures)} 個失敗。")
+        sys.exit(1 if failures else 0)
+    if args.verify_classifier:
+        if not args.logfile or args.logfile == '-':
+            print("錯誤: --verify-classifier 需要文字格式的日誌文件。")
+            sys.exit(2)
+        checked, mismatched, examples = verify_classifier(iter_log_messages(args.logfile), config.get('categories', {}))
+        for message, expected, actual in examples:
+            print(f"不一致: 預期 {expected}, 實際 {actual}: {message[:200]}")
+        print(f"分類比對: {checked} 筆訊息, {mismatched} 筆不一致。")
+        sys.exit(1 if mismatched else 0)
+    run(args, config)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
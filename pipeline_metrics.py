@@ -0,0 +1,233 @@
+# pipeline_metrics.py
+"""
+選用的效能量測。以 --metrics 啟用後, 記錄各階段 (parse/aggregate/plot) 與其子步驟的 wall/CPU 時間、
+計數、處理量與 peak RSS, 合併寫入輸出目錄的 pipeline_metrics.json (各階段各佔一個鍵);
+--profile 另外輸出各階段的 cProfile (profile_<stage>.prof) 或 pyinstrument (profile_<stage>.html)。
+
+未啟用時 step() 回傳共用的 nullcontext, timed_call/timed_iter 原樣回傳, 不影響效能。
+逐筆累計的子步驟 (timed_call/timed_iter) 只記錄 wall time, 以免量測本身的成本 (每次數百 ns) 影響結果。
+"""
+import contextlib
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+METRICS_FILE = 'pipeline_metrics.json'
+PROFILERS = ('cprofile', 'pyinstrument')
+
+_recorder = None
+_null = contextlib.nullcontext()
+
+def peak_rss_mb(who=None):
+    """目前 process (或已結束的子 process 中最大者) 的 peak RSS (MB)"""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who is None else who)
+    # Linux 的 ru_maxrss 單位為 KB, macOS 為 bytes
+    return round(usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+class Recorder:
+    def __init__(self, output_dir, profile=None):
+        self.output_dir = output_dir
+        self.profile = profile
+        self.steps = {}
+        self.counters = {}
+
+    def record(self, name, wall, cpu=None, calls=1):
+        step = self.steps.setdefault(name, {'wall_seconds': 0.0, 'calls': 0})
+        step['wall_seconds'] += wall
+        step['calls'] += calls
+        if cpu is not None:
+            step['cpu_seconds'] = step.get('cpu_seconds', 0.0) + cpu
+
+    @contextlib.contextmanager
+    def step(self, name):
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - wall, time.process_time() - cpu)
+
+    def start_profiler(self):
+        if self.profile == 'pyinstrument':
+            try:
+                from pyinstrument import Profiler
+            except ImportError:
+                print("警告: 未安裝 pyinstrument，改用 cProfile。")
+                self.profile = 'cprofile'
+            else:
+                profiler = Profiler()
+                profiler.start()
+                return profiler
+        if self.profile == 'cprofile':
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+            return profiler
+        return None
+
+    def stop_profiler(self, profiler, stage_name):
+        if profiler is None:
+            return None
+        if self.profile == 'pyinstrument':
+            profiler.stop()
+            path = os.path.join(self.output_dir, f"profile_{stage_name}.html")
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(profiler.output_html())
+        else:
+            profiler.disable()
+            path = os.path.join(self.output_dir, f"profile_{stage_name}.prof")
+            profiler.dump_stats(path)
+        return os.path.basename(path)
+
+    def save(self, stage_name, record):
+        """合併寫入 pipeline_metrics.json, 保留其他階段的紀錄"""
+        path = os.path.join(self.output_dir, METRICS_FILE)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                metrics = json.load(f)
+        except (FileNotFoundError, ValueError):
+            metrics = {}
+        metrics.setdefault('stages', {})[stage_name] = record
+        metrics['updated'] = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(metrics, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+def setup(output_dir, profile=None):
+    """output_dir 為 None 時停用量測"""
+    global _recorder
+    _recorder = Recorder(output_dir, profile) if output_dir else None
+
+def enabled():
+    return _recorder is not None
+
+@contextlib.contextmanager
+def stage(name):
+    """量測一個階段; 結束時 (包含失敗) 將結果寫入 pipeline_metrics.json"""
+    recorder = _recorder
+    if recorder is None:
+        yield
+        return
+    recorder.steps, recorder.counters = {}, {}
+    profiler = recorder.start_profiler()
+    started = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield
+    finally:
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        profile_file = recorder.stop_profiler(profiler, name)
+        record = {
+            'started': started,
+            'wall_seconds': round(wall, 6),
+            'cpu_seconds': round(cpu, 6),
+            'peak_rss_mb': peak_rss_mb(),
+            'children_peak_rss_mb': peak_rss_mb(resource.RUSAGE_CHILDREN) if resource else None,
+            'steps': {name: {key: round(value, 6) if isinstance(value, float) else value
+                             for key, value in step.items()}
+                      for name, step in recorder.steps.items()},
+            'counters': dict(recorder.counters),
+        }
+        # 處理量
+        for counter in ('lines', 'bytes', 'rows'):
+            if recorder.counters.get(counter) and wall > 0:
+                record[f'{counter}_per_second'] = round(recorder.counters[counter] / wall, 1)
+        if profile_file:
+            record['profile'] = profile_file
+        recorder.save(name, record)
+
+def step(name):
+    """量測一個子步驟的 wall/CPU 時間 (同名的子步驟累計)"""
+    if _recorder is None:
+        return _null
+    return _recorder.step(name)
+
+def record_step(name, wall, cpu=None):
+    """記錄在其他 process 中量測的子步驟"""
+    if _recorder is not None:
+        _recorder.record(name, wall, cpu)
+
+def worker_setup(enabled):
+    """
+    在 worker process 中以新的 recorder 記錄子步驟 (fork 繼承的 recorder 不會回到主程序);
+    以 take_steps() 取出後回傳給主程序, 由 merge_steps() 合併。
+    """
+    global _recorder
+    _recorder = Recorder(None) if enabled else None
+
+def take_steps():
+    """取出並清空目前記錄的子步驟"""
+    if _recorder is None:
+        return {}
+    steps, _recorder.steps = _recorder.steps, {}
+    return steps
+
+def merge_steps(steps):
+    """併入其他 process 的子步驟 (時間與次數相加; 各 worker 的時間可能重疊)"""
+    if _recorder is not None:
+        for name, step in steps.items():
+            _recorder.record(name, step['wall_seconds'], step.get('cpu_seconds'), step['calls'])
+
+def timed_call(name, func):
+    """回傳累計 func 每次呼叫 wall time 的包裝; 未啟用時原樣回傳 func"""
+    if _recorder is None:
+        return func
+    record = _recorder.record
+    clock = time.perf_counter
+
+    def wrapper(*args):
+        start = clock()
+        try:
+            return func(*args)
+        finally:
+            record(name, clock() - start)
+    return wrapper
+
+def timed_iter(name, iterable):
+    """累計從 iterable 取出每個元素所花的 wall time; 未啟用時原樣回傳"""
+    if _recorder is None:
+        return iterable
+
+    def wrapper():
+        record = _recorder.record
+        clock = time.perf_counter
+        iterator = iter(iterable)
+        while True:
+            start = clock()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                record(name, clock() - start, calls=0)
+                return
+            record(name, clock() - start)
+            yield item
+    return wrapper()
+
+def count(name, value=1):
+    if _recorder is not None:
+        _recorder.counters[name] = _recorder.counters.get(name, 0) + value
+
+def set_counter(name, value):
+    if _recorder is not None:
+        _recorder.counters[name] = value
+
+def step_total(name, key='wall_seconds'):
+    """子步驟累計的 wall_seconds 或 calls; 未記錄時為 0"""
+    if _recorder is None:
+        return 0
+    return _recorder.steps.get(name, {}).get(key, 0)
+
+def derive_step(name, total, parts):
+    """以 total 子步驟扣除 parts 的時間, 推算無法直接量測的子步驟 (e.g., generator 中的合併)"""
+    if _recorder is not None and total in _recorder.steps:
+        wall = step_total(total) - sum(step_total(part) for part in parts)
+        _recorder.steps[name] = {'wall_seconds': max(wall, 0.0), 'derived': True}
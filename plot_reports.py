@@ -1,14 +1,29 @@
 # plot_reports.py
 import argparse
+import hashlib
+import json
 import pandas as pd
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import seaborn as sns
 import yaml
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 
+import pipeline_metrics
+from parse_journal import load_parsed
+
+# matplotlib/seaborn 載入很慢, 只在有圖表需要重畫時才由 import_plotting() 載入
+plt = None
+sns = None
+
+def import_plotting():
+    global plt, sns
+    if plt is None:
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+        import seaborn as sns
+
 def load_config(config_path='rules.yaml'):
     print("Loading config...")
     try:
@@ -17,6 +32,16 @@ def load_config(config_path='rules.yaml'):
     except FileNotFoundError:
         return {}
 
+# 圖表與報告所需的 parsed 欄位
+PARSED_COLUMNS = ['ts_utc', 'message', 'date', 'hour', 'category', 'boot_seq']
+
+# aggregate_metrics.py 的輸出中, 圖表與報告會用到的檔案
+INPUT_FILES = ['metrics_daily.csv', 'metrics_hourly.csv', 'top_messages.csv', 'health_score.csv',
+               'summary_last_days.csv', 'error_codes_daily.csv', 'bursts.csv']
+
+# critical_timeline.png 中以點標出的類別與顏色; 其他類別只畫爆量區段
+CRITICAL_COLORS = {'RAID_FW': 'red', 'FSCRYPT_EXT4': 'orange'}
+
 def plot_daily_stacked_events(df, order, palette, output_dir):
     print("Plotting daily stacked events...")
     if df.empty:
@@ -58,17 +83,29 @@ def plot_hourly_heatmap(df, order, palette, output_dir):
     plt.savefig(os.path.join(output_dir, 'events_hourly_heatmap.png'))
     plt.close(fig)
 
-def plot_cifs_error_breakdown(df, output_dir):
+# CIFS 錯誤碼與圖例名稱; 其餘 CIFS 事件歸為 OTHER_CIFS
+CIFS_ERROR_TYPES = {-95: '-95 (Dialect)', -101: '-101 (Network)'}
+
+def cifs_error_counts(error_codes_df):
+    """error_codes_daily.csv 中 CIFS_SMB 的每日錯誤碼計數"""
+    return error_codes_df[error_codes_df['category'] == 'CIFS_SMB']
+
+def plot_cifs_error_breakdown(metrics_daily_df, error_codes_df, output_dir):
     print("Plotting CIFS error breakdown...")
-    cifs_df = df[df['category'] == 'CIFS_SMB'].copy()
-    if cifs_df.empty:
+    cifs_daily = metrics_daily_df[metrics_daily_df['category'] == 'CIFS_SMB'].set_index('date')['count']
+    if cifs_daily.empty:
         return
 
-    cifs_df['error_type'] = 'OTHER_CIFS'
-    cifs_df.loc[cifs_df['message'].str.contains('return code = -95'), 'error_type'] = '-95 (Dialect)'
-    cifs_df.loc[cifs_df['message'].str.contains('return code = -101'), 'error_type'] = '-101 (Network)'
+    codes = cifs_error_counts(error_codes_df)
+    codes = codes[codes['error_code'].isin(list(CIFS_ERROR_TYPES))]
+    typed = codes.pivot_table(index='date', columns='error_code', values='count', aggfunc='sum')
+    typed = typed.reindex(cifs_daily.index).fillna(0).astype(int).rename(columns=CIFS_ERROR_TYPES)
+    breakdown = typed.assign(OTHER_CIFS=cifs_daily - typed.sum(axis=1))
 
-    daily_breakdown = cifs_df.groupby(['date', 'error_type']).size().unstack(fill_value=0)
+    # 只保留實際出現過的錯誤類型, 欄位依名稱排序
+    long = breakdown.stack()
+    long = long[long > 0].rename_axis(['date', 'error_type']).rename('count').reset_index()
+    daily_breakdown = long.set_index(['date', 'error_type'])['count'].unstack(fill_value=0)
 
     fig, ax = plt.subplots(figsize=(12, 7))
     daily_breakdown.plot(kind='bar', stacked=True, ax=ax, colormap='coolwarm')
@@ -80,23 +117,29 @@ def plot_cifs_error_breakdown(df, output_dir):
     plt.savefig(os.path.join(output_dir, 'cifs_error_breakdown.png'))
     plt.close(fig)
 
-def plot_critical_timeline(df, output_dir):
+def plot_critical_timeline(df, bursts_df, output_dir):
     print("Plotting critical timeline...")
-    critical_df = df[df['category'].isin(['RAID_FW', 'FSCRYPT_EXT4'])].copy()
-    if critical_df.empty:
+    critical_df = df[df['category'].isin(list(CRITICAL_COLORS))].copy()
+    if critical_df.empty and bursts_df.empty:
         return
 
     critical_df['ts_utc'] = pd.to_datetime(critical_df['ts_utc'])
     
     fig, ax = plt.subplots(figsize=(16, 6))
-    colors = {'RAID_FW': 'red', 'FSCRYPT_EXT4': 'orange'}
     
-    for category, color in colors.items():
+    for category, color in CRITICAL_COLORS.items():
         cat_df = critical_df[critical_df['category'] == category]
         if not cat_df.empty:
             ax.plot(cat_df['ts_utc'], [category]*len(cat_df), 'o', color=color, label=category, markersize=8)
 
-    ax.set_title('Critical Events Timeline (RAID_FW, FSCRYPT_EXT4)', fontsize=16)
+    # 爆量區段 (start ~ end 分鐘結束) 以粗橫線標在各類別的列上; 區段在長時間軸上很短, 另在起點加上標記
+    if not bursts_df.empty:
+        start = pd.to_datetime(bursts_df['start']).dt.tz_convert(None)
+        end = pd.to_datetime(bursts_df['end']).dt.tz_convert(None) + pd.Timedelta(minutes=1)
+        ax.hlines(bursts_df['category'].tolist(), start, end, colors='purple', linewidth=12, alpha=0.4)
+        ax.plot(start, bursts_df['category'].tolist(), 'D', color='purple', alpha=0.6, markersize=6, label='burst')
+
+    ax.set_title('Critical Events Timeline (RAID_FW, FSCRYPT_EXT4) and Bursts', fontsize=16)
     ax.set_xlabel('Timestamp (UTC)')
     ax.set_ylabel('')
     ax.legend()
@@ -105,6 +148,11 @@ def plot_critical_timeline(df, output_dir):
     plt.savefig(os.path.join(output_dir, 'critical_timeline.png'))
     plt.close(fig)
 
+def top_messages_bar_data(top_messages_df):
+    """以樣板字串 (前 120 字元) 為標籤的 count"""
+    labels = top_messages_df['template'].fillna('').astype(str).str.slice(0, 120)
+    return top_messages_df[['count']].set_axis(labels, axis=0)
+
 def plot_top_messages_bar(df, output_dir):
     print("Plotting top messages bar...")
     if df.empty:
@@ -115,7 +163,7 @@ def plot_top_messages_bar(df, output_dir):
     ax.barh(df.index.astype(str), df['count'], color='skyblue')
     ax.set_title(f'Top {len(df)} Messages', fontsize=16)
     ax.set_xlabel('Count')
-    ax.set_ylabel('Message Prefix')
+    ax.set_ylabel('Message Template')
     plt.tight_layout()
     plt.savefig(os.path.join(output_dir, 'top_messages_bar.png'))
     plt.close(fig)
@@ -150,7 +198,104 @@ def plot_health_score(df, parsed_df, output_dir):
     plt.savefig(os.path.join(output_dir, 'health_score.png'))
     plt.close(fig)
 
-def generate_report(summary_df, window_days, parsed_df, output_dir):
+# 圖表快取: {圖檔名: {'key': 輸入與選項的雜湊, 'written': 是否產生了圖檔}}
+CHART_CACHE = '.chart_cache.json'
+
+def chart_key(func, args, code_digest):
+    """以繪圖函式、輸入 DataFrame 的內容與其他選項計算圖表的快取鍵"""
+    h = hashlib.sha1(f"{code_digest}:{func.__name__}".encode('utf-8'))
+    for arg in args:
+        if isinstance(arg, pd.DataFrame):
+            h.update(repr((list(arg.columns), [str(dtype) for dtype in arg.dtypes])).encode('utf-8'))
+            h.update(pd.util.hash_pandas_object(arg, index=True).values.tobytes())
+        else:
+            h.update(repr(arg).encode('utf-8'))
+    return h.hexdigest()
+
+def render_chart(func, args, output_dir):
+    """
+    在目前的 process 中畫一張圖, 回傳 (wall, CPU) 秒數; 每張圖都從預設樣式開始, 結果與執行順序無關。
+    在子 process 中量測, 由主 process 記錄到 pipeline_metrics。
+    """
+    wall, cpu = time.perf_counter(), time.process_time()
+    import_plotting()
+    plt.style.use('default')
+    func(*args, output_dir)
+    return time.perf_counter() - wall, time.process_time() - cpu
+
+def render_charts(charts, output_dir, workers, force=False):
+    """
+    charts 為 (圖檔名, 繪圖函式, 參數) 的列表。
+    輸入與選項都沒變且圖檔仍在的圖表略過, 其餘以 process pool 平行重畫。
+    """
+    cache_path = os.path.join(output_dir, CHART_CACHE)
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    except (FileNotFoundError, ValueError):
+        cache = {}
+    # 本腳本變更時所有圖表都重畫
+    with open(__file__, 'rb') as f:
+        code_digest = hashlib.sha1(f.read()).hexdigest()
+
+    pending = []
+    for name, func, args in charts:
+        key = chart_key(func, args, code_digest)
+        entry = cache.get(name, {})
+        if not force and entry.get('key') == key and \
+                (not entry.get('written') or os.path.exists(os.path.join(output_dir, name))):
+            print(f"Skipping {name} (unchanged).")
+            pipeline_metrics.count('charts_skipped')
+            continue
+        pending.append((name, func, args, key))
+    if not pending:
+        return
+
+    def finished(name, key, timing):
+        cache[name] = {'key': key, 'written': os.path.exists(os.path.join(output_dir, name))}
+        pipeline_metrics.record_step(f"chart:{name}", *timing)
+        pipeline_metrics.count('charts_rendered')
+
+    try:
+        if workers <= 1 or len(pending) == 1:
+            for name, func, args, key in pending:
+                finished(name, key, render_chart(func, args, output_dir))
+        else:
+            with ProcessPoolExecutor(max_workers=min(workers, len(pending))) as pool:
+                futures = [(name, key, pool.submit(render_chart, func, args, output_dir))
+                           for name, func, args, key in pending]
+                for name, key, future in futures:
+                    finished(name, key, future.result())
+    finally:
+        tmp_path = cache_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, indent=2)
+        os.replace(tmp_path, cache_path)
+
+def chart_specs(outputs, parsed_df, heatmap_order, heatmap_palette):
+    """
+    各圖表的 (圖檔名, 繪圖函式, 參數); parsed_df 的 date 須已轉為 datetime。
+    只把各圖表實際用到的資料交給繪圖函式, 讓快取鍵的計算與傳給子 process 的資料都保持小量。
+    """
+    metrics_daily_df = outputs['metrics_daily.csv']
+    error_codes_df = outputs['error_codes_daily.csv']
+    critical_df = parsed_df.loc[parsed_df['category'].isin(list(CRITICAL_COLORS)), ['ts_utc', 'category']]
+    boot_df = parsed_df.groupby('boot_seq', as_index=False)['date'].min()
+    return [
+        ('events_daily_stacked.png', plot_daily_stacked_events, (metrics_daily_df, heatmap_order, heatmap_palette)),
+        ('events_hourly_heatmap.png', plot_hourly_heatmap, (outputs['metrics_hourly.csv'], heatmap_order, heatmap_palette)),
+        ('cifs_error_breakdown.png', plot_cifs_error_breakdown, (metrics_daily_df, error_codes_df)),
+        ('critical_timeline.png', plot_critical_timeline, (critical_df, outputs['bursts.csv'])),
+        ('top_messages_bar.png', plot_top_messages_bar, (top_messages_bar_data(outputs['top_messages.csv']),)),
+        ('health_score.png', plot_health_score, (outputs['health_score.csv'], boot_df)),
+    ]
+
+def burst_span(burst):
+    """'2025-07-01 03:10 ~ 03:14 UTC' 形式的爆量區段"""
+    start, end = burst['start'][:16].replace('T', ' '), burst['end'][:16].replace('T', ' ')
+    return f"{start} ~ {end[11:] if end[:10] == start[:10] else end} UTC"
+
+def generate_report(summary_df, window_days, parsed_df, error_codes_df, output_dir, bursts_df=None):
     print("Generating dynamic report...")
     report_parts = []
     report_parts.append("# Log Analysis Report")
@@ -162,6 +307,16 @@ def generate_report(summary_df, window_days, parsed_df, output_dir):
     else:
         report_parts.append(summary_df.to_markdown(index=False))
 
+    if bursts_df is None:
+        bursts_df = pd.DataFrame(columns=['start', 'end', 'category', 'events', 'peak_rate', 'baseline', 'peak_z'])
+    if not bursts_df.empty:
+        top_bursts = bursts_df.sort_values(['peak_z', 'events'], ascending=False).head(10)
+        report_parts.append(f"### Bursts ({len(bursts_df)} detected)")
+        report_parts.append("Intervals where a category's per-minute rate rose far above its own recent (EWMA) baseline. "
+                            "Top bursts by peak z-score:")
+        report_parts.append(top_bursts[['start', 'end', 'category', 'events', 'peak_rate', 'baseline', 'peak_z']]
+                            .to_markdown(index=False))
+
     report_parts.append("## 2. Key Observations & Interpretations")
     
     # Interpretation for RAID_FW
@@ -180,16 +335,22 @@ def generate_report(summary_df, window_days, parsed_df, output_dir):
     if not fscrypt_events.empty:
         report_parts.append("### FSCRYPT/EXT4: Filesystem Errors")
         report_parts.append("- **What was observed**: Multiple filesystem encryption/decryption errors (`ret = -22`) were logged.")
-        peak_hour = fscrypt_events['hour'].mode()[0]
-        report_parts.append(f"  - **Pattern**: These errors appear frequently and peak around **{peak_hour}:00 UTC**, suggesting a potential link to scheduled tasks.")
+        fscrypt_bursts = bursts_df[bursts_df['category'] == 'FSCRYPT_EXT4']
+        if not fscrypt_bursts.empty:
+            largest = fscrypt_bursts.loc[fscrypt_bursts['events'].idxmax()]
+            report_parts.append(f"  - **Pattern**: These errors arrive in {len(fscrypt_bursts)} burst(s); the largest ran **{burst_span(largest)}** "
+                                f"({largest['events']} events, peaking at {largest['peak_rate']}/min against a baseline of {largest['baseline']}/min), suggesting a potential link to scheduled tasks or write-heavy jobs.")
+        else:
+            peak_hour = fscrypt_events['hour'].mode()[0]
+            report_parts.append(f"  - **Pattern**: These errors appear frequently and peak around **{peak_hour}:00 UTC**, suggesting a potential link to scheduled tasks.")
         report_parts.append("- **Interpretation**: These errors indicate a problem at the filesystem level. The `-22` error code (EINVAL) suggests that an invalid argument was provided to a system call. This could be due to a kernel bug, an issue with the underlying storage, or an incorrect encryption policy.")
         report_parts.append("- **Where to look**: The `events_hourly_heatmap.png` shows the concentration of these errors during specific hours. The `top_messages_bar.png` lists the most common fscrypt error messages.")
 
     # Interpretation for CIFS_SMB
-    cifs_df = parsed_df[parsed_df['category'] == 'CIFS_SMB']
-    if not cifs_df.empty:
-        cifs_95_count = cifs_df[cifs_df['message'].str.contains('return code = -95', na=False)].shape[0]
-        cifs_101_count = cifs_df[cifs_df['message'].str.contains('return code = -101', na=False)].shape[0]
+    cifs_codes = cifs_error_counts(error_codes_df).groupby('error_code')['count'].sum()
+    if not cifs_codes.empty:
+        cifs_95_count = int(cifs_codes.get(-95, 0))
+        cifs_101_count = int(cifs_codes.get(-101, 0))
         if cifs_95_count > 0 or cifs_101_count > 0:
             report_parts.append("### CIFS/SMB: Network Share Connectivity Issues")
             report_parts.append("- **What was observed**: The system logged errors while trying to connect to CIFS/SMB network shares.")
@@ -197,6 +358,11 @@ def generate_report(summary_df, window_days, parsed_df, output_dir):
                 report_parts.append(f"  - **Type 1**: {cifs_95_count} errors with code `-95` (Operation not supported). This points to a **protocol dialect mismatch** between the client and the server. The client might be trying to use a newer SMB version that the server doesn't support.")
             if cifs_101_count > 0:
                 report_parts.append(f"  - **Type 2**: {cifs_101_count} errors with code `-101` (Network is unreachable). This indicates a **network connectivity problem**. The client could not reach the server at the network level.")
+            cifs_bursts = bursts_df[bursts_df['category'] == 'CIFS_SMB']
+            if not cifs_bursts.empty:
+                largest = cifs_bursts.loc[cifs_bursts['events'].idxmax()]
+                report_parts.append(f"  - **Pattern**: The errors arrive in {len(cifs_bursts)} burst(s); the largest ran **{burst_span(largest)}** "
+                                    f"({largest['events']} events, peaking at {largest['peak_rate']}/min), which typically matches a mount retry loop or an outage window.")
             report_parts.append("- **Interpretation**: These two error types point to different root causes. The `-95` errors require configuration changes (e.g., specifying `vers=2.0` in mount options), while the `-101` errors suggest network infrastructure problems (e.g., firewall, routing, or the server being offline).")
             report_parts.append("- **Where to look**: The `cifs_error_breakdown.png` chart visualizes the daily distribution of these two error types.")
 
@@ -245,28 +411,46 @@ def generate_report(summary_df, window_days, parsed_df, output_dir):
     with open(os.path.join(output_dir, 'report.md'), 'w', encoding='utf-8') as f:
         f.write('\n\n'.join(report_parts))
 
-def main():
-    print("Starting plot_reports.py...")
+def build_parser():
     parser = argparse.ArgumentParser(description='從聚合指標產生圖表與報告。')
     parser.add_argument('--rules', default='rules.yaml', help='YAML 配置文件路徑')
     parser.add_argument('--window-days', type=int, default=7, help='報告摘要天數')
     parser.add_argument('--io_dir', default='.', help='輸入與輸出目錄')
-    args = parser.parse_args()
-
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='平行繪圖的 process 數 (1 表示在主 process 中依序繪製)')
+    parser.add_argument('--force', action='store_true', help='忽略圖表快取, 重畫所有圖表')
+    parser.add_argument('--metrics', action='store_true', help='記錄各圖表的耗時到 io_dir/pipeline_metrics.json')
+    parser.add_argument('--profile', choices=pipeline_metrics.PROFILERS,
+                        help='另外輸出此階段的 profile (需要 --metrics; 平行繪圖時只包含主 process)')
+    return parser
+
+def run(args, config, outputs=None, parsed_df=None):
+    """
+    產生圖表與 report.md。
+    outputs 為 aggregate_metrics 在記憶體中的 {檔名: DataFrame}, parsed_df 為記憶體中的 parsed 資料;
+    未提供時從 io_dir 讀取。
+    """
+    pipeline_metrics.setup(args.io_dir if args.metrics else None, args.profile)
+    with pipeline_metrics.stage('plot'):
+        plot(args, config, outputs, parsed_df)
+
+def plot(args, config, outputs, parsed_df):
     print(f"I/O directory: {args.io_dir}")
-    config = load_config(args.rules)
     heatmap_order = config.get('heatmap_order', [])
     heatmap_palette = config.get('heatmap_palette')
 
     try:
         print("Loading CSV files...")
-        metrics_daily_df = pd.read_csv(os.path.join(args.io_dir, 'metrics_daily.csv'))
-        metrics_hourly_df = pd.read_csv(os.path.join(args.io_dir, 'metrics_hourly.csv'))
-        top_messages_df = pd.read_csv(os.path.join(args.io_dir, 'top_messages.csv'), index_col=0)
-        health_score_df = pd.read_csv(os.path.join(args.io_dir, 'health_score.csv'))
-        summary_df = pd.read_csv(os.path.join(args.io_dir, 'summary_last_days.csv'))
-        parsed_df = pd.read_csv(os.path.join(args.io_dir, 'parsed.csv'), low_memory=False)
-        print("CSV files loaded successfully.")
+        with pipeline_metrics.step('load'):
+            if outputs is None:
+                outputs = {name: pd.read_csv(os.path.join(args.io_dir, name), index_col=0 if name == 'top_messages.csv' else None)
+                           for name in INPUT_FILES}
+            metrics_daily_df = outputs['metrics_daily.csv']
+            summary_df = outputs['summary_last_days.csv']
+            error_codes_df = outputs['error_codes_daily.csv']
+            if parsed_df is None:
+                parsed_df = load_parsed(args.io_dir, PARSED_COLUMNS)
+        print("Input files loaded successfully.")
     except FileNotFoundError as e:
         print(f"錯誤: 找不到輸入文件 {e.filename}。請先執行 aggregate_metrics.py。")
         return
@@ -274,17 +458,24 @@ def main():
     if not heatmap_order:
         heatmap_order = metrics_daily_df.groupby('category')['count'].sum().sort_values(ascending=False).index.tolist()
 
-    plot_daily_stacked_events(metrics_daily_df, heatmap_order, heatmap_palette, args.io_dir)
-    plot_hourly_heatmap(metrics_hourly_df, heatmap_order, heatmap_palette, args.io_dir)
-    plot_cifs_error_breakdown(parsed_df, args.io_dir)
-    plot_critical_timeline(parsed_df, args.io_dir)
-    plot_top_messages_bar(top_messages_df, args.io_dir)
-    plot_health_score(health_score_df, parsed_df, args.io_dir)
+    parsed_df['date'] = pd.to_datetime(parsed_df['date'])
+
+    with pipeline_metrics.step('chart_data'):
+        charts = chart_specs(outputs, parsed_df, heatmap_order, heatmap_palette)
+    with pipeline_metrics.step('render_charts'):
+        render_charts(charts, args.io_dir, args.workers, args.force)
 
-    generate_report(summary_df, args.window_days, parsed_df, args.io_dir)
+    with pipeline_metrics.step('report'):
+        generate_report(summary_df, args.window_days, parsed_df, error_codes_df, args.io_dir, outputs['bursts.csv'])
+    pipeline_metrics.set_counter('rows', len(parsed_df))
 
     print("圖表與報告產生完成。")
     print(f"- 檔案已儲存至: {args.io_dir}/")
 
+def main():
+    print("Starting plot_reports.py...")
+    args = build_parser().parse_args()
+    run(args, load_config(args.rules))
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
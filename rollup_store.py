@@ -0,0 +1,393 @@
+# rollup_store.py
+import hashlib
+import json
+import os
+import sqlite3
+import numpy as np
+import pandas as pd
+
+# 增量彙總所需的 parsed 欄位
+ROLLUP_COLUMNS = ['ts_utc', 'message', 'date', 'hour', 'category', 'template_id', 'repeat_count']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+-- date × hour × category 的事件數 (date × category 由此加總)
+CREATE TABLE IF NOT EXISTS hourly_counts (
+    date TEXT, hour INTEGER, category TEXT, count INTEGER,
+    PRIMARY KEY (date, hour, category)
+);
+-- 每個樣板 (template_id) 的事件數與首末出現時間
+CREATE TABLE IF NOT EXISTS template_counts (
+    template_id INTEGER PRIMARY KEY, count INTEGER, first_seen TEXT, last_seen TEXT
+);
+-- 每個樣板出現過的類別, first_row 用於還原首次出現的順序
+CREATE TABLE IF NOT EXISTS template_categories (
+    template_id INTEGER, category TEXT, first_row INTEGER,
+    PRIMARY KEY (template_id, category)
+);
+-- 訊息中錯誤碼 (return code = N) 的每日計數
+CREATE TABLE IF NOT EXISTS error_codes (
+    date TEXT, category TEXT, error_code INTEGER, count INTEGER,
+    PRIMARY KEY (date, category, error_code)
+);
+-- 每分鐘各類別的事件數 (epoch 分鐘數, 含合併的重複次數) 與出現過的錯誤碼;
+-- 各 bucket 大小的共現矩陣與爆量偵測由此計算。generation 為最後一次變動時的 fold 序號
+CREATE TABLE IF NOT EXISTS minute_counts (
+    minute INTEGER, category TEXT, count INTEGER, generation INTEGER,
+    PRIMARY KEY (minute, category)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS minute_counts_generation ON minute_counts (generation);
+CREATE TABLE IF NOT EXISTS minute_error_codes (
+    minute INTEGER, category TEXT, error_code INTEGER,
+    PRIMARY KEY (minute, category, error_code)
+) WITHOUT ROWID;
+-- 以下為共現與爆量的衍生狀態, 只重算 generation 之後變動的分鐘 (見 changed_range)
+-- 各 bucket 大小中每個 bucket 出現過的類別, 與兩兩類別同 bucket 出現的次數
+CREATE TABLE IF NOT EXISTS bucket_presence (
+    bucket_minutes INTEGER, bucket INTEGER, category TEXT,
+    PRIMARY KEY (bucket_minutes, bucket, category)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS co_occurrence_counts (
+    bucket_minutes INTEGER, category_a TEXT, category_b TEXT, count INTEGER,
+    PRIMARY KEY (bucket_minutes, category_a, category_b)
+) WITHOUT ROWID;
+-- 時間差共現: 各規則的 after 出現分鐘與其前 within 分鐘內是否有 before
+CREATE TABLE IF NOT EXISTS lagged_minutes (
+    rule TEXT, minute INTEGER, matched INTEGER,
+    PRIMARY KEY (rule, minute)
+) WITHOUT ROWID;
+-- 爆量偵測: 每小時結尾的 EWMA 平均與平方平均, 以及超過門檻的分鐘
+CREATE TABLE IF NOT EXISTS burst_checkpoints (
+    minute INTEGER, category TEXT, mean REAL, square_mean REAL,
+    PRIMARY KEY (minute, category)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS burst_minutes (
+    category TEXT, minute INTEGER, count INTEGER, baseline REAL, z REAL,
+    PRIMARY KEY (category, minute)
+) WITHOUT ROWID;
+"""
+
+# 彙總表結構變更時遞增, 舊的 store 會自動重建
+SCHEMA_VERSION = 6
+TABLES = ('meta', 'hourly_counts', 'template_counts', 'template_categories', 'error_codes',
+          'minute_counts', 'minute_error_codes', 'bucket_presence', 'co_occurrence_counts', 'lagged_minutes',
+          'burst_checkpoints', 'burst_minutes')
+# 舊版本使用、已不再需要的表
+OBSOLETE_TABLES = ('message_metrics', 'messages', 'message_categories', 'minute_presence')
+
+def file_digest(path, start, end):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        return hashlib.sha1(f.read(end - start)).hexdigest()
+
+def last_line_start(path, size):
+    """文件最後一行的起始位置 (假設文件以換行結尾)"""
+    block = 64 * 1024
+    with open(path, 'rb') as f:
+        pos = size - 1
+        while pos > 0:
+            start = max(0, pos - block)
+            f.seek(start)
+            idx = f.read(pos - start).rfind(b'\n')
+            if idx >= 0:
+                return start + idx + 1
+            pos = start
+    return 0
+
+class RollupStore:
+    """
+    aggregate_metrics.py 的增量彙總 store。
+    parsed.csv 只會在結尾附加新列 (parse_journal.py --incremental 只會改寫最後一列的 repeat_count),
+    因此記錄已併入的位置, 下次只讀取其後的新列。
+    """
+
+    def __init__(self, path, error_code_pattern, chunk_rows=200000):
+        self.conn = sqlite3.connect(path)
+        outdated = self._schema_version() != str(SCHEMA_VERSION)
+        if outdated:
+            # 表的欄位可能已改變, 全部刪除後依新的結構重建
+            for table in OBSOLETE_TABLES + TABLES:
+                self.conn.execute(f"DROP TABLE IF EXISTS {table}")
+        self.conn.executescript(SCHEMA)
+        if outdated:
+            self.reset()
+        self.chunk_rows = chunk_rows
+        self.error_code_pattern = error_code_pattern
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.conn.commit()
+        else:
+            self.conn.rollback()
+        self.conn.close()
+
+    def reset(self):
+        for table in TABLES:
+            self.conn.execute(f"DELETE FROM {table}")
+        self._set_meta(schema_version=SCHEMA_VERSION)
+
+    def _schema_version(self):
+        try:
+            return self._meta().get('schema_version')
+        except sqlite3.OperationalError:
+            return None
+
+    def _meta(self):
+        return dict(self.conn.execute("SELECT key, value FROM meta"))
+
+    def _set_meta(self, **values):
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            [(key, str(value)) for key, value in values.items()])
+
+    def fold_csv(self, csv_path):
+        """
+        將 parsed.csv 中尚未併入的列彙總進 store, 回傳新併入的筆數。
+        若 parsed.csv 的開頭或已併入部分的內容改變 (例如重新完整解析), 則清空後從頭彙總。
+        """
+        size = os.path.getsize(csv_path)
+        with open(csv_path, 'rb') as f:
+            header = f.readline()
+            header_end = f.tell()
+        names = header.decode('utf-8').strip().split(',')
+        head_digest = file_digest(csv_path, 0, min(size, 4096))
+
+        meta = self._meta()
+        start, rows, resumed = header_end, 0, False
+        if meta.get('resume_offset') and meta.get('head_digest') == head_digest:
+            resume = int(meta['resume_offset'])
+            prefix_start = max(header_end, resume - 4096)
+            if resume <= size and file_digest(csv_path, prefix_start, resume) == meta['prefix_digest']:
+                # 從上次的最後一列開始讀取; 該列已併入, 但 repeat_count 可能被改寫, 只補上增加的次數
+                start, rows, resumed = resume, int(meta['rows']), True
+        if not resumed:
+            self.reset()
+            meta = {}
+        self.generation = int(meta.get('generation', 0)) + 1
+        self._set_meta(generation=self.generation)
+
+        folded, last_repeat = 0, None
+        if start < size:
+            with open(csv_path, 'rb') as f:
+                f.seek(start)
+                reader = pd.read_csv(
+                    f, header=None, names=names, usecols=ROLLUP_COLUMNS,
+                    dtype={'ts_utc': str, 'message': str, 'date': str, 'category': str},
+                    chunksize=self.chunk_rows)
+                for chunk in reader:
+                    if not len(chunk):
+                        continue
+                    last_repeat = int(chunk['repeat_count'].iloc[-1])
+                    if resumed:
+                        self.fold_repeat_delta(chunk.iloc[:1], int(meta.get('last_repeat', 1)))
+                        chunk, resumed = chunk.iloc[1:], False
+                    self.fold_frame(chunk, rows + folded)
+                    folded += len(chunk)
+
+        rows += folded
+        if rows:
+            resume = last_line_start(csv_path, size)
+            prefix_digest = file_digest(csv_path, max(header_end, resume - 4096), resume)
+            self._set_meta(head_digest=head_digest, resume_offset=resume,
+                           prefix_digest=prefix_digest, rows=rows)
+            if last_repeat is not None:
+                self._set_meta(last_repeat=last_repeat)
+        return folded
+
+    @staticmethod
+    def _minutes(ts_utc):
+        minute = pd.to_datetime(ts_utc.str.slice(0, 19), format='%Y-%m-%dT%H:%M:%S')
+        return minute.to_numpy().astype('datetime64[m]').astype(np.int64)
+
+    def _add_minute_counts(self, rows):
+        self.conn.executemany(
+            "INSERT INTO minute_counts VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (minute, category) DO UPDATE SET count = count + excluded.count, generation = excluded.generation",
+            [row + (self.generation,) for row in rows])
+
+    def fold_repeat_delta(self, row, previous_repeat):
+        """上次已併入的最後一列: 只將 repeat_count 增加的部分加進每分鐘事件數"""
+        delta = int(row['repeat_count'].iloc[0]) - previous_repeat
+        if delta:
+            self._add_minute_counts([(int(self._minutes(row['ts_utc'])[0]), row['category'].iloc[0], delta)])
+
+    def fold_frame(self, df, first_row):
+        """將一批 parsed 列加進各彙總表; first_row 為這批第一列在 parsed.csv 中的序號"""
+        if df.empty:
+            return
+        df = df.assign(row=np.arange(first_row, first_row + len(df)), minute=self._minutes(df['ts_utc']))
+
+        hourly = df.groupby(['date', 'hour', 'category']).size()
+        self.conn.executemany(
+            "INSERT INTO hourly_counts VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (date, hour, category) DO UPDATE SET count = count + excluded.count",
+            [(date, int(hour), category, int(n)) for (date, hour, category), n in hourly.items()])
+
+        templates = df.groupby('template_id').agg(
+            count=('row', 'size'), first_seen=('ts_utc', 'min'), last_seen=('ts_utc', 'max'))
+        self.conn.executemany(
+            "INSERT INTO template_counts VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (template_id) DO UPDATE SET count = count + excluded.count, "
+            "first_seen = min(first_seen, excluded.first_seen), last_seen = max(last_seen, excluded.last_seen)",
+            [(int(template_id), int(count), first_seen, last_seen)
+             for template_id, count, first_seen, last_seen in templates.itertuples()])
+
+        first_rows = df.groupby(['template_id', 'category'])['row'].min()
+        self.conn.executemany(
+            "INSERT INTO template_categories VALUES (?, ?, ?) "
+            "ON CONFLICT (template_id, category) DO UPDATE SET first_row = min(first_row, excluded.first_row)",
+            [(int(template_id), category, int(row)) for (template_id, category), row in first_rows.items()])
+
+        error_code = pd.to_numeric(df['message'].str.extract(self.error_code_pattern, expand=False))
+        codes = df.assign(error_code=error_code).dropna(subset=['error_code'])
+        daily = codes.groupby(['date', 'category', 'error_code']).size()
+        self.conn.executemany(
+            "INSERT INTO error_codes VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (date, category, error_code) DO UPDATE SET count = count + excluded.count",
+            [(date, category, int(code), int(n)) for (date, category, code), n in daily.items()])
+
+        minute_counts = df.groupby(['minute', 'category'])['repeat_count'].sum()
+        self._add_minute_counts(
+            [(int(minute), category, int(n)) for (minute, category), n in minute_counts.items()])
+        code_presence = codes[['minute', 'category', 'error_code']].drop_duplicates()
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO minute_error_codes VALUES (?, ?, ?)",
+            [(int(minute), category, int(code)) for minute, category, code in code_presence.itertuples(index=False)])
+
+    def _query(self, sql):
+        return pd.read_sql_query(sql, self.conn)
+
+    def daily_counts(self):
+        return self._query(
+            "SELECT date, category, SUM(count) AS count FROM hourly_counts "
+            "GROUP BY date, category ORDER BY date, category")
+
+    def hourly_counts(self):
+        return self._query(
+            "SELECT hour, category, SUM(count) AS count FROM hourly_counts "
+            "GROUP BY hour, category ORDER BY hour, category")
+
+    def minute_presence(self, start, end):
+        return self._query(
+            f"SELECT minute, category FROM minute_counts WHERE minute BETWEEN {int(start)} AND {int(end)}")
+
+    def minute_counts(self, start=None):
+        """start 分鐘 (含) 以後的每分鐘事件數; start 為 None 時為全部"""
+        where = '' if start is None else f" WHERE minute >= {int(start)}"
+        return self._query("SELECT minute, category, count FROM minute_counts" + where)
+
+    def changed_range(self, name, signature=None):
+        """
+        衍生狀態 name 上次更新後, 每分鐘事件數有變動的 (最早, 最晚) 分鐘; 沒有變動時回傳 None。
+        狀態尚未建立或 signature (計算該狀態的設定) 改變時, 回傳全部資料的範圍。
+        """
+        saved = json.loads(self._meta().get(f"state:{name}", 'null'))
+        generation = saved[1] if saved and saved[0] == signature else 0
+        start, end = self.conn.execute(
+            "SELECT MIN(minute), MAX(minute) FROM minute_counts WHERE generation > ?", (generation,)).fetchone()
+        return None if start is None else (start, end)
+
+    def mark_state(self, name, signature=None):
+        """記錄衍生狀態 name 已更新到目前的 fold"""
+        self._set_meta(**{f"state:{name}": json.dumps([signature, int(self._meta().get('generation', 0))])})
+
+    def bucket_presence(self, bucket_minutes, first, last):
+        return self._query(
+            "SELECT bucket, category FROM bucket_presence "
+            f"WHERE bucket_minutes = {int(bucket_minutes)} AND bucket BETWEEN {int(first)} AND {int(last)}")
+
+    def update_co_occurrence(self, bucket_minutes, sets, delta):
+        """記錄 bucket 的出現類別 ({類別: bucket 陣列}), 並將共現矩陣的差值加進計數"""
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO bucket_presence VALUES (?, ?, ?)",
+            [(bucket_minutes, bucket, category) for category, buckets in sets.items() for bucket in buckets.tolist()])
+        pairs = delta.stack()
+        self.conn.executemany(
+            "INSERT INTO co_occurrence_counts VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (bucket_minutes, category_a, category_b) DO UPDATE SET count = count + excluded.count",
+            [(bucket_minutes, a, b, int(n)) for (a, b), n in pairs[pairs != 0].items()])
+
+    def co_occurrence_counts(self, bucket_minutes):
+        return self._query(
+            "SELECT category_a, category_b, count FROM co_occurrence_counts "
+            f"WHERE bucket_minutes = {int(bucket_minutes)}")
+
+    def selector_minutes(self, selector, start, end):
+        """[start, end] 內符合 {category, error_code} 條件的出現分鐘 (排序且不重複)"""
+        table = 'minute_counts' if selector.get('error_code') is None else 'minute_error_codes'
+        conditions, params = ['minute BETWEEN ? AND ?'], [int(start), int(end)]
+        for column in ('category', 'error_code'):
+            if selector.get(column) is not None:
+                conditions.append(f"{column} = ?")
+                params.append(selector[column])
+        rows = self.conn.execute(
+            f"SELECT DISTINCT minute FROM {table} WHERE {' AND '.join(conditions)} ORDER BY minute", params)
+        return np.array([minute for minute, in rows], dtype=np.int64)
+
+    def replace_lagged(self, rule, start, end, minutes, matched):
+        """以重算的結果取代規則 rule 在 [start, end] 內的 after 分鐘"""
+        self.conn.execute("DELETE FROM lagged_minutes WHERE rule = ? AND minute BETWEEN ? AND ?",
+                          (rule, int(start), int(end)))
+        self.conn.executemany(
+            "INSERT INTO lagged_minutes VALUES (?, ?, ?)",
+            [(rule, minute, int(hit)) for minute, hit in zip(minutes.tolist(), matched.tolist())])
+
+    def lagged_totals(self, rule):
+        """規則 rule 的 (after 出現分鐘數, 其中前面有 before 的分鐘數)"""
+        return self.conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(matched), 0) FROM lagged_minutes WHERE rule = ?", (rule,)).fetchone()
+
+    def burst_checkpoint(self, before):
+        """before 分鐘之前最近的 checkpoint: (分鐘, {類別: (平均, 平方平均)}); 沒有時為 (None, {})"""
+        minute, = self.conn.execute(
+            "SELECT MAX(minute) FROM burst_checkpoints WHERE minute < ?", (int(before),)).fetchone()
+        if minute is None:
+            return None, {}
+        rows = self.conn.execute(
+            "SELECT category, mean, square_mean FROM burst_checkpoints WHERE minute = ?", (minute,))
+        return minute, {category: (mean, square_mean) for category, mean, square_mean in rows}
+
+    def replace_bursts(self, start, hot, checkpoints):
+        """以 start 分鐘起重算的爆量分鐘與 checkpoint 取代 store 中的狀態"""
+        for table in ('burst_minutes', 'burst_checkpoints'):
+            self.conn.execute(f"DELETE FROM {table} WHERE minute >= ?", (int(start),))
+        self.conn.executemany(
+            "INSERT INTO burst_minutes VALUES (?, ?, ?, ?, ?)",
+            zip(*(hot[column].tolist() for column in ('category', 'minute', 'count', 'baseline', 'z'))))
+        self.conn.executemany(
+            "INSERT INTO burst_checkpoints VALUES (?, ?, ?, ?)",
+            zip(*(checkpoints[column].tolist() for column in ('minute', 'category', 'mean', 'square_mean'))))
+
+    def burst_minutes(self):
+        """依類別、時間排序的爆量分鐘"""
+        return self._query("SELECT category, minute, count, baseline, z FROM burst_minutes ORDER BY category, minute")
+
+    def segment_events(self, categories, starts, ends):
+        """各段 (類別, 起始分鐘, 結束分鐘) 的事件總數"""
+        return np.array([
+            self.conn.execute(
+                "SELECT SUM(count) FROM minute_counts WHERE category = ? AND minute BETWEEN ? AND ?",
+                (category, start, end)).fetchone()[0]
+            for category, start, end in zip(list(categories), starts.tolist(), ends.tolist())], dtype=np.int64)
+
+    def message_groups(self):
+        """與 groupby('template_id') 相同排序的 count/first_seen/last_seen/categories"""
+        grouped = self._query(
+            "SELECT template_id, count, first_seen, last_seen FROM template_counts ORDER BY template_id"
+        ).set_index('template_id')
+        categories = self._query(
+            "SELECT template_id, category FROM template_categories ORDER BY template_id, first_row")
+        grouped['categories'] = categories.groupby('template_id', sort=False)['category'].agg(list)
+        return grouped
+
+    def error_code_counts(self):
+        counts = self._query(
+            "SELECT date, category, error_code, count FROM error_codes ORDER BY date, category, error_code")
+        counts['error_code'] = counts['error_code'].astype('Int64')
+        return counts
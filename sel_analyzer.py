@@ -0,0 +1,253 @@
+# sel_analyzer.py
+"""
+server_health_full.sh 項目 12 (BMC / SEL) 的 SEL 分類器。
+
+一次載入 severity map (substr/sensor/exact/regex/noise 條目預先編譯), 單次掃描 ipmitool sel elist 的輸出,
+分類規則與原本的 severity_from_rules / 內建關鍵字 / sel_is_noise 相同。
+寫出與原本相同格式的事件明細 JSON (與 top sensors JSON), 並以一個 JSON 輸出
+CRIT/WARN/INFO/NOISE 計數、top sensors、CRIT/WARN 事件與最後一筆 CRIT/WARN 的 epoch, 供 script 讀取。
+
+    python3 sel_analyzer.py logs/host_sel_detail.log --map sel_map.txt --days 30 --top 8 \\
+        --events-json logs/host_sel_events.json
+
+map 每行為 '<LEVEL> [substr:|sensor:|exact:|regex:/.../|noise:]<pattern>', 由上而下第一個符合的條目決定等級;
+substr/sensor 與原本的 [[ == *pat* ]] 相同, pattern 中的 * ? [..] 為萬用字元。
+"""
+import argparse
+import fnmatch
+import json
+import re
+import sys
+import time
+
+DEFAULT_TOP = 8
+
+# 未符合 map 時的內建關鍵字 (與原本的 bash 正規表示式相同, 比對小寫的 event)
+BUILTIN_RULES = [
+    ('WARN', re.compile(r'predictive failure')),
+    ('CRIT', re.compile(r'uncorrect|fatal|thermal trip|overheat|ac lost|power down|voltage failure|fan failure'
+                        r'|cpu failure')),
+    ('WARN', re.compile(r'fail|failure|degraded|ecc|correct|threshold|redundancy lost')),
+]
+# sel_is_noise: 內建規則判為 INFO 的這些事件視為雜訊
+NOISE_SUBSTRINGS = ('pef action', 'drive present', 'power button pressed', '001c4c')
+
+# grep -E 的 POSIX 字元類別與字詞邊界
+POSIX_CLASSES = {
+    '[:alpha:]': 'a-zA-Z', '[:digit:]': '0-9', '[:alnum:]': 'a-zA-Z0-9', '[:upper:]': 'A-Z', '[:lower:]': 'a-z',
+    '[:space:]': r'\s', '[:blank:]': r' \t', '[:xdigit:]': '0-9A-Fa-f', '[:punct:]': r'!-/:-@\[-`{-~',
+}
+GLOB_CHARS = re.compile(r'[*?\[]')
+
+def ere_to_python(pattern):
+    for posix, python in POSIX_CLASSES.items():
+        pattern = pattern.replace(posix, python)
+    return pattern.replace(r'\<', r'\b').replace(r'\>', r'\b')
+
+def contains_matcher(pattern):
+    """[[ "$text_l" == *$(pattern_l)* ]]: 沒有萬用字元時為子字串比對"""
+    pattern = pattern.lower()
+    if not GLOB_CHARS.search(pattern):
+        return lambda text: pattern in text
+    regex = re.compile(fnmatch.translate(f"*{pattern}*"), re.DOTALL)
+    return lambda text: regex.match(text) is not None
+
+def parse_map_line(line):
+    """map 的一行轉為 (等級, 類型, pattern); 註解與空行回傳 None"""
+    if not line or line.startswith('#'):
+        return None
+    fields = line.split()
+    level = fields[0].upper() if fields else ''
+    # 與 cut -d' ' -f2- 相同: 沒有空白時整行都是 pattern
+    rest = line.split(' ', 1)[1] if ' ' in line else line
+    if not rest:
+        return None
+    for prefix, kind in (('substr:', 'substr'), ('sensor:', 'sensor'), ('exact:', 'exact')):
+        if rest.startswith(prefix):
+            return level, kind, rest[len(prefix):]
+    if rest.startswith('regex:/'):
+        pattern = rest[len('regex:/'):]
+        return level, 'regex', pattern[:-1] if pattern.endswith('/') else pattern
+    if rest.startswith('noise:'):
+        return 'NOISE', 'substr', rest[len('noise:'):]
+    return level, 'substr', rest
+
+def load_severity_map(path):
+    """回傳 [(等級, 比對函式(sensor_l, event, event_l))], 依檔案順序"""
+    rules = []
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            entry = parse_map_line(line.rstrip('\n'))
+            if entry is None:
+                continue
+            level, kind, pattern = entry
+            if kind == 'substr':
+                match = contains_matcher(pattern)
+                rules.append((level, lambda sensor_l, event, event_l, match=match: match(event_l)))
+            elif kind == 'sensor':
+                match = contains_matcher(pattern)
+                rules.append((level, lambda sensor_l, event, event_l, match=match: match(sensor_l)))
+            elif kind == 'exact':
+                exact = pattern.lower()
+                rules.append((level, lambda sensor_l, event, event_l, exact=exact: event_l == exact))
+            else:
+                try:
+                    regex = re.compile(ere_to_python(pattern), re.IGNORECASE)
+                except re.error as e:
+                    # grep -E 無法編譯時不會符合
+                    print(f"[SEL] 無效的 regex 條目 '{pattern}': {e}", file=sys.stderr)
+                    continue
+                rules.append((level, lambda sensor_l, event, event_l, regex=regex: regex.search(event) is not None))
+    return rules
+
+def classify(rules, sensor, event):
+    """map 第一個符合的條目; 否則依內建關鍵字, 內建規則判為 INFO 的雜訊事件為 NOISE"""
+    sensor_l, event_l = sensor.lower(), event.lower()
+    for level, match in rules:
+        if match(sensor_l, event, event_l):
+            return level
+    for level, regex in BUILTIN_RULES:
+        if regex.search(event_l):
+            return level
+    if any(noise in event_l for noise in NOISE_SUBSTRINGS):
+        return 'NOISE'
+    return 'INFO'
+
+# normalize_datetime 接受的格式與日期欄位的順序
+DATE_FORMATS = [
+    (re.compile(r'([0-9]{4})-([0-9]{2})-([0-9]{2})\s+([0-9]{2}:[0-9]{2}:[0-9]{2})'), 'ymd'),
+    (re.compile(r'([0-9]{2})-([0-9]{2})-([0-9]{4})\s+([0-9]{2}:[0-9]{2}:[0-9]{2})'), 'mdy'),
+    (re.compile(r'([0-9]{2})/([0-9]{2})/([0-9]{4})\s+([0-9]{2}:[0-9]{2}:[0-9]{2})'), 'mdy'),
+    (re.compile(r'([0-9]{2})/([0-9]{2})/([0-9]{2})\s+([0-9]{2}:[0-9]{2}:[0-9]{2})'), 'mdyy'),
+]
+DATE_TIME_PREFIX = re.compile(r'(\S+)\s+([0-9]{2}:[0-9]{2}:[0-9]{2})')
+
+def normalize_datetime(text):
+    """與 script 的 normalize_datetime 相同, 回傳 'YYYY-mm-dd HH:MM:SS'; 無法辨識時為 None"""
+    text = re.sub(r'  +', ' ', re.sub(r'\sT\s', ' ', text.strip()).replace(',', ''))
+    for regex, order in DATE_FORMATS:
+        match = regex.fullmatch(text)
+        if match:
+            a, b, c, clock = match.groups()
+            year, month, day = (a, b, c) if order == 'ymd' else (c, a, b)
+            return f"{'20' if order == 'mdyy' else ''}{year}-{month}-{day} {clock}"
+    # 日期與時間之後還有其他內容時, 只取日期與時間
+    match = DATE_TIME_PREFIX.match(text)
+    if match and ' '.join(match.groups()) != text:
+        return normalize_datetime(' '.join(match.groups()))
+    return None
+
+def event_epoch(date, clock):
+    """SEL 的日期與時間 (本地時間) 轉為 epoch; 無法解析時為 None (與 dt_to_epoch_or_empty 相同)"""
+    normalized = normalize_datetime(f"{date} {clock}")
+    if normalized is None:
+        return None
+    try:
+        return int(time.mktime(time.strptime(normalized, '%Y-%m-%d %H:%M:%S')))
+    except (ValueError, OverflowError):
+        return None
+
+def split_sel_line(line):
+    """'id | date | time | sensor | event | direction [| ...]' 的前 6 欄 (去除前後空白); 不足 6 欄時為 None"""
+    if line.count('|') < 5:
+        return None
+    fields = line.split('|', 6)
+    return [field.strip(' ') for field in fields[:6]]
+
+def analyze(lines, rules, sel_days=0, now=None, noise_hide=False, top=DEFAULT_TOP):
+    """
+    單次掃描 SEL, 回傳 (事件列表, 結果)。
+    sel_days > 0 時, 早於 now - sel_days 天的 CRIT/WARN 事件不計入計數 (仍列於事件明細)。
+    """
+    now = int(time.time()) if now is None else now
+    cutoff = now - sel_days * 86400 if sel_days > 0 else 0
+    counts = {'crit': 0, 'warn': 0, 'info': 0, 'noise_raw': 0}
+    sensors = {}
+    events, crit_warn_events = [], []
+    last_warncrit_epoch = None
+
+    for raw in lines:
+        raw = raw.rstrip('\n')
+        fields = split_sel_line(raw) if raw else None
+        if fields is None:
+            continue
+        event_id, date, clock, sensor, event, direction = fields
+        if 'deasserted' in direction.lower() or not sensor or not event:
+            continue
+
+        severity = classify(rules, sensor, event)
+        if severity == 'NOISE':
+            counts['noise_raw'] += 1
+            if noise_hide:
+                continue
+            severity = 'INFO'
+
+        epoch = event_epoch(date, clock) if date or clock else None
+        if severity in ('CRIT', 'WARN') and epoch is not None:
+            last_warncrit_epoch = epoch if last_warncrit_epoch is None else max(last_warncrit_epoch, epoch)
+
+        if sel_days > 0 and epoch is not None and epoch < cutoff:
+            if severity not in ('CRIT', 'WARN'):
+                counts['info'] += 1
+        else:
+            counts[{'CRIT': 'crit', 'WARN': 'warn'}.get(severity, 'info')] += 1
+        sensors[sensor] = sensors.get(sensor, 0) + 1
+
+        datetime_iso = f"{date.replace('/', '-')}T{clock}"
+        events.append({'id': event_id, 'date': date, 'time': clock, 'datetime': datetime_iso, 'sensor': sensor,
+                       'event': event, 'severity': severity, 'level': severity, 'raw': raw})
+        if severity in ('CRIT', 'WARN'):
+            crit_warn_events.append({'id': event_id, 'datetime': datetime_iso, 'sensor': sensor, 'event': event,
+                                     'severity': severity, 'level': severity})
+
+    # 與 sort -rn 相同: 次數由多到少, 同次數時依 'count:sensor' 的位元組順序反向
+    ranked = sorted(sensors.items(), key=lambda item: (item[1], f"{item[1]}:{item[0]}".encode('utf-8')), reverse=True)
+    result = dict(counts, noise_hidden=int(noise_hide),
+                  top_sensors=[{'sensor': sensor, 'count': count} for sensor, count in ranked[:top]],
+                  last_warncrit_epoch=last_warncrit_epoch, crit_warn_events=crit_warn_events, events=len(events))
+    return events, result
+
+def write_json_array(path, items):
+    """與原本的 script 相同的排版: '[' 換行, 項目以逗號相接, 最後 ']' 換行"""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('[\n' + ','.join(json.dumps(item, ensure_ascii=False, separators=(',', ':')) for item in items) + ']\n')
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='SEL 事件分類 (server_health_full.sh 項目 12)。')
+    parser.add_argument('sel', nargs='?', default='-', help="ipmitool sel elist 的輸出文件 ('-' 為 stdin)")
+    parser.add_argument('--map', help='severity map 文件 (SEL_SEVERITY_MAP)')
+    parser.add_argument('--days', type=int, default=0, help='只計入最近 N 天的 CRIT/WARN (0 表示不限)')
+    parser.add_argument('--now', type=int, default=None, help='計算期間的基準時間 (epoch 秒); 預設為現在')
+    parser.add_argument('--noise-hide', action='store_true', help='不列出雜訊事件')
+    parser.add_argument('--top', type=int, default=DEFAULT_TOP, help='top sensors 的數量')
+    parser.add_argument('--events-json', help='寫出事件明細 JSON (最後一項為 summary)')
+    parser.add_argument('--top-json', help='寫出 top sensors JSON')
+    return parser
+
+def main():
+    args = build_parser().parse_args()
+    rules = []
+    if args.map:
+        try:
+            rules = load_severity_map(args.map)
+        except FileNotFoundError:
+            print(f"[SEL] severity map 檔案不存在: {args.map}", file=sys.stderr)
+        else:
+            print(f"[SEL] 載入自訂 map 條目數: {len(rules)}", file=sys.stderr)
+
+    if args.sel == '-':
+        events, result = analyze(sys.stdin, rules, args.days, args.now, args.noise_hide, args.top)
+    else:
+        with open(args.sel, 'r', encoding='utf-8', errors='replace') as f:
+            events, result = analyze(f, rules, args.days, args.now, args.noise_hide, args.top)
+
+    if args.events_json:
+        summary = {key: result[key] for key in ('crit', 'warn', 'info', 'noise_raw', 'noise_hidden')}
+        write_json_array(args.events_json, events + [{'summary': summary}])
+    if args.top_json:
+        write_json_array(args.top_json, result['top_sensors'])
+    print(json.dumps(result, ensure_ascii=False))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,336 @@
+# sensor_history.py
+"""
+server_health_full.sh 的 CPU 溫度 / 風扇轉速歷史 store (SQLite)。
+
+每次健檢只附加一筆樣本並刪除超過保留期間 (預設 90 天) 的樣本, 同時維護每個序列的每日彙總
+(筆數、總和、最大值); 90 天峰值與平均由每日彙總 (最多約 90 列) 計算, 不必重讀整份歷史。
+結果與原本以 jq 處理 cpu_history.json / fan_history.json 的方式相同, 並可匯出為相同格式的 JSON。
+
+    python3 sensor_history.py cpu logs/cpu/cpu_history.json --max 71 --avg 64.25 --ts '2025-10-06 10:55:18'
+    python3 sensor_history.py fan logs/fan/fan_history.json --entries '[{"name":"FAN1","rpm":5400}]' --ts ...
+    python3 sensor_history.py export cpu logs/cpu/cpu_history.json
+
+store 位於歷史 JSON 旁 (cpu_history.db); 第一次使用時匯入既有的 JSON 歷史。
+"""
+import argparse
+import calendar
+import json
+import os
+import sqlite3
+import sys
+import time
+
+TS_FORMAT = '%Y-%m-%d %H:%M:%S'
+DEFAULT_RETENTION_DAYS = 90
+# 風扇個別序列的前綴; overall 為該次所有風扇的平均轉速
+FAN_PREFIX = 'fan:'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+-- 每次健檢一筆樣本, data 為 {序列: 數值} 的 JSON
+CREATE TABLE IF NOT EXISTS samples (
+    id INTEGER PRIMARY KEY,
+    ts INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS samples_ts ON samples (ts);
+-- 每個序列的每日彙總 (UTC 日期)
+CREATE TABLE IF NOT EXISTS daily (
+    series TEXT, date TEXT, count INTEGER, total REAL, peak REAL,
+    PRIMARY KEY (series, date)
+);
+"""
+
+SCHEMA_VERSION = 1
+
+def to_num(value):
+    """數字或數字字串轉為數值, 其他回傳 None (同 jq 的 to_num)"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        try:
+            number = json.loads(value)
+        except ValueError:
+            return None
+        return number if isinstance(number, (int, float)) and not isinstance(number, bool) else None
+    return None
+
+def parse_ts(text):
+    """'YYYY-mm-dd HH:MM:SS' (UTC) → epoch 秒; 格式不符時為 None"""
+    try:
+        return calendar.timegm(time.strptime(text, TS_FORMAT))
+    except (TypeError, ValueError):
+        return None
+
+def format_ts(epoch):
+    return time.strftime(TS_FORMAT, time.gmtime(epoch))
+
+def day_of(epoch):
+    return time.strftime('%Y-%m-%d', time.gmtime(epoch))
+
+def plain(value):
+    """整數值以整數輸出, 與 jq 的數字格式一致"""
+    return int(value) if isinstance(value, float) and value.is_integer() else value
+
+class HistoryStore:
+    """只附加的時間序列 store; 樣本依時間過期, 每日彙總隨附加與過期增量更新"""
+
+    def __init__(self, path, retention_days=DEFAULT_RETENTION_DAYS):
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+        if self._meta().get('schema_version') != str(SCHEMA_VERSION):
+            self.conn.execute("DELETE FROM samples")
+            self.conn.execute("DELETE FROM daily")
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('schema_version', ?)",
+                              (str(SCHEMA_VERSION),))
+        self.retention = retention_days * 86400
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.conn.commit()
+        else:
+            self.conn.rollback()
+        self.conn.close()
+
+    def _meta(self):
+        return dict(self.conn.execute("SELECT key, value FROM meta"))
+
+    def empty(self):
+        return self.conn.execute("SELECT 1 FROM samples LIMIT 1").fetchone() is None
+
+    def append(self, ts, values):
+        """附加一筆樣本; values 中非數值的項目不計入彙總"""
+        values = {series: value for series, value in values.items() if value is not None}
+        self.conn.execute("INSERT INTO samples (ts, data) VALUES (?, ?)", (ts, json.dumps(values)))
+        self._fold_daily(ts, values)
+
+    def expire(self, now):
+        """刪除早於 now - 保留期間的樣本, 並以剩餘樣本重算受影響日期的彙總; 回傳刪除的筆數"""
+        cutoff = now - self.retention
+        expired_days = {day_of(ts) for (ts,) in self.conn.execute("SELECT ts FROM samples WHERE ts < ?", (cutoff,))}
+        if not expired_days:
+            return 0
+        deleted = self.conn.execute("DELETE FROM samples WHERE ts < ?", (cutoff,)).rowcount
+        for day in expired_days:
+            start = calendar.timegm(time.strptime(day, '%Y-%m-%d'))
+            self.conn.execute("DELETE FROM daily WHERE date = ?", (day,))
+            rows = self.conn.execute("SELECT ts, data FROM samples WHERE ts >= ? AND ts < ? ORDER BY id",
+                                     (start, start + 86400)).fetchall()
+            for ts, data in rows:
+                self._fold_daily(ts, json.loads(data))
+        return deleted
+
+    def _fold_daily(self, ts, values):
+        self.conn.executemany(
+            """INSERT INTO daily (series, date, count, total, peak) VALUES (?, ?, 1, ?, ?)
+               ON CONFLICT (series, date) DO UPDATE SET
+                   count = count + 1, total = total + excluded.total, peak = MAX(peak, excluded.peak)""",
+            [(series, day_of(ts), value, value) for series, value in values.items()])
+
+    def stats(self):
+        """{序列: (mean, peak)}, 涵蓋保留期間內的所有樣本"""
+        return {series: (total / count, peak) for series, count, total, peak in self.conn.execute(
+            "SELECT series, SUM(count), SUM(total), MAX(peak) FROM daily GROUP BY series ORDER BY series")}
+
+    def daily(self):
+        """{日期: {序列: (mean, peak)}}, 依日期排序"""
+        days = {}
+        for date, series, count, total, peak in self.conn.execute(
+                "SELECT date, series, count, total, peak FROM daily ORDER BY date, series"):
+            days.setdefault(date, {})[series] = (total / count, peak)
+        return days
+
+    def samples(self):
+        for ts, data in self.conn.execute("SELECT ts, data FROM samples ORDER BY id"):
+            yield ts, json.loads(data)
+
+# --- CPU: 每次健檢的最高溫 (max) 與平均溫度 (avg) ---
+
+def import_cpu_json(store, entries):
+    for entry in entries:
+        ts = parse_ts(entry.get('ts'))
+        if ts is not None:
+            store.append(ts, {'max': to_num(entry.get('max')), 'avg': to_num(entry.get('avg'))})
+
+def cpu_stats(store):
+    """(90 天最高溫的峰值, 90 天平均溫度的平均); 沒有資料時為 0"""
+    stats = store.stats()
+    return plain(stats['max'][1]) if 'max' in stats else 0, plain(stats['avg'][0]) if 'avg' in stats else 0
+
+def cpu_daily(store):
+    return [{'date': date, 'peak_max': plain(series['max'][1]) if 'max' in series else 0,
+             'avg_avg': plain(series['avg'][0]) if 'avg' in series else 0}
+            for date, series in store.daily().items()]
+
+def export_cpu(store):
+    return [{'ts': format_ts(ts), **{key: plain(values[key]) for key in ('max', 'avg') if key in values}}
+            for ts, values in store.samples()]
+
+# --- 風扇: 每次健檢所有風扇的平均轉速 (overall) 與各風扇轉速 ---
+
+def fan_values(entries):
+    """由 fan_eval 項目 [{name, rpm}, ...] 計算一筆樣本"""
+    rpms = [to_num(entry.get('rpm')) for entry in entries]
+    rpms = [rpm for rpm in rpms if rpm is not None]
+    values = {'overall': sum(rpms) / len(rpms) if rpms else 0}
+    for entry in entries:
+        if entry.get('name'):
+            values[FAN_PREFIX + entry['name']] = to_num(entry.get('rpm')) or 0
+    return values
+
+def import_fan_json(store, history):
+    """舊格式 {overall: [{ts, avg}], per_fan: {name: [{ts, rpm}]}}; 同一時間的紀錄合併為一筆樣本"""
+    samples = {}
+    def add(ts_text, series, value):
+        ts = parse_ts(ts_text)
+        if ts is None:
+            return
+        # 同一秒有多筆時依出現順序對應
+        index = 0
+        while series in samples.get((ts, index), {}):
+            index += 1
+        samples.setdefault((ts, index), {})[series] = value
+
+    for entry in history.get('overall', []):
+        add(entry.get('ts'), 'overall', to_num(entry.get('avg')))
+    for name, entries in history.get('per_fan', {}).items():
+        for entry in entries:
+            add(entry.get('ts'), FAN_PREFIX + name, to_num(entry.get('rpm')))
+    for (ts, _), values in sorted(samples.items()):
+        store.append(ts, values)
+
+def fan_stats(store, current=()):
+    """90 天統計; current (本次的風扇名稱) 即使已無保留期間內的樣本也會列出 (數值為 0)"""
+    stats = store.stats()
+    overall = stats.get('overall')
+    per_fan = {name: {'avg_90d': 0, 'peak_90d': 0} for name in current}
+    per_fan.update({series[len(FAN_PREFIX):]: {'avg_90d': plain(mean), 'peak_90d': plain(peak)}
+                    for series, (mean, peak) in stats.items() if series.startswith(FAN_PREFIX)})
+    return {
+        'per_fan': per_fan,
+        'overall': {'avg_rpm_90d': plain(overall[0]) if overall else 0,
+                    'peak_avg_rpm_90d': plain(overall[1]) if overall else 0},
+    }
+
+def fan_daily(store):
+    return [{'date': date, 'avg_rpm': plain(series['overall'][0]), 'peak_avg_rpm': plain(series['overall'][1])}
+            for date, series in store.daily().items() if 'overall' in series]
+
+def export_fan(store):
+    history = {'overall': [], 'per_fan': {}}
+    for ts, values in store.samples():
+        for series, value in values.items():
+            if series == 'overall':
+                history['overall'].append({'ts': format_ts(ts), 'avg': plain(value)})
+            elif series.startswith(FAN_PREFIX):
+                history['per_fan'].setdefault(series[len(FAN_PREFIX):], []).append(
+                    {'ts': format_ts(ts), 'rpm': plain(value)})
+    return history
+
+KINDS = {
+    'cpu': (import_cpu_json, cpu_daily, export_cpu),
+    'fan': (import_fan_json, fan_daily, export_fan),
+}
+
+def store_path(history_json):
+    return os.path.splitext(history_json)[0] + '.db'
+
+def write_json(path, data):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+        f.write('\n')
+    os.replace(tmp_path, path)
+
+def open_store(kind, history_json, retention_days):
+    """開啟 history_json 旁的 store; 新建時匯入既有的 JSON 歷史"""
+    os.makedirs(os.path.dirname(history_json) or '.', exist_ok=True)
+    store = HistoryStore(store_path(history_json), retention_days)
+    if store.empty() and os.path.exists(history_json):
+        try:
+            with open(history_json, 'r', encoding='utf-8') as f:
+                KINDS[kind][0](store, json.load(f))
+        except ValueError:
+            print(f"警告: 無法讀取 {history_json}，將從空的歷史開始。", file=sys.stderr)
+    return store
+
+def finish(kind, store, history_json, args):
+    """過期、寫出每日彙總與相容格式的 JSON (依參數)"""
+    store.expire(args.now)
+    _, daily, export = KINDS[kind]
+    if args.daily:
+        write_json(os.path.splitext(history_json)[0] + '_daily.json', daily(store))
+    if args.export:
+        write_json(history_json, export(store))
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='CPU 溫度 / 風扇轉速的歷史 store。')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    def common(sub):
+        sub.add_argument('history', help='歷史 JSON 路徑 (store 位於同目錄的 .db)')
+        sub.add_argument('--ts', help="樣本時間 (UTC, 'YYYY-mm-dd HH:MM:SS'); 預設為現在")
+        sub.add_argument('--now', type=int, default=None, help='計算過期的基準時間 (epoch 秒); 預設為現在')
+        sub.add_argument('--retention-days', type=int, default=DEFAULT_RETENTION_DAYS, help='樣本保留天數')
+        sub.add_argument('--daily', action='store_true', help='另外寫出 <history>_daily.json')
+        sub.add_argument('--export', action='store_true', default=True, help='同時以原本的格式寫出歷史 JSON (預設)')
+        sub.add_argument('--no-export', dest='export', action='store_false',
+                         help='不寫出歷史 JSON (store 失效時 server_health_full.sh 的 jq 實作會沿用舊的 JSON)')
+
+    cpu = subparsers.add_parser('cpu', help="附加一筆 CPU 溫度, 輸出 '90 天峰值|90 天平均'")
+    common(cpu)
+    cpu.add_argument('--max', required=True, help='本次最高溫度')
+    cpu.add_argument('--avg', required=True, help='本次平均溫度')
+
+    fan = subparsers.add_parser('fan', help='附加一筆風扇轉速, 輸出 90 天統計 JSON')
+    common(fan)
+    fan.add_argument('--entries', required=True, help='fan_eval 項目的 JSON 陣列 [{name, rpm}, ...]')
+
+    export = subparsers.add_parser('export', help='以原本的格式寫出歷史 JSON')
+    export.add_argument('kind', choices=sorted(KINDS))
+    export.add_argument('history', help='歷史 JSON 路徑')
+    export.add_argument('--retention-days', type=int, default=DEFAULT_RETENTION_DAYS, help='樣本保留天數')
+    return parser
+
+def main():
+    args = build_parser().parse_args()
+    if args.command == 'export':
+        with open_store(args.kind, args.history, args.retention_days) as store:
+            write_json(args.history, KINDS[args.kind][2](store))
+        return 0
+
+    now = int(time.time())
+    args.now = now if args.now is None else args.now
+    ts = parse_ts(args.ts) if args.ts else now
+    if ts is None:
+        print(f"錯誤: 無法解析時間 '{args.ts}'", file=sys.stderr)
+        return 1
+
+    with open_store(args.command, args.history, args.retention_days) as store:
+        if args.command == 'cpu':
+            store.append(ts, {'max': to_num(args.max), 'avg': to_num(args.avg)})
+            finish('cpu', store, args.history, args)
+            peak, mean = cpu_stats(store)
+            print(f"{peak}|{mean}")
+        else:
+            try:
+                entries = json.loads(args.entries)
+            except ValueError:
+                entries = []
+            values = fan_values(entries if isinstance(entries, list) else [])
+            store.append(ts, values)
+            finish('fan', store, args.history, args)
+            current = [series[len(FAN_PREFIX):] for series in values if series.startswith(FAN_PREFIX)]
+            print(json.dumps(fan_stats(store, current), ensure_ascii=False))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -121,6 +121,13 @@ FIO_BS="1M"
 
 OUTPUT_DIR="logs"
 OUTPUT_PREFIX=""
+# CPU/風扇歷史 store、SEL 分類與報告歷史索引的 helper (與本腳本同目錄)
+: "${SENSOR_HISTORY_PY:=$(dirname "$(readlink -f "${BASH_SOURCE[0]}")")/sensor_history.py}"
+: "${SEL_ANALYZER_PY:=$(dirname "$(readlink -f "${BASH_SOURCE[0]}")")/sel_analyzer.py}"
+: "${HEALTH_INDEX_PY:=$(dirname "$(readlink -f "${BASH_SOURCE[0]}")")/health_index.py}"
+: "${HEALTH_INDEX_DB:=}"
+: "${HISTORY_EXPORT_JSON:=1}"
+: "${JOURNAL_JSON_EXPORT:=0}"
 : "${LOG_DIR:=$OUTPUT_DIR}"
 MARKDOWN_OUTPUT=1
 CSV_OUTPUT=1
@@ -247,6 +254,8 @@ print_usage() {
     --legacy-json
     --json-out <file>
     --thresholds-json <file>
+    HEALTH_INDEX_DB=<path>   (環境變數，產生 JSON 後匯入 health_index.py 的歷史索引)
+    JOURNAL_JSON_EXPORT=1    (環境變數，另存 journalctl -o json 的 <base>.journal.jsonl 供 parse_journal.py --format json)
   顏色:
     --color=auto|always|never
     --no-color               (相容寫法，等於 --color=never)
@@ -326,10 +335,38 @@ sel_last_warn_crit_epoch() {
   [[ -n "$latest" ]] && printf '%s\n' "$latest"
 }
 
+# CPU/風扇歷史: 有 python3 時改用 sensor_history.py 的 SQLite store (<history>.db),
+# 每次只附加一筆並由每日彙總計算 90 天統計; 預設同時寫出原本格式的 JSON (HISTORY_EXPORT_JSON=0 關閉)。
+# 沒有 python3 時沿用以下 jq 實作 (每次重讀並改寫整份 JSON); 已有 .db 時 store 為準，
+# jq 只以 JSON 計算統計而不改寫，避免 JSON 與 store 分歧。
+sensor_history_available() {
+  [[ "${SENSOR_HISTORY_DISABLE:-0}" -ne 1 && -f "$SENSOR_HISTORY_PY" ]] && command -v python3 >/dev/null 2>&1
+}
+
+sensor_history_flags() {
+  # args: daily_flag (每行輸出一個參數，以 mapfile 讀入陣列)
+  [[ "${1:-0}" -eq 1 ]] && printf '%s\n' --daily
+  [[ "${HISTORY_EXPORT_JSON:-1}" -eq 1 ]] || printf '%s\n' --no-export
+}
+
+sensor_history_owns() {
+  # args: history_file；已有 sensor_history.py 的 store 時回傳 0
+  [[ -f "${1%.json}.db" ]]
+}
+
 cpu_history_upsert_and_stats() {
   # args: cur_max avg_temp timestamp iso8601 history_file
   local cur_max="$1" avg="$2" ts="$3" iso="$4" hist="$5"
   local dir; dir=$(dirname "$hist"); mkdir -p "$dir"
+  if sensor_history_available; then
+    local out flags=()
+    mapfile -t flags < <(sensor_history_flags "${CPU_DAILY_STATS:-0}")
+    if out=$(python3 "$SENSOR_HISTORY_PY" cpu "$hist" --max "$cur_max" --avg "$avg" --ts "$iso" "${flags[@]}"); then
+      printf '%s\n' "$out"
+      return
+    fi
+    echo "[WARN] sensor_history.py 失敗，改用 jq 處理 CPU 歷史" >&2
+  fi
   local entry; entry=$(jq -n --arg iso "$iso" --argjson max "$cur_max" --argjson avg "$avg" '{ts:$iso, max:$max, avg:$avg}')
   local now_epoch; now_epoch=$(date +%s)
   local cutoff=$(( now_epoch - 90*86400 ))
@@ -345,7 +382,7 @@ cpu_history_upsert_and_stats() {
     | map(select(((.ts | try (strptime("%Y-%m-%d %H:%M:%S") | mktime) catch 0)) >= $cutoff))
     '
   )
-  printf '%s\n' "$arr" > "$hist"
+  sensor_history_owns "$hist" || printf '%s\n' "$arr" > "$hist"
 
   local peak avg90
   peak=$(printf '%s' "$arr" | jq '
@@ -406,6 +443,15 @@ fan_history_upsert_and_stats() {
   # stdout: JSON {overall:{avg_rpm_90d, peak_avg_rpm_90d}, per_fan:{<name>:{avg_90d, peak_90d}}}
   local eval_json="$1" ts="$2" iso="$3" hist="$4"
   local dir; dir=$(dirname "$hist"); mkdir -p "$dir"
+  if sensor_history_available; then
+    local out flags=()
+    mapfile -t flags < <(sensor_history_flags "${FAN_DAILY_STATS:-0}")
+    if out=$(python3 "$SENSOR_HISTORY_PY" fan "$hist" --entries "$eval_json" --ts "$iso" "${flags[@]}"); then
+      printf '%s\n' "$out"
+      return
+    fi
+    echo "[WARN] sensor_history.py 失敗，改用 jq 處理風扇歷史" >&2
+  fi
 
   local this_avg
   this_avg=$(printf '%s' "$eval_json" | jq '
@@ -451,7 +497,7 @@ fan_history_upsert_and_stats() {
     ')
   done
 
-  printf '%s\n' "$H" > "$hist"
+  sensor_history_owns "$hist" || printf '%s\n' "$H" > "$hist"
 
   local overall_avg overall_peak
   overall_avg=$(printf '%s' "$H" | jq '
@@ -5268,49 +5314,41 @@ is_internal_noise(){
 SEL_CRIT=0 SEL_WARN=0 SEL_INFO=0 SEL_NOISE_RAW=0
 SEL_TOP_ARRAY=()          # top sensors
 SEL_CW_EVENTS_ARRAY=()    # 內嵌 CRIT/WARN
-check_bmc() {
-  local item="BMC.SEL"
-  echo -e "${C_BLUE}[12] BMC / SEL${C_RESET}"
-  # Quick verify: grep -A2 '^12 .*BMC/SEL' logs/*_health_*.md
 
-  if (( SKIP_BMC )); then
-    local skip_json
-    skip_json=$(jq -n --arg item "$item" '{status:"SKIP", item:$item, reason:"BMC skipped", evidence:{}}')
-    set_check_result 12 "$skip_json"
-    return
-  fi
-
-  ipmi_try mc info 2>/dev/null | egrep -i 'Firmware|Version' || true
-
-  local sel_raw
-  sel_raw=$(ipmi_try sel elist 2>/dev/null || ipmi_try sel list 2>/dev/null || echo "")
-  
-  local evidence
-  evidence=$(jq -n --arg sel_detail "$SEL_DETAIL_FILE" --arg sel_events "$SEL_EVENTS_JSON" \
-    '{sel_detail_log:$sel_detail, sel_events_json:$sel_events}')
+sel_analyzer_available() {
+  [[ "${SEL_ANALYZER_DISABLE:-0}" -ne 1 && -f "$SEL_ANALYZER_PY" ]] && command -v python3 >/dev/null 2>&1
+}
 
-  if [[ -z "$sel_raw" ]]; then
-    local warn_json
-    warn_json=$(jq -n --arg item "$item" --arg reason "無法取得 SEL" --argjson evidence "$evidence" \
-        '{status:"WARN", item:$item, reason:$reason, evidence:$evidence}')
-    set_check_result 12 "$warn_json"
-    return
+# 以 sel_analyzer.py 分類 SEL, 寫出事件明細 / top sensors JSON 並設定 SEL_* 計數與陣列
+sel_classify_python() {
+  local sel_raw="$1" result
+  local -a flags=(--days "${SEL_DAYS:-0}" --now "$(date +%s)" --top "$SEL_SHOW" --events-json "$SEL_EVENTS_JSON")
+  [[ -n "$SEL_SEVERITY_MAP" ]] && flags+=(--map "$SEL_SEVERITY_MAP")
+  (( SEL_NOISE_HIDE )) && flags+=(--noise-hide)
+  [[ -n "$SEL_TOP_JSON" ]] && flags+=(--top-json "$SEL_TOP_JSON")
+  if ! result=$(printf '%s\n' "$sel_raw" | python3 "$SEL_ANALYZER_PY" - "${flags[@]}"); then
+    echo "[WARN] sel_analyzer.py 失敗，改用 shell 逐筆分類 SEL" >&2
+    return 1
   fi
 
-  echo "$sel_raw" > "$SEL_DETAIL_FILE"
-  echo "[Info] SEL 詳細寫入: $SEL_DETAIL_FILE"
+  IFS=$'\t' read -r SEL_CRIT SEL_WARN SEL_INFO SEL_NOISE_RAW < <(jq -r '[.crit, .warn, .info, .noise_raw] | @tsv' <<< "$result")
+  mapfile -t SEL_TOP_ARRAY < <(jq -c '.top_sensors[]' <<< "$result")
+  local -a cw_events
+  mapfile -t cw_events < <(jq -c '.crit_warn_events[]' <<< "$result")
+  # 沒有事件時陣列為空; bash < 4.4 在 set -u 下展開空陣列會中止
+  SEL_CW_EVENTS_ARRAY+=(${cw_events[@]+"${cw_events[@]}"})
 
-  if echo "$sel_raw" | grep -qi 'no entries'; then
-    echo "[SEL] 空 (no entries)" >&2
-    echo '[]' > "$SEL_EVENTS_JSON"
-    SEL_CRIT=0; SEL_WARN=0; SEL_INFO=0; SEL_NOISE_RAW=0
-    local pass_json
-    pass_json=$(jq -n --arg item "$item" --arg reason "SEL 空 (no entries)" --argjson evidence "$evidence" \
-        '{status:"PASS", item:$item, reason:$reason, evidence:$evidence}')
-    set_check_result 12 "$pass_json"
-    return
-  fi
+  local top_str
+  top_str=$(jq -r '[.top_sensors[] | "\(.sensor):\(.count)"] | join(" ") | if . == "" then "無" else . end' <<< "$result")
+  echo "[SEL] CRIT=$SEL_CRIT WARN=$SEL_WARN INFO=$SEL_INFO (noise_hidden=$SEL_NOISE_HIDE noise_raw=$SEL_NOISE_RAW) (Top: $top_str)" >&2
+  echo "[SEL] 事件明細 JSON: $SEL_EVENTS_JSON" >&2
+  [[ -n "$SEL_TOP_JSON" ]] && echo "[SEL] Top sensors JSON: $SEL_TOP_JSON" >&2
+  return 0
+}
 
+# 逐筆以 severity_from_rules 分類 SEL (sel_analyzer.py 無法使用時)
+sel_classify_shell() {
+  local sel_raw="$1"
   load_severity_map
 
   local now_epoch sel_cutoff sel_days
@@ -5443,6 +5481,54 @@ check_bmc() {
     } > "$SEL_TOP_JSON"
     echo "[SEL] Top sensors JSON: $SEL_TOP_JSON" >&2
   fi
+}
+check_bmc() {
+  local item="BMC.SEL"
+  echo -e "${C_BLUE}[12] BMC / SEL${C_RESET}"
+  # Quick verify: grep -A2 '^12 .*BMC/SEL' logs/*_health_*.md
+
+  if (( SKIP_BMC )); then
+    local skip_json
+    skip_json=$(jq -n --arg item "$item" '{status:"SKIP", item:$item, reason:"BMC skipped", evidence:{}}')
+    set_check_result 12 "$skip_json"
+    return
+  fi
+
+  ipmi_try mc info 2>/dev/null | egrep -i 'Firmware|Version' || true
+
+  local sel_raw
+  sel_raw=$(ipmi_try sel elist 2>/dev/null || ipmi_try sel list 2>/dev/null || echo "")
+  
+  local evidence
+  evidence=$(jq -n --arg sel_detail "$SEL_DETAIL_FILE" --arg sel_events "$SEL_EVENTS_JSON" \
+    '{sel_detail_log:$sel_detail, sel_events_json:$sel_events}')
+
+  if [[ -z "$sel_raw" ]]; then
+    local warn_json
+    warn_json=$(jq -n --arg item "$item" --arg reason "無法取得 SEL" --argjson evidence "$evidence" \
+        '{status:"WARN", item:$item, reason:$reason, evidence:$evidence}')
+    set_check_result 12 "$warn_json"
+    return
+  fi
+
+  echo "$sel_raw" > "$SEL_DETAIL_FILE"
+  echo "[Info] SEL 詳細寫入: $SEL_DETAIL_FILE"
+
+  if echo "$sel_raw" | grep -qi 'no entries'; then
+    echo "[SEL] 空 (no entries)" >&2
+    echo '[]' > "$SEL_EVENTS_JSON"
+    SEL_CRIT=0; SEL_WARN=0; SEL_INFO=0; SEL_NOISE_RAW=0
+    local pass_json
+    pass_json=$(jq -n --arg item "$item" --arg reason "SEL 空 (no entries)" --argjson evidence "$evidence" \
+        '{status:"PASS", item:$item, reason:$reason, evidence:$evidence}')
+    set_check_result 12 "$pass_json"
+    return
+  fi
+
+  # 以 sel_analyzer.py 單次分類整份 SEL; 無法使用時改用逐筆的 shell 比對
+  if ! { sel_analyzer_available && sel_classify_python "$sel_raw"; }; then
+    sel_classify_shell "$sel_raw"
+  fi
 
   local sel_days_num="$SEL_DAYS"
   [[ "$sel_days_num" =~ ^[0-9]+$ ]] || sel_days_num=0
@@ -5819,6 +5905,11 @@ analyze_system_logs() {
 
   echo "[INFO] Saving full high-priority logs (p0-3) to ${output_file}..."
   sudo journalctl -p 0..3 --since "${days} days ago" -o short-iso > "$output_file"
+  # 結構化版本 (含 PRIORITY/_BOOT_ID/__CURSOR), 供 parse_journal.py --format json 使用; 預設關閉
+  # 副檔名用 .jsonl，避免被當成報告 JSON (health_index.py ingest 只讀 *.json)
+  if [[ "${JOURNAL_JSON_EXPORT:-0}" -eq 1 ]]; then
+    sudo journalctl -p 0..3 --since "${days} days ago" -o json > "${output_file%.*}.journal.jsonl"
+  fi
 
   echo -e "\n${C_BOLD}Top 20 Error-producing Processes (p3):${C_RESET}"
   sudo journalctl -p 3 --since "${days} days ago" -o short-unix | awk '{print $5}' | sed 's/://;s/\[.*//' | sort | uniq -c | sort -nr | head -n 20 | tee -a "$output_file"
@@ -6620,6 +6711,11 @@ build_master_json() {
 
 if (( JSON_OUTPUT )); then
   build_master_json
+  # 匯入歷史索引 (跨次執行的趨勢查詢: health_index.py table / timeline)
+  if [[ -n "$HEALTH_INDEX_DB" && -f "$HEALTH_INDEX_PY" ]] && command -v python3 >/dev/null 2>&1; then
+    python3 "$HEALTH_INDEX_PY" --db "$HEALTH_INDEX_DB" ingest "$JSON_OUT_FILE" \
+      || echo "[WARN] 無法將報告匯入歷史索引: $HEALTH_INDEX_DB" >&2
+  fi
 fi
 
 
@@ -0,0 +1,121 @@
+# synth_journal.py
+"""
+產生可重現的合成 journal 日誌 (journalctl -o short-iso 格式), 供效能測試使用。
+訊息組成仿照實際主機: kernel (fscrypt/megaraid_sas/CIFS/Xid/I/O error)、smartd、networkctl、sudo、
+fwupd、cron 等; 可設定行數、Boot 次數、重複爆量 (同一秒內連續相同訊息) 與雜訊行比例。
+相同參數與 seed 產生的內容完全相同。
+
+    python3 synth_journal.py --lines 1000000 --boots 5 --seed 1 -o synth_1m.log
+"""
+import argparse
+import random
+import sys
+from datetime import datetime, timedelta
+
+def hex_id(rng, n):
+    return ''.join(rng.choice('0123456789abcdef') for _ in range(n))
+
+# (權重, unit, 是否有 pid, 產生訊息的函式)
+MESSAGE_MIX = [
+    (12, 'kernel', False, lambda rng: f"fscrypt (sda{rng.randint(1, 4)}, inode {rng.randint(1000, 999999)}): "
+                                      f"Error -22 ext4_bio_write_folio"),
+    (8, 'kernel', False, lambda rng: "megaraid_sas 0000:3b:00.0: FW in FAULT state Fault code:0x10000"),
+    (4, 'kernel', False, lambda rng: f"megaraid_sas 0000:3b:00.0: scanning for scsi{rng.randint(0, 3)}..."),
+    (10, 'kernel', False, lambda rng: f"CIFS: VFS: cifs_mount failed w/return code = {rng.choice((-95, -101, -101))}"),
+    (3, 'kernel', False, lambda rng: f"CIFS: VFS: \\\\10.0.{rng.randint(0, 9)}.{rng.randint(1, 254)} "
+                                     f"Send error in SessSetup = -13"),
+    (4, 'kernel', False, lambda rng: f"Xid {rng.choice((13, 31, 43, 79))} GPU has fallen off the bus"),
+    (4, 'kernel', False, lambda rng: f"blk_update_request: I/O error, dev sd{rng.choice('abcd')}, "
+                                     f"sector {rng.randint(0, 2 ** 31)} op 0x0:(READ)"),
+    (8, 'smartd', True, lambda rng: "Sending warning via /usr/bin/mail to root ..."),
+    (2, 'smartd', True, lambda rng: f"Device: /dev/sd{rng.choice('abcd')} [SAT], "
+                                    f"SMART Usage Attribute: 194 Temperature_Celsius changed from "
+                                    f"{rng.randint(30, 40)} to {rng.randint(30, 45)}"),
+    (6, 'networkctl', True, lambda rng: f"Interface \"veth{hex_id(rng, 7)}\" not found."),
+    (4, 'networkctl', True, lambda rng: rng.choice(("docker0 not found", f"br-{hex_id(rng, 12)} not found"))),
+    (6, 'sudo', True, lambda rng: f"pam_unix(sudo:auth): authentication failure; logname= uid={rng.choice((0, 1000, 1001))}"),
+    (5, 'sudo', True, lambda rng: f"   {rng.choice(('alice', 'bob'))} : {rng.randint(1, 3)} incorrect password attempts ; "
+                                  f"TTY=pts/{rng.randint(0, 9)}"),
+    (5, 'systemd', True, lambda rng: "Failed to start Refresh fwupd metadata and update motd."),
+    (8, 'cron', True, lambda rng: f"(root) CMD (run-parts /etc/cron.{rng.choice(('hourly', 'daily'))})"),
+    (6, 'sshd', True, lambda rng: f"Accepted publickey for admin from 172.23.{rng.randint(0, 15)}.{rng.randint(1, 254)} "
+                                  f"port {rng.randint(30000, 65000)} ssh2"),
+    (5, 'systemd', True, lambda rng: f"Started Session {rng.randint(1, 99999)} of user admin."),
+]
+
+# 無法解析的雜訊行 (空行、截斷的行等)
+NOISE_LINES = ['', '-- No entries --', 'Jul 01 00:00:00 truncated line', '   ']
+
+def generate(lines, boots=1, burst_rate=0.01, burst_max=30, noise_rate=0.002, seconds_per_line=5.0,
+             seed=0, host='jfcrh-strg', start='2025-07-01T00:00:00', tz='+0900'):
+    """
+    逐行產生日誌 (不含換行), 共 lines 行 (含 Boot 標記與雜訊行)。
+    boots > 1 時在各 Boot 之間插入 '-- Boot <id> --'; 每行以 burst_rate 的機率開始一段
+    2 ~ burst_max 行的重複爆量; 時間間隔為平均 seconds_per_line 秒的指數分布。
+    """
+    rng = random.Random(seed)
+    weights = [weight for weight, _, _, _ in MESSAGE_MIX]
+    boot_lines = {lines * i // boots for i in range(1, boots)}
+    ts = datetime.strptime(start, '%Y-%m-%dT%H:%M:%S')
+    emitted = 0
+    while emitted < lines:
+        if emitted in boot_lines:
+            yield f"-- Boot {hex_id(rng, 32)} --"
+            emitted += 1
+            continue
+        if rng.random() < noise_rate:
+            yield rng.choice(NOISE_LINES)
+            emitted += 1
+            continue
+
+        ts += timedelta(seconds=int(rng.expovariate(1 / seconds_per_line)))
+        _, unit, has_pid, make_message = rng.choices(MESSAGE_MIX, weights)[0]
+        prefix = f"{ts.strftime('%Y-%m-%dT%H:%M:%S')}{tz} {host} " + (f"{unit}[{rng.randint(100, 32767)}]" if has_pid else unit)
+        line = f"{prefix}: {make_message(rng)}"
+        repeat = rng.randint(2, burst_max) if rng.random() < burst_rate else 1
+        for i in range(min(repeat, lines - emitted)):
+            # 爆量不跨越 Boot 標記
+            if i and emitted in boot_lines:
+                break
+            yield line
+            emitted += 1
+
+def write_journal(path, lines, **options):
+    with open(path, 'w', encoding='utf-8') as f:
+        for line in generate(lines, **options):
+            f.write(line + '\n')
+
+def parse_size(text):
+    """10k / 1m / 10M / 2500 → 行數"""
+    text = text.strip().lower()
+    scale = {'k': 1000, 'm': 1000000}.get(text[-1:], 1)
+    return int(float(text[:-1] if scale > 1 else text) * scale)
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='產生可重現的合成 journal 日誌。')
+    parser.add_argument('--lines', type=parse_size, default=10000, help='行數, e.g., 10k, 1m')
+    parser.add_argument('--boots', type=int, default=1, help='Boot 次數')
+    parser.add_argument('--burst-rate', type=float, default=0.01, help='每行開始重複爆量的機率')
+    parser.add_argument('--burst-max', type=int, default=30, help='重複爆量的最大行數')
+    parser.add_argument('--noise-rate', type=float, default=0.002, help='無法解析的雜訊行比例')
+    parser.add_argument('--seconds-per-line', type=float, default=5.0, help='相鄰兩行的平均間隔秒數')
+    parser.add_argument('--seed', type=int, default=0, help='亂數種子')
+    parser.add_argument('--host', default='jfcrh-strg', help='主機名稱')
+    parser.add_argument('--start', default='2025-07-01T00:00:00', help='第一行的本地時間')
+    parser.add_argument('--tz', default='+0900', help='時區偏移')
+    parser.add_argument('-o', '--output', help='輸出文件 (預設為 stdout)')
+    return parser
+
+def main():
+    args = build_parser().parse_args()
+    options = dict(boots=args.boots, burst_rate=args.burst_rate, burst_max=args.burst_max,
+                   noise_rate=args.noise_rate, seconds_per_line=args.seconds_per_line, seed=args.seed,
+                   host=args.host, start=args.start, tz=args.tz)
+    if args.output:
+        write_journal(args.output, args.lines, **options)
+    else:
+        for line in generate(args.lines, **options):
+            sys.stdout.write(line + '\n')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+# template_miner.py
+"""
+Drain 式的線上日誌樣板 (template) 探勘。
+
+訊息以空白切成 token, 含數字的 token 視為變數; 依 token 數與前 depth - 2 個 token
+走訪固定深度的樹找到候選群組, 與群組樣板相似度 (相同 token 的比例) 達到 similarity
+即歸入該群組, 不同的位置改為 <*>; 否則建立新群組。群組 ID 依建立順序由 1 起算, 不會改變。
+"""
+import functools
+
+WILDCARD = '<*>'
+
+@functools.lru_cache(maxsize=65536)
+def tokenize(message):
+    """回傳 (原始 token, 遮罩後的 token); 含數字的 token 遮罩為 <*>"""
+    tokens = tuple(message.split())
+    masked = tuple(WILDCARD if any(c.isdigit() for c in token) else token for token in tokens)
+    return tokens, masked
+
+class TemplateMiner:
+    """
+    Drain 固定深度解析樹。
+    state() / restore() 保存與還原所有群組及其在樹中的路徑, 接續解析時的結果與完整解析相同。
+    """
+
+    def __init__(self, depth=4, similarity=0.4, max_children=100):
+        if depth < 3:
+            raise ValueError("depth 至少為 3")
+        self.depth = depth
+        self.similarity = similarity
+        self.max_children = max_children
+        # node 為 (子節點 dict, 群組 ID list); 第一層以 token 數為鍵
+        self.root = ({}, [])
+        # templates[id - 1] 為群組樣板 (token list), paths[id - 1] 為其在樹中的路徑
+        self.templates = []
+        self.paths = []
+
+    def settings(self):
+        return [self.depth, self.similarity, self.max_children]
+
+    def _search(self, masked):
+        """沿路徑尋找葉節點; 沒有對應的子節點時改走 <*>"""
+        children, _ = self.root
+        node = children.get(len(masked))
+        for token in masked[:self.depth - 2]:
+            if node is None:
+                return None
+            children = node[0]
+            node = children.get(token) or children.get(WILDCARD)
+        return node
+
+    def _route(self, masked):
+        """新群組在樹中的路徑; 子節點已達 max_children 時歸入 <*>"""
+        path = [len(masked)]
+        node = self.root[0].get(len(masked), ({}, []))
+        for token in masked[:self.depth - 2]:
+            children = node[0]
+            if token not in children:
+                if WILDCARD in children:
+                    if len(children) >= self.max_children:
+                        token = WILDCARD
+                elif len(children) + 1 >= self.max_children:
+                    token = WILDCARD
+            path.append(token)
+            node = children.get(token, ({}, []))
+        return path
+
+    def _insert(self, path, cluster_id):
+        node = self.root
+        for key in path:
+            node = node[0].setdefault(key, ({}, []))
+        node[1].append(cluster_id)
+
+    def _best_match(self, cluster_ids, masked):
+        """相似度最高的群組 (同分時取 <*> 較多者); 未達門檻時回傳 None"""
+        best, best_key = None, None
+        for cluster_id in cluster_ids:
+            template = self.templates[cluster_id - 1]
+            same = params = 0
+            for template_token, token in zip(template, masked):
+                if template_token == WILDCARD:
+                    params += 1
+                elif template_token == token:
+                    same += 1
+            key = (same / len(masked) if masked else 1.0, params)
+            if best_key is None or key > best_key:
+                best, best_key = cluster_id, key
+        if best_key is not None and best_key[0] >= self.similarity:
+            return best
+        return None
+
+    def add(self, message):
+        """將訊息歸入群組 (必要時更新樣板或建立新群組), 回傳 (template_id, 以空白連接的參數)"""
+        tokens, masked = tokenize(message)
+        node = self._search(masked)
+        cluster_id = self._best_match(node[1], masked) if node else None
+        if cluster_id is None:
+            self.templates.append(list(masked))
+            path = self._route(masked)
+            self.paths.append(path)
+            cluster_id = len(self.templates)
+            self._insert(path, cluster_id)
+        template = self.templates[cluster_id - 1]
+        for i, token in enumerate(masked):
+            if template[i] != token and template[i] != WILDCARD:
+                template[i] = WILDCARD
+        return cluster_id, ' '.join(token for token, t in zip(tokens, template) if t == WILDCARD)
+
+    def merge(self, templates):
+        """
+        依序將另一個 miner 的樣板 (templates[id - 1]) 當作訊息併入, 回傳各樣板在本 miner 中的 ID。
+        平行解析時各區段分別探勘, 再由主程序依日誌順序併入, ID 仍依首次出現的順序指定。
+        """
+        return [self.add(' '.join(template))[0] for template in templates]
+
+    def items(self):
+        """依 ID 排序的 (template_id, 樣板字串)"""
+        return [(i + 1, ' '.join(template)) for i, template in enumerate(self.templates)]
+
+    def state(self):
+        return {'settings': self.settings(), 'clusters': [[path, template] for path, template in zip(self.paths, self.templates)]}
+
+    def restore(self, state):
+        """由 state() 的內容重建解析樹; 設定不同時拋出 ValueError"""
+        if state['settings'] != self.settings():
+            raise ValueError("template miner 設定不同")
+        self.root = ({}, [])
+        self.templates, self.paths = [], []
+        for path, template in state['clusters']:
+            self.templates.append(list(template))
+            self.paths.append(path)
+            self._insert(path, len(self.templates))
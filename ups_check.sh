@@ -26,6 +26,8 @@ DURATION_WARN=500
 DURATION_CRIT=1500
 VERBOSE=0
 STRICT_PAIR=0
+SNMP_DEADLINE=20
+: "${UPS_POLL_PY:=$(dirname "$(readlink -f "${BASH_SOURCE[0]}")")/ups_poll.py}"
 
 # --- SNMP OIDs ---
 OID_MODEL="1.3.6.1.4.1.318.1.1.1.1.1.1.0"
@@ -58,6 +60,7 @@ Usage: $0 [options]
   --crit-batt <N>          CRIT battery level threshold (default: 50)
   --temp-warn-high <N>     WARN high temperature threshold (default: 45)
   --temp-crit-high <N>     CRIT high temperature threshold (default: 50)
+  --deadline <sec>         Overall SNMP polling deadline for all UPS units (default: 20)
   --help                   Show this help message.
 EOF
 }
@@ -67,6 +70,10 @@ snmp_get_value(){
   snmpget -v2c -c "$community" -t 3 -r 1 -Oqv "$ip" "$oid" 2>/dev/null || echo "SNMPERR"
 }
 
+ups_poll_available(){
+  [[ "${UPS_POLL_DISABLE:-0}" -ne 1 && -f "$UPS_POLL_PY" ]] && command -v python3 >/dev/null 2>&1
+}
+
 strip_quotes(){
   local s="$1"
   if [[ "$s" =~ ^\"(.*)\" ]]; then
@@ -97,6 +104,15 @@ parse_timeticks_to_seconds(){
 
 perform_ups_check() {
     [[ -f "$CONFIG_FILE" ]] || { echo "[ERR] Config file not found: $CONFIG_FILE" >&2; exit 1; }
+    # 以 ups_poll.py 同時查詢所有 UPS (每台一個 multi-OID GET); 失敗時改用 snmpget 逐一查詢
+    if ups_poll_available; then
+        local out
+        if out=$(python3 "$UPS_POLL_PY" poll --config "$CONFIG_FILE" --deadline "$SNMP_DEADLINE"); then
+            printf '%s\n' "$out"
+            return
+        fi
+        echo "[WARN] ups_poll.py 失敗，改用 snmpget 逐一查詢" >&2
+    fi
     local all_raw_logs=""
     while IFS='|' read -r IP COMMUNITY LABEL
  do
@@ -106,7 +122,7 @@ perform_ups_check() {
 
         if ! ping -c1 -W1 "$IP" >/dev/null 2>&1;
  then
-            all_raw_logs+="${NOW_TS} $LABEL($IP) STATUS=CRIT reason=PING_FAIL"$ '\n'
+            all_raw_logs+="${NOW_TS} $LABEL($IP) STATUS=CRIT reason=PING_FAIL"$'\n'
             continue
         fi
 
@@ -118,7 +134,7 @@ perform_ups_check() {
         RUNTIME_RAW_VAL=$(snmp_get_value "$IP" "$COMMUNITY" "$OID_BAT_RUNTIME")
 
         if [[ "$MODEL" == "SNMPERR" || "$BAT_CAP" == "SNMPERR" ]]; then
-            all_raw_logs+="${NOW_TS} $LABEL($IP) STATUS=CRIT reason=SNMP_TIMEOUT"$ '\n'
+            all_raw_logs+="${NOW_TS} $LABEL($IP) STATUS=CRIT reason=SNMP_TIMEOUT"$'\n'
             continue
         fi
         
@@ -244,7 +260,7 @@ while [[ $# -gt 0 ]]; do
   case "$1" in
     --config) CONFIG_FILE="$2"; shift 2;; --verbose) VERBOSE=1; shift;; --min-runtime) MIN_RUNTIME_MIN="$2"; shift 2;; 
     --warn-batt) WARN_BATT="$2"; shift 2;; --crit-batt) CRIT_BATT="$2"; shift 2;; --temp-warn-high) TEMP_WARN_HIGH="$2"; shift 2;; 
-    --temp-crit-high) TEMP_CRIT_HIGH="$2"; shift 2;; --strict-pair) STRICT_PAIR=1; shift;; --help|-h) print_usage; exit 0;; 
+    --temp-crit-high) TEMP_CRIT_HIGH="$2"; shift 2;; --strict-pair) STRICT_PAIR=1; shift;; --deadline) SNMP_DEADLINE="$2"; shift 2;; --help|-h) print_usage; exit 0;; 
     *) echo "Unknown parameter: $1"; exit 1;; 
   esac
 done
@@ -0,0 +1,475 @@
+# ups_poll.py
+"""
+ups_check.sh 的並行 SNMP 輪詢器。
+
+每台 UPS 以一個 SNMPv2c GET 取得所有 OID (型號、序號、電量、溫度、輸出狀態、剩餘時間與 HP 變體),
+所有 UPS 以 asyncio 同時查詢 (共用一個 UDP socket, 以 request-id 對應回應); 每台的逾時與重試與原本的
+snmpget -t 3 -r 1 相同, 另有整體的截止時間, 單一台無回應不會拖慢其他 UPS。
+輸出與 ups_check.sh 的 perform_ups_check 相同格式的每台一行紀錄, 依設定檔順序排列。
+
+    python3 ups_poll.py poll --config config/ups_list.conf
+    python3 ups_poll.py simulate --snmprec jfcr-ups1.snmprec --port 1161
+
+SNMP 的 BER 編解碼只實作 GET 所需的部分, 不需要 net-snmp 或 pysnmp。simulate 是讀取 snmpsim 格式
+(.snmprec, 檔名即 community) 的簡易 agent, 供本機測試; 設定檔的 IP 欄可寫成 host:port。
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import sys
+import time
+from datetime import datetime
+
+# ups_check.sh 使用的 OID
+OIDS = {
+    'model': '1.3.6.1.4.1.318.1.1.1.1.1.1.0',
+    'serial': '1.3.6.1.4.1.318.1.1.1.1.2.3.0',
+    'bat_cap': '1.3.6.1.4.1.318.1.1.1.2.2.1.0',
+    'bat_temp': '1.3.6.1.4.1.318.1.1.1.2.2.2.0',
+    'bat_runtime': '1.3.6.1.4.1.318.1.1.1.2.2.3.0',
+    'hp_cap': '1.3.6.1.4.1.318.1.1.1.2.3.1.0',
+    'hp_temp': '1.3.6.1.4.1.318.1.1.1.2.3.2.0',
+    'hp_runtime': '1.3.6.1.4.1.318.1.1.1.2.3.3.0',
+    'apc_output_status': '1.3.6.1.4.1.318.1.1.1.4.2.1.0',
+    'std_runtime_min': '1.3.6.1.2.1.33.1.2.3.0',
+    'std_charge_pct': '1.3.6.1.2.1.33.1.2.4.0',
+    'std_output_source': '1.3.6.1.2.1.33.1.4.1.0',
+}
+
+DEFAULT_CONFIG = 'config/ups_list.conf'
+DEFAULT_PORT = 161
+DEFAULT_TIMEOUT = 3.0
+DEFAULT_RETRIES = 1
+DEFAULT_DEADLINE = 20.0
+
+# upsBasicOutputStatus / upsOutputSource 的值
+OUTPUT_STATES = {2: 'NONE', 3: 'ON_LINE', 4: 'BYPASS', 5: 'ON_BATTERY', 6: 'ON_BOOST', 7: 'ON_TRIM'}
+
+# --- BER 編解碼 (SNMPv2c GET 所需的部分) ---
+
+INTEGER, OCTET_STRING, NULL, OBJECT_ID, SEQUENCE = 0x02, 0x04, 0x05, 0x06, 0x30
+IP_ADDRESS, COUNTER32, GAUGE32, TIMETICKS, OPAQUE, COUNTER64 = 0x40, 0x41, 0x42, 0x43, 0x44, 0x46
+NO_SUCH_OBJECT, NO_SUCH_INSTANCE, END_OF_MIB_VIEW = 0x80, 0x81, 0x82
+GET_REQUEST, GET_RESPONSE = 0xA0, 0xA2
+SNMP_V2C = 1
+
+# 與 snmpget -Oqv 相同的例外值文字
+EXCEPTION_TEXT = {
+    NO_SUCH_OBJECT: 'No Such Object available on this agent at this OID',
+    NO_SUCH_INSTANCE: 'No Such Instance currently exists at this OID',
+    END_OF_MIB_VIEW: 'No more variables left in this MIB View',
+}
+UNSIGNED_TYPES = (COUNTER32, GAUGE32, TIMETICKS, COUNTER64)
+
+class SnmpError(ValueError):
+    pass
+
+def encode_length(length):
+    if length < 0x80:
+        return bytes([length])
+    body = length.to_bytes((length.bit_length() + 7) // 8, 'big')
+    return bytes([0x80 | len(body)]) + body
+
+def tlv(tag, payload):
+    return bytes([tag]) + encode_length(len(payload)) + payload
+
+def encode_integer(value, tag=INTEGER):
+    if tag in UNSIGNED_TYPES:
+        body = value.to_bytes(value.bit_length() // 8 + 1, 'big')
+    else:
+        body = value.to_bytes((value + (value < 0)).bit_length() // 8 + 1, 'big', signed=True)
+    return tlv(tag, body)
+
+def encode_oid(oid):
+    parts = [int(part) for part in oid.strip('.').split('.')]
+    if len(parts) < 2:
+        raise SnmpError(f"無效的 OID '{oid}'")
+    body = bytearray([parts[0] * 40 + parts[1]])
+    for part in parts[2:]:
+        chunk = [part & 0x7F]
+        part >>= 7
+        while part:
+            chunk.append(0x80 | (part & 0x7F))
+            part >>= 7
+        body.extend(reversed(chunk))
+    return tlv(OBJECT_ID, bytes(body))
+
+def encode_value(tag, value):
+    """(tag, 值) 編碼為 varbind 的值; 例外值與 NULL 沒有內容"""
+    if tag in (NULL, NO_SUCH_OBJECT, NO_SUCH_INSTANCE, END_OF_MIB_VIEW):
+        return tlv(tag, b'')
+    if tag == OBJECT_ID:
+        return encode_oid(value)
+    if tag in (OCTET_STRING, IP_ADDRESS, OPAQUE):
+        return tlv(tag, value if isinstance(value, bytes) else str(value).encode('utf-8'))
+    return encode_integer(int(value), tag)
+
+def encode_message(community, pdu_type, request_id, varbinds, error_status=0, error_index=0):
+    """varbinds 為 [(oid, tag, 值)]; GET 請求的值為 (NULL, None)"""
+    bindings = b''.join(tlv(SEQUENCE, encode_oid(oid) + encode_value(tag, value)) for oid, tag, value in varbinds)
+    pdu = tlv(pdu_type, encode_integer(request_id) + encode_integer(error_status) + encode_integer(error_index)
+              + tlv(SEQUENCE, bindings))
+    return tlv(SEQUENCE, encode_integer(SNMP_V2C) + tlv(OCTET_STRING, community.encode('utf-8')) + pdu)
+
+def decode_tlv(data, pos):
+    """回傳 (tag, 內容, 下一個位置)"""
+    if pos + 2 > len(data):
+        raise SnmpError('封包長度不足')
+    tag, length = data[pos], data[pos + 1]
+    pos += 2
+    if length & 0x80:
+        size = length & 0x7F
+        length = int.from_bytes(data[pos:pos + size], 'big')
+        pos += size
+    if pos + length > len(data):
+        raise SnmpError('封包長度不足')
+    return tag, data[pos:pos + length], pos + length
+
+def decode_sequence(data):
+    items, pos = [], 0
+    while pos < len(data):
+        tag, value, pos = decode_tlv(data, pos)
+        items.append((tag, value))
+    return items
+
+def decode_oid(body):
+    parts = [body[0] // 40, body[0] % 40] if body else []
+    value = 0
+    for byte in body[1:]:
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            parts.append(value)
+            value = 0
+    return '.'.join(map(str, parts))
+
+def decode_value(tag, body):
+    if tag == INTEGER:
+        return int.from_bytes(body, 'big', signed=True)
+    if tag in UNSIGNED_TYPES:
+        return int.from_bytes(body, 'big')
+    if tag == OBJECT_ID:
+        return decode_oid(body)
+    if tag == IP_ADDRESS:
+        return '.'.join(map(str, body))
+    if tag == OCTET_STRING:
+        return body.decode('utf-8', errors='replace')
+    if tag in EXCEPTION_TEXT:
+        return EXCEPTION_TEXT[tag]
+    return None if tag == NULL else body
+
+def decode_message(data):
+    """回傳 (community, pdu 類型, request-id, error-status, [(oid, tag, 值)])"""
+    tag, message, _ = decode_tlv(data, 0)
+    if tag != SEQUENCE:
+        raise SnmpError('不是 SNMP 訊息')
+    fields = decode_sequence(message)
+    if len(fields) != 3 or decode_value(*fields[0]) != SNMP_V2C:
+        raise SnmpError('只支援 SNMPv2c')
+    community = fields[1][1].decode('utf-8', errors='replace')
+    pdu_type, pdu = fields[2]
+    request_id, error_status, _, (_, bindings) = decode_sequence(pdu)
+    varbinds = []
+    for _, binding in decode_sequence(bindings):
+        (_, oid), (value_tag, value) = decode_sequence(binding)
+        varbinds.append((decode_oid(oid), value_tag, decode_value(value_tag, value)))
+    return community, pdu_type, decode_value(*request_id), decode_value(*error_status), varbinds
+
+# --- 非同步 SNMP client ---
+
+class SnmpClient(asyncio.DatagramProtocol):
+    """所有 UPS 共用的 UDP socket; 回應以 request-id 交給等待中的請求"""
+
+    def __init__(self):
+        self.transport = None
+        self.pending = {}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        try:
+            _, pdu_type, request_id, error_status, varbinds = decode_message(data)
+        except (SnmpError, ValueError):
+            return
+        future = self.pending.get(request_id)
+        if pdu_type == GET_RESPONSE and future is not None and not future.done():
+            future.set_result((error_status, varbinds))
+
+    def error_received(self, exc):
+        # ICMP port unreachable 等錯誤無法對應到請求, 由逾時處理
+        pass
+
+    async def get(self, addr, community, oids, timeout, retries):
+        """一次 GET 取得所有 oids, 回傳 {oid: 值}; 重試後仍無回應時回傳 None"""
+        request_id = random.randint(1, 2 ** 31 - 1)
+        while request_id in self.pending:
+            request_id = random.randint(1, 2 ** 31 - 1)
+        message = encode_message(community, GET_REQUEST, request_id, [(oid, NULL, None) for oid in oids])
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        try:
+            # 重試時沿用同一個 request-id, 較晚抵達的前一次回應也會被接受
+            for _ in range(retries + 1):
+                self.transport.sendto(message, addr)
+                try:
+                    error_status, varbinds = await asyncio.wait_for(asyncio.shield(future), timeout)
+                except asyncio.TimeoutError:
+                    continue
+                if error_status:
+                    return None
+                return {oid: value for oid, _, value in varbinds}
+            return None
+        finally:
+            del self.pending[request_id]
+
+# --- UPS 欄位 (與 ups_check.sh 的判斷相同) ---
+
+def number(value, default):
+    """與 [[ "$v" =~ ^[0-9]+$ ]] || v=default 相同"""
+    if isinstance(value, int) and value >= 0:
+        return value
+    if isinstance(value, str) and value.isascii() and value.isdigit():
+        return int(value)
+    return default
+
+def timeticks_seconds(value):
+    """TimeTicks (1/100 秒) 轉為秒; 無法解析時為 0"""
+    return number(value, 0) // 100
+
+def ups_fields(values):
+    """由 {欄位: 值} 算出 ups_check.sh 紀錄中的欄位; values 中的 None 表示查詢失敗"""
+    bat_cap = number(values['bat_cap'], -1)
+    bat_temp = number(values['bat_temp'], -99)
+    apc_out = number(values['apc_output_status'], 0)
+    std_out = number(values['std_output_source'], 0)
+    std_runtime_min = number(values['std_runtime_min'], 0)
+    std_charge_pct = number(values['std_charge_pct'], 0)
+    if bat_cap < 0 and std_charge_pct > 0:
+        bat_cap = std_charge_pct
+
+    hp_cap = number(values['hp_cap'], 0)
+    hp_temp = number(values['hp_temp'], 0)
+    hp_runtime = number(values['hp_runtime'], 0)
+    if bat_cap < 0 and hp_cap > 0:
+        bat_cap = hp_cap // 10
+    if bat_temp < 0 and hp_temp > 0:
+        bat_temp = hp_temp // 10
+
+    run_sec = timeticks_seconds(values['bat_runtime'])
+    if run_sec == 0 and hp_runtime > 0:
+        run_sec = hp_runtime
+    if run_sec == 0 and std_runtime_min > 0:
+        run_sec = std_runtime_min * 60
+
+    raw_src, out_sel = 'APC', apc_out
+    if apc_out == 0 or apc_out > 150:
+        raw_src, out_sel = 'STD', std_out
+    output_state = OUTPUT_STATES.get(out_sel, f"UNKNOWN_{out_sel}")
+
+    if run_sec == 0 and bat_cap >= 90 and (output_state in ('ON_LINE', 'BYPASS') or output_state.startswith('UNKNOWN_')):
+        run_sec = -1
+
+    return {
+        'model': values['model'] or '',
+        'serial': values['serial'] if values['serial'] is not None else 'SNMPERR',
+        'battery_pct': bat_cap,
+        'temp_c': bat_temp,
+        'runtime_sec': run_sec,
+        'runtime_min': f"{run_sec / 60:.2f}" if run_sec >= 0 else 'N/A',
+        'output_state': output_state,
+        'output_raw_src': raw_src,
+    }
+
+def format_record(result):
+    """與 perform_ups_check 相同格式的一行紀錄"""
+    head = f"{result['ts']} {result['label']}({result['ip']}) STATUS={result['status']}"
+    if result['status'] != 'OK':
+        return f"{head} reason={result['reason']}"
+    return (f"{head} model=\"{result['model']}\" serial=\"{result['serial']}\" "
+            f"battery_pct={result['battery_pct']} temp_c={result['temp_c']} runtime_sec={result['runtime_sec']} "
+            f"runtime_min={result['runtime_min']} output_state={result['output_state']} "
+            f"output_raw_src={result['output_raw_src']} duration_ms={result['duration_ms']}")
+
+# --- 輪詢 ---
+
+def read_devices(path):
+    """IP|COMMUNITY|LABEL; 跳過空白與 # 開頭的行。IP 可寫成 host:port"""
+    devices = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            ip, community, label = (line.rstrip('\n').split('|', 2) + ['', ''])[:3]
+            if not ip or ip.startswith('#'):
+                continue
+            devices.append({'ip': ip, 'community': community, 'label': label})
+    return devices
+
+def split_host_port(ip, default_port):
+    host, sep, port = ip.rpartition(':')
+    if sep and port.isdigit() and ':' not in host:
+        return host, int(port)
+    return ip, default_port
+
+async def ping(host):
+    """ping -c1 -W1; 沒有 ping 指令時視為可連線"""
+    try:
+        process = await asyncio.create_subprocess_exec(
+            'ping', '-c1', '-W1', host, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+    except FileNotFoundError:
+        return True
+    return await process.wait() == 0
+
+async def poll_device(client, device, result, args):
+    """查詢一台 UPS, 結果寫入 result (截止時間到時仍保留已填入的欄位)"""
+    loop = asyncio.get_running_loop()
+    host, port = split_host_port(device['ip'], args.port)
+    try:
+        addr = (await loop.getaddrinfo(host, port, family=socket.AF_INET, type=socket.SOCK_DGRAM))[0][4]
+    except (OSError, ValueError):
+        result.update(status='CRIT', reason='PING_FAIL')
+        return
+    names = list(OIDS)
+    # ping 與 SNMP 查詢同時進行; ping 失敗時與原本相同回報 PING_FAIL
+    reachable, response = await asyncio.gather(
+        ping(host) if args.ping else asyncio.sleep(0, True),
+        client.get(addr, device['community'], [OIDS[name] for name in names], args.timeout, args.retries))
+    if not reachable:
+        result.update(status='CRIT', reason='PING_FAIL')
+        return
+    values = {name: (response or {}).get(OIDS[name]) for name in names}
+    if values['model'] is None or values['bat_cap'] is None:
+        result.update(status='CRIT', reason='SNMP_TIMEOUT')
+        return
+    result.update(ups_fields(values), status='OK',
+                  duration_ms=int((time.perf_counter() - result['started']) * 1000))
+
+async def poll_all(devices, args):
+    """同時查詢所有 UPS, 依設定檔順序回傳結果; 超過 args.deadline 秒仍未完成的 UPS 回報 DEADLINE"""
+    loop = asyncio.get_running_loop()
+    transport, client = await loop.create_datagram_endpoint(SnmpClient, family=socket.AF_INET)
+    results = []
+    try:
+        tasks = []
+        for device in devices:
+            result = {'ts': datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'label': device['label'],
+                      'ip': device['ip'], 'started': time.perf_counter(), 'status': None}
+            results.append(result)
+            tasks.append(asyncio.ensure_future(poll_device(client, device, result, args)))
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=args.deadline)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+    finally:
+        transport.close()
+    for result in results:
+        if result['status'] is None:
+            result.update(status='CRIT', reason='DEADLINE')
+        del result['started']
+    return results
+
+# --- 本機測試用的 agent ---
+
+def read_snmprec(path):
+    """snmpsim 的 .snmprec: 每行 OID|TAG|VALUE, TAG 為十進位型別代碼, 加 x 表示值為十六進位"""
+    records = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if not line or line.startswith('#'):
+                continue
+            oid, tag, value = line.split('|', 2)
+            hex_value = tag.endswith('x')
+            tag = int(tag.rstrip('x'))
+            if hex_value:
+                value = bytes.fromhex(value)
+            elif tag not in (OCTET_STRING, OBJECT_ID, IP_ADDRESS, OPAQUE):
+                value = int(value)
+            if tag == IP_ADDRESS and not hex_value:
+                value = bytes(int(part) for part in value.split('.'))
+            records[oid.strip('.')] = (tag, value)
+    return records
+
+class SimulatedAgent(asyncio.DatagramProtocol):
+    """依 community 選擇 .snmprec 回應 GET; community 不符的請求不回應 (與實際的 agent 相同)"""
+
+    def __init__(self, agents, delay=0.0):
+        self.agents = agents
+        self.delay = delay
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        try:
+            community, pdu_type, request_id, _, varbinds = decode_message(data)
+        except (SnmpError, ValueError):
+            return
+        records = self.agents.get(community)
+        if records is None or pdu_type != GET_REQUEST:
+            return
+        response = encode_message(community, GET_RESPONSE, request_id,
+                                  [(oid, *records.get(oid, (NO_SUCH_OBJECT, None))) for oid, _, _ in varbinds])
+        if self.delay:
+            asyncio.get_running_loop().call_later(self.delay, self.transport.sendto, response, addr)
+        else:
+            self.transport.sendto(response, addr)
+
+async def simulate(args):
+    agents = {os.path.splitext(os.path.basename(path))[0]: read_snmprec(path) for path in args.snmprec}
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: SimulatedAgent(agents, args.delay), local_addr=(args.host, args.port))
+    print(f"模擬 agent 監聽於 {args.host}:{args.port} (community: {', '.join(agents)})", file=sys.stderr)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        transport.close()
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='ups_check.sh 的並行 SNMP 輪詢器。')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    poll = subparsers.add_parser('poll', help='查詢設定檔中的所有 UPS, 輸出 ups_check.sh 格式的紀錄')
+    poll.add_argument('--config', default=DEFAULT_CONFIG, help='UPS 清單 (IP|COMMUNITY|LABEL)')
+    poll.add_argument('--port', type=int, default=DEFAULT_PORT, help='SNMP port (IP 欄未指定時)')
+    poll.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, help='每次請求的逾時秒數')
+    poll.add_argument('--retries', type=int, default=DEFAULT_RETRIES, help='逾時後的重試次數')
+    poll.add_argument('--deadline', type=float, default=DEFAULT_DEADLINE, help='所有 UPS 的整體截止秒數')
+    poll.add_argument('--no-ping', dest='ping', action='store_false', help='不先以 ping 確認連線')
+    poll.add_argument('--json', action='store_true', help='以 JSON 陣列輸出各 UPS 的欄位')
+
+    sim = subparsers.add_parser('simulate', help='以 .snmprec 檔回應 GET 的本機測試 agent')
+    sim.add_argument('--snmprec', nargs='+', required=True, help='snmpsim 格式的資料檔 (檔名即 community)')
+    sim.add_argument('--host', default='127.0.0.1', help='監聽位址')
+    sim.add_argument('--port', type=int, default=1161, help='監聽 port')
+    sim.add_argument('--delay', type=float, default=0.0, help='延遲回應的秒數 (模擬緩慢的 UPS)')
+    return parser
+
+def main():
+    args = build_parser().parse_args()
+    if args.command == 'simulate':
+        try:
+            asyncio.run(simulate(args))
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    try:
+        devices = read_devices(args.config)
+    except FileNotFoundError:
+        print(f"[ERR] Config file not found: {args.config}", file=sys.stderr)
+        return 1
+    results = asyncio.run(poll_all(devices, args))
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        for result in results:
+            print(format_record(result))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())